@@ -1,5 +1,6 @@
 import logging
 import random
+import hashlib
 import re
 from django.apps import apps
 import time
@@ -19,6 +20,7 @@ validators = {}
 taggers = {}
 token_set = set()
 repetition_word_set = set()
+lexicon_version = None
 compile_patterns = lambda patterns: [(re.compile(pattern), repl) for pattern, repl in patterns]
 typographies = r'&*@‱\\/•^†‡⹋°〃=※×#÷%‰¶§‴~_\|‖¦٪'
 punctuations = r'\.:!،؛?؟»\]\)\}«\[\(\{\'\"…¡¿'
@@ -26,9 +28,15 @@ num_punctuations = r':!،؛?؟»\]\)\}«\[\(\{\'\"…¡¿'
 numbers = r'۰۱۲۳۴۵۶۷۸۹'
 persians = 'اآب‌پتثجچحخدذرزژسشصضطظعغفقکگلمنوهی'
 has_persian_character_pattern = re.compile(rf"([{persians}{numbers}])")
-link = r'((https?|ftp):\/\/)?(?<!@)([wW]{3}\.)?(([a-zA-Z۰-۹0-9-]+)(\.([a-zA-Z۰-۹0-9]){2,})+([-\w@:%_\+\/~#?&=]+)?)'
+###############################################################################
+# الگوهای link و email در متن‌های طولانی و ساختگی نباید زمان زیادی بگیرند.
+# در الگوی قبلی، حروف آخرین بخش دامنه هم با «\.([a-zA-Z۰-۹0-9]){2,}» و هم با مسیر پیوند جور می‌شدند و برای هر مکان شروع، زمان بررسی با مجذور طول متن زیاد می‌شد.
+# حالا آخرین بخش دامنه فقط دو حرف اول را می‌گیرد و بقیه را به مسیر می‌دهد، پس هر رشته فقط یک جور تجزیه دارد و مجموعه پیوندهای پذیرفته‌شده همان است.
+# طول هر بخش هم مثل محدودیت‌های RFC محدود شده است تا بررسی از هر مکان شروع، زمان ثابتی بگیرد و زمان کل با طول متن خطی بماند.
+link = r'((https?|ftp):\/\/)?(?<!@)([wW]{3}\.)?(([a-zA-Z۰-۹0-9-]{1,63})(\.[a-zA-Z۰-۹0-9]{2,63}){0,126}\.[a-zA-Z۰-۹0-9]{2}[-\w@:%_\+\/~#?&=]{0,2048})'
 emojies = r'\U0001F600-\U0001F64F\U0001F300-\U0001F5FF\U0001F4CC\U0001F4CD'
-email = r'[a-zA-Z۰-۹0-9\._\+-]+@([a-zA-Z۰-۹0-9-]+\.)+[A-Za-z]{2,}'
+email = r'[a-zA-Z۰-۹0-9\._\+-]{1,64}@([a-zA-Z۰-۹0-9-]{1,63}\.){1,126}[A-Za-z]{2,63}'
+###############################################################################
 id = r'@[a-zA-Z_]+'
 num = r'[+-]?[\d۰-۹]+'
 numf = r'[+-]?[\d۰-۹,]+[\.٫,]{1}[\d۰-۹]+'
@@ -40,6 +48,27 @@ all_token_tags = dict()
 is_number_pattern = re.compile(rf"^({num})|(numf)$")
 
 
+###############################################################################
+# نشانه‌های بی‌نهایت (عدد، ایموجی، آیدی، لینک، ایمیل و هشتگ) را در یک بار خواندن متن پیدا می‌کنیم.
+# هر بازه شامل مکان شروع نشانه در متن و نوع آن است و برچسب‌زن بدون بررسی دوباره رگس‌ها برچسب آن را می‌گذارد.
+# ترتیب نوع‌ها همان ترتیب الگوهای RegexpTagger برچسب‌زن mohaverekhan-correction-tagger است.
+# نشانه‌هایی که ممکن است یکی از الگوهای قبل از این الگوها روی آن‌ها تطبیق پیدا کند (حروف فارسی، شروع با عدد، فقط علامت) نوع نمی‌گیرند.
+entity_tags = {'NUMBER': 'U', 'EMOJI': 'X', 'ID': 'S', 'LINK': 'K', 'EMAIL': 'M', 'TAG': 'G'}
+# نشانه بی‌نهایتی که از همین مکان شروع شود، بدون بررسی حرف قبل از آن
+entity_pattern = (
+    rf'(?:'
+        rf'(?=[+-]?[\d۰-۹])(?P<NUMBER>{num}|{numf})|'
+        rf'(?![^ \n]*[{persians}])(?![+\-\d۰-۹]|[{punctuations}{typographies}]+(?:[ \n]|$))'
+        rf'(?:(?P<EMOJI>[{emojies}]+)|(?P<ID>{id})|(?P<LINK>{link})|(?P<EMAIL>{email})|(?P<TAG>{tag}))'
+    rf')'
+    rf'(?=[ \n]|$)'
+)
+entity_span_pattern = re.compile(rf'(?<![^ \n]){entity_pattern}')
+
+def find_entity_spans(text_content):
+    return [(match.start(), match.lastgroup) for match in entity_span_pattern.finditer(text_content)]
+
+
 ###############################################################################
 # باید بررسی کنیم نشانه‌های مورد نظر در مجموعه داده موجود وجود دارد یا نه
 # ممکنه نشانه مورد نظر، یک نشانه بی‌نهایت باشد و یک نشانه بی‌نهایت برای ما معتبر هست.
@@ -58,9 +87,21 @@ def is_token_valid(token_content):
     
     return False
 
+
+###############################################################################
+# نسخه مجموعه نشانه‌ها از روی خود نشانه‌ها و برچسب‌هایشان ساخته می‌شود.
+# هر بار که مجموعه نشانه‌ها دوباره ساخته شود و تغییری کرده باشد، نسخه هم عوض می‌شود.
+def compute_lexicon_version(token_tags):
+    digest = hashlib.md5()
+    for token_content in sorted(token_tags):
+        digest.update(token_content.encode('utf-8'))
+        digest.update(' '.join(sorted(token_tags[token_content])).encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
         
 def cache_token_tags_dic():
-    global tag_set_token_tags, all_token_tags, repetition_word_set
+    global tag_set_token_tags, all_token_tags, repetition_word_set, lexicon_version
     temp_tag_set_token_tags = {}
     temp_all_token_tags = {}
     temp_repetition_word_set = set()
@@ -247,6 +288,8 @@ def cache_token_tags_dic():
     tag_set_token_tags = temp_tag_set_token_tags
     all_token_tags = temp_all_token_tags
     repetition_word_set = temp_repetition_word_set
+    lexicon_version = compute_lexicon_version(all_token_tags)
+    logger.info(f'> lexicon_version : {lexicon_version}')
 
 
     two_length_token_set = set()
@@ -315,4 +358,4 @@ def init():
     cache_normalizers()
     cache_taggers()
 
-    cache_token_tags_dic()
\ No newline at end of file
+    cache_token_tags_dic()
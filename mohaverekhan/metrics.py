@@ -0,0 +1,125 @@
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+
+###############################################################################
+# زمان اجرای هر مرحله از نرمالایزرها و برچسب‌زن‌ها در هیستوگرام‌هایی داخل همین پردازه نگه داشته می‌شود.
+# هر هیستوگرام با نام مدل و نام مرحله مشخص می‌شود و به صورت صدک‌ها نمایش داده می‌شود.
+# بازه‌های هیستوگرام لگاریتمی هستند، پس حافظه ثابتی دارند و خطای صدک‌ها نسبی و کمتر از ۱۰ درصد است.
+# مقدارهای شمارشی مثل اندازه دسته یا طول صف هم در همین هیستوگرام‌ها نگه داشته می‌شوند، ولی بدون واحد نمایش داده می‌شوند.
+min_seconds = 1e-6
+bucket_growth = 2 ** 0.25
+bucket_count = 120 # ۱ میکروثانیه تا حدود ۱۰ دقیقه
+percentiles = (50, 90, 95, 99)
+
+class Histogram:
+
+    def __init__(self, unit='seconds'):
+        self.unit = unit
+        self.buckets = [0] * bucket_count
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def get_bucket_index(seconds):
+        if seconds <= min_seconds:
+            return 0
+        index = int(math.log(seconds / min_seconds, bucket_growth)) + 1
+        return min(index, bucket_count - 1)
+
+    def record(self, seconds):
+        self.buckets[self.get_bucket_index(seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    # وسط هندسی بازه‌ای که صدک در آن افتاده را برمی‌گرداند.
+    def get_percentile(self, percentile):
+        if self.count == 0:
+            return None
+        rank = math.ceil(self.count * percentile / 100)
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank:
+                break
+        if index == 0:
+            seconds = min_seconds
+        else:
+            seconds = min_seconds * bucket_growth ** (index - 0.5)
+        return min(max(seconds, self.min), self.max)
+
+    def to_dict(self):
+        suffix, scale = ('_ms', 1000) if self.unit == 'seconds' else ('', 1)
+        histogram_dict = {
+            'count': self.count,
+            f'mean{suffix}': self.sum / self.count * scale if self.count else None,
+            f'min{suffix}': self.min * scale if self.count else None,
+            f'max{suffix}': self.max * scale if self.count else None,
+        }
+        for percentile in percentiles:
+            value = self.get_percentile(percentile)
+            histogram_dict[f'p{percentile}{suffix}'] = value * scale if value is not None else None
+        return histogram_dict
+
+
+histograms = {}
+lock = threading.Lock()
+# در پردازه‌های فرزند، زمان‌ها اینجا جمع می‌شوند تا به پردازه اصلی برگردانده شوند.
+recorded_samples = None
+
+def get_histogram(key, unit):
+    histogram = histograms.get(key, None)
+    if histogram is None:
+        histogram = histograms[key] = Histogram(unit)
+    return histogram
+
+def record(model_name, stage_name, seconds):
+    with lock:
+        get_histogram((model_name, stage_name), 'seconds').record(seconds)
+        if recorded_samples is not None:
+            recorded_samples.append((model_name, stage_name, seconds))
+
+def record_value(model_name, stage_name, value):
+    with lock:
+        get_histogram((model_name, stage_name), 'count').record(value)
+
+def record_samples(samples):
+    for model_name, stage_name, seconds in samples:
+        record(model_name, stage_name, seconds)
+
+def start_recording():
+    global recorded_samples
+    recorded_samples = []
+
+def stop_recording():
+    global recorded_samples
+    samples, recorded_samples = recorded_samples, None
+    return samples
+
+@contextmanager
+def timer(model_name, stage_name):
+    beg_ts = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(model_name, stage_name, time.perf_counter() - beg_ts)
+
+def get_stage_percentiles(model_name):
+    with lock:
+        return {
+            stage_name: histogram.to_dict()
+                for (histogram_model_name, stage_name), histogram in sorted(histograms.items())
+                    if histogram_model_name == model_name
+        }
+
+def reset(model_name=None):
+    with lock:
+        for key in list(histograms):
+            if model_name is None or key[0] == model_name:
+                del histograms[key]
@@ -66,6 +66,12 @@ class Word(models.Model):
     def __str__(self):
         return f'{self.content[:120]}{" ..." if len(self.content) > 120 else ""}'
 
+# جدول جفت‌های نرمال seq2seq از روی جفت‌های معتبر ساخته می‌شود.
+def invalidate_normal_lexicon():
+    seq2seq_normalizer = cache.normalizers.get('mohaverekhan-seq2seq-normalizer')
+    if seq2seq_normalizer is not None:
+        seq2seq_normalizer.normal_lexicon.invalidate()
+
 class WordNormal(models.Model):
     logger = logging.getLogger(__name__)
     created = models.DateTimeField(auto_now_add=True)
@@ -89,6 +95,8 @@ class WordNormal(models.Model):
     def save(self, *args, **kwargs):
         self.check_validation()        
         super(WordNormal, self).save(*args, **kwargs)
+        if self.is_valid:
+            invalidate_normal_lexicon()
     
     def __str__(self):
         return f'{self.content[:120]}{" ..." if len(self.content) > 120 else ""}'
@@ -147,6 +155,8 @@ class TextNormal(Text):
         self.check_validation()        
         self.check_normalizers_sequence()
         super(TextNormal, self).save(*args, **kwargs)
+        if self.is_valid:
+            invalidate_normal_lexicon()
 
 class TextTag(models.Model):
     logger = logging.getLogger(__name__)
@@ -459,6 +469,9 @@ class Normalizer(models.Model):
     model_details = UTF8JSONField(default=dict, blank=True) # contains model training details
     last_update = models.DateTimeField(auto_now=True)
 
+    # گزینه‌هایی که تابع normalize علاوه بر متن می‌پذیرد، به همراه نوع آن‌ها
+    normalize_options = {}
+
     class Meta:
         verbose_name = 'Normalizer'
         verbose_name_plural = 'Normalizers'
@@ -487,6 +500,9 @@ class Normalizer(models.Model):
     def train(self):
         pass
 
+    def get_normalize_details(self):
+        return {}
+
     def normalize(self, text):
         text_normal_content = text.content
         text_normal, created = TextNormal.objects.update_or_create(
@@ -507,6 +523,9 @@ class Tagger(models.Model):
     tag_set = models.ForeignKey(to=TagSet, on_delete=models.DO_NOTHING, related_name='taggers', related_query_name='tagger')
     last_update = models.DateTimeField(auto_now=True)
 
+    # گزینه‌هایی که تابع tag علاوه بر متن می‌پذیرد، به همراه نوع آن‌ها
+    tag_options = {}
+
     class Meta:
         verbose_name = 'Tagger'
         verbose_name_plural = 'Taggers'
@@ -526,6 +545,9 @@ class Tagger(models.Model):
     def train(self):
         pass
 
+    def get_tag_details(self):
+        return {}
+
     def tag(self, text):
         pass
 
@@ -1,7 +1,7 @@
 import time
 import logging
 from mohaverekhan.models import Normalizer
-from mohaverekhan import cache
+from mohaverekhan import cache, metrics
 
 class MohaverekhanBasicNormalizer(Normalizer):
 
@@ -98,15 +98,18 @@ class MohaverekhanBasicNormalizer(Normalizer):
         # self.logger.info(f'>>> mohaverekhan-basic-normalizer : \n{text_content}')
         text_content = text_content.strip(' ')
 
-        text_content = self.uniform_signs(text_content)
+        with metrics.timer(self.name, 'uniform_signs'):
+            text_content = self.uniform_signs(text_content)
         # self.logger.info(f'>> uniform_signs : \n{text_content}')
 
-        text_content = self.do_basic_patterns(text_content)
+        with metrics.timer(self.name, 'do_basic_patterns'):
+            text_content = self.do_basic_patterns(text_content)
         # self.logger.info(f'>> do_basic_patterns : \n{text_content}')
 
         text_content = text_content.strip(' ')
         
         end_ts = time.time()
+        metrics.record(self.name, 'normalize', end_ts - beg_ts)
         # self.logger.info(f"> (Time)({end_ts - beg_ts:.6f})")
         # self.logger.info(f'> Result mohaverekhan-basic-normalizer : \n{text_content}')
         return text_content
\ No newline at end of file
@@ -0,0 +1,101 @@
+import os
+import time
+import logging
+import pickle
+import threading
+from collections import OrderedDict
+from mohaverekhan import cache
+
+
+###############################################################################
+# نشانه‌های ناشناخته‌ای مثل «بهتریییییین» و «منطقست» در متن‌های ورودی بارها تکرار می‌شوند.
+# اصلاحی که نرمالایزر برای هر کدام انتخاب کرده را روی دیسک نگه می‌داریم تا دفعه بعد دوباره بررسی نشوند.
+# اصلاح‌ها به نسخه مجموعه نشانه‌ها وابسته‌اند، پس با عوض شدن نسخه همه را دور می‌ریزیم.
+# اگر تعداد اصلاح‌ها از حد مجاز بیشتر شد، اصلاح‌هایی که مدت بیشتری استفاده نشده‌اند حذف می‌شوند.
+class CorrectionStore:
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, path, max_size=100000, save_interval=60):
+        self.path = path
+        self.max_size = max_size
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.lexicon_version = None
+        self.corrections = OrderedDict()
+        self.is_dirty = False
+        self.last_save_ts = time.time()
+        # در پردازه‌های فرزند، اصلاح‌های جدید اینجا جمع می‌شوند تا به پردازه اصلی برگردانده شوند.
+        self.recorded_corrections = None
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as store_file:
+                self.lexicon_version, self.corrections = pickle.load(store_file)
+            self.logger.info(f'> Loaded {len(self.corrections)} corrections from "{self.path}"')
+        except Exception as e:
+            self.logger.exception(f'> Could not load corrections from "{self.path}" : {e}')
+            self.lexicon_version, self.corrections = None, OrderedDict()
+
+    # اگر مجموعه نشانه‌ها دوباره ساخته شده باشد، اصلاح‌های قبلی دیگر معتبر نیستند.
+    # این تابع باید با قفل گرفته شده صدا زده شود.
+    def check_lexicon_version(self):
+        if self.lexicon_version == cache.lexicon_version:
+            return
+        if self.corrections:
+            self.logger.info(f'> Lexicon changed {self.lexicon_version} -> {cache.lexicon_version}, {len(self.corrections)} corrections invalidated')
+        self.lexicon_version = cache.lexicon_version
+        self.corrections = OrderedDict()
+        self.is_dirty = True
+
+    def get(self, stage, token_content):
+        if cache.lexicon_version is None:
+            return None
+        key = (stage, token_content)
+        with self.lock:
+            self.check_lexicon_version()
+            if key not in self.corrections:
+                return None
+            self.corrections.move_to_end(key)
+            return self.corrections[key]
+
+    def put(self, stage, token_content, fixed_token_content):
+        if cache.lexicon_version is None:
+            return
+        key = (stage, token_content)
+        with self.lock:
+            self.check_lexicon_version()
+            self.corrections[key] = fixed_token_content
+            self.corrections.move_to_end(key)
+            if self.recorded_corrections is not None:
+                self.recorded_corrections.append((stage, token_content, fixed_token_content))
+            while len(self.corrections) > self.max_size:
+                self.corrections.popitem(last=False)
+            self.is_dirty = True
+
+    # نوشتن روی دیسک هزینه دارد، پس حداکثر هر save_interval ثانیه یک بار ذخیره می‌کنیم.
+    def save(self, force=False):
+        with self.save_lock:
+            with self.lock:
+                if not self.is_dirty:
+                    return
+                if not force and time.time() - self.last_save_ts < self.save_interval:
+                    return
+                snapshot = (self.lexicon_version, OrderedDict(self.corrections))
+                self.is_dirty = False
+                self.last_save_ts = time.time()
+
+            temp_path = f'{self.path}.tmp'
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with open(temp_path, 'wb') as store_file:
+                    pickle.dump(snapshot, store_file, -1)
+                os.replace(temp_path, self.path)
+            except Exception as e:
+                self.logger.exception(f'> Could not save corrections in "{self.path}" : {e}')
+                with self.lock:
+                    self.is_dirty = True
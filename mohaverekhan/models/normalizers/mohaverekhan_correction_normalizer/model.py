@@ -1,8 +1,14 @@
+import os
 import time
 import logging
 import re
+import threading
+import multiprocessing
+from django.conf import settings
 from mohaverekhan.models import Normalizer
-from mohaverekhan import cache
+from mohaverekhan.models.base_models import sentence_splitter_pattern
+from mohaverekhan import cache, tracing, metrics
+from .correction_store import CorrectionStore
 
 class MohaverekhanCorrectionNormalizer(Normalizer):
     
@@ -11,6 +17,21 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
 
     logger = logging.getLogger(__name__)
 
+    # فایل اصلاح‌ها در settings.MOHAVEREKHAN_CORRECTIONS_PATH است و اولین بار که لازم شود خوانده می‌شود، نه هنگام import.
+    shared_correction_store = None
+    correction_store_lock = threading.Lock()
+
+    normalize_options = {'parallel': bool, 'profile': str, 'deadline': float, 'trace': bool}
+    parallel_jobs = os.cpu_count() or 1
+    # پردازه‌های اصلاح موازی اولین بار که parallel=True خواسته شود ساخته می‌شوند و بین درخواست‌ها مشترک هستند.
+    # هر pool یک شماره دارد و تعداد درخواست‌هایی که از آن استفاده می‌کنند در sentence_pool_users نگه داشته می‌شود.
+    sentence_pool = None
+    sentence_pool_number = 0
+    sentence_pool_lexicon_version = None
+    sentence_pool_users = {}
+    retired_sentence_pools = {}
+    sentence_pool_lock = threading.Lock()
+
     ###############################################################################
     ### تو این قسمت یه سری فاصله دهی اولیه انجام میدیم.
     correction_patterns = (
@@ -49,19 +70,35 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
         (r'\n', r' newline ', 'replace \n to newline for changing back', 0, 'mohaverekhan', 'true'),
         #فعل با می در مجموعه داده موجود نباشه
         (r'(^| )(ن?می) ', r'\1\2‌', 'after می،نمی - replace space with non-joiner ', 0, 'hazm', 'true'),
-        # فاصله های زائد اضافی را حذف می‌کنیم.
-        (r' +', r' ', 'remove extra spaces', 0, 'hazm', 'true'),
+        # فاصله های زائد اضافی در extra_spaces_pattern حذف می‌شوند.
     )
     correction_patterns = [(rp[0], rp[1]) for rp in correction_patterns]
     correction_patterns = cache.compile_patterns(correction_patterns)
 
+    ###############################################################################
+    # حذف فاصله‌های زائد و پیدا کردن نشانه‌های بی‌نهایت (همان نشانه‌های cache.find_entity_spans) در یک بار خواندن متن
+    # هر فاصله‌ای که بعد از آن فاصله دیگری باشد حذف می‌شود و هر فاصله‌ای که بعد از آن نشانه بی‌نهایت باشد نوع آن نشانه را ثبت می‌کند.
+    # چون هر تطبیق با فاصله شروع می‌شود، بقیه جاهای متن خیلی سریع رد می‌شوند.
+    # نشانه‌های بی‌نهایت حرف فارسی ندارند و مراحل بعدی اصلاح آن‌ها را تغییر نمی‌دهند، پس نوع هر نشانه با محتوای آن نگه داشته می‌شود.
+    extra_spaces_pattern = re.compile(rf' (?:{cache.entity_pattern}|(?P<SPACES> *)(?= ))')
+
     # رگس‌های تصحیح رو اعمال می‌کنه.
+    # خروجی : (متن اصلاح‌شده)(نوع نشانه‌های بی‌نهایت بر اساس محتوا)
     def fix_spaces_in_text(self, text_content):
         for pattern, replacement in self.correction_patterns:
             text_content = pattern.sub(replacement, text_content)
             # self.logger.info(f'> after {pattern} -> {replacement} : \n{text_content}')
+        entity_kinds = {}
+        def fix_extra_spaces(match):
+            kind = match.lastgroup
+            if kind == 'SPACES':
+                return ''
+            entity_kinds[match.group(kind)] = kind
+            return match.group()
+        # فاصله اول برای نشانه‌ای است که در ابتدای متن باشد.
+        text_content = self.extra_spaces_pattern.sub(fix_extra_spaces, ' ' + text_content)
         text_content = text_content.strip(' ')
-        return text_content
+        return text_content, entity_kinds
 
     ###############################################################################
     # اگه جدا کردن براساس چیزی به غیر از فاصله نیاز بود، این تابع رو گذاشتم.
@@ -89,7 +126,7 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
 
                 fixed_token_content = token_content.replace('‌', '')
                 if is_valid and cache.is_token_valid(fixed_token_content):
-                    self.logger.info(f'> Fixed, nj replaced with empty : {fixed_token_content}')
+                    self.trace_decision('nj_removed', token_content, fixed_token_content)
                     return True, fixed_token_content
 
         # بین تمام حروف، نیم‌فاصله می‌گذاریم. اگر معتبر بود، پس آن را بازمی‌گردانیم.
@@ -98,7 +135,7 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
             part1, part2 = token_content[:i], token_content[i:]
             nj_joined = f'{part1}‌{part2}'
             if cache.is_token_valid(nj_joined):
-                self.logger.info(f'> Fixed, Found nj_joined : {nj_joined}')
+                self.trace_decision('nj_joined', token_content, nj_joined)
                 return True, nj_joined
 
         return False, token_content
@@ -111,7 +148,7 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
 
     # نشانه ناشناخته
     # تابع بازگشتی
-    def try_fix_repetition_in_token(self, token_content):
+    def try_fix_repetition_in_token(self, token_content, depth=0):
         if len(token_content) <= 2: #شش
             return False, token_content
 
@@ -120,15 +157,20 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
         matches_count = len(self.repetition_pattern.findall(token_content))
         # self.logger.info(f'> matches_count : {matches_count}')
         if matches_count != 1:
+            # در حالت سریع، عمق بازگشت محدود است.
+            max_repetition_depth = self.get_profile()['max_repetition_depth']
+            if max_repetition_depth is not None and depth >= max_repetition_depth:
+                return False, token_content
+
             it = re.finditer(self.repetition_pattern, token_content)
 
             for match in it:
                 fixed_token_content = token_content.replace(match.group(0), match.group(0)[0])
                 # self.logger.info(f'> 1 : {fixed_token_content}')
-                is_valid, fixed_token_content = self.try_fix_repetition_in_token(fixed_token_content)
+                is_valid, fixed_token_content = self.try_fix_repetition_in_token(fixed_token_content, depth + 1)
                 # self.logger.info(f'> 2 : {fixed_token_content}')
                 if is_valid:
-                    self.logger.info(f'> Found repetition token and nj in recursive: {token_content} -> {fixed_token_content}')
+                    self.trace_decision('repetition_recursive', token_content, fixed_token_content)
                     return True, fixed_token_content
         else:
             # وقتی نشانه به اینجا برسه فقط یک حرف تکرار‌شده داره
@@ -140,7 +182,7 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
                 # ببند بند
                 fixed_token_content = self.repetition_pattern.sub(r'\1\1', token_content) 
                 if cache.is_token_valid(fixed_token_content):
-                    self.logger.debug(f'> Fixed, repetition in token : {token_content} -> {fixed_token_content}')
+                    self.trace_decision('repetition', token_content, fixed_token_content)
                     return True, fixed_token_content
 
                 # شاید مشکل معتبر نبودن نشانه نیم‌فاصله باشد، پس نیم‌فاصله هم بررسی می‌کنیم.
@@ -148,7 +190,7 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
                 # میزننننمش
                 is_valid, fixed_token_content = self.try_fix_non_joiner_in_token(fixed_token_content)
                 if is_valid:
-                    self.logger.info(f'> Found repetition token and nj : {token_content} -> {fixed_token_content}')
+                    self.trace_decision('repetition_nj', token_content, fixed_token_content)
                     return True, fixed_token_content
 
 
@@ -158,14 +200,14 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
                     return True, 'کننده'
 
                 if cache.is_token_valid(fixed_token_content):
-                    self.logger.debug(f'> Fixed, repetition in token : {token_content} -> {fixed_token_content}')
+                    self.trace_decision('repetition', token_content, fixed_token_content)
                     return True, fixed_token_content
 
                 # شاید مشکل معتبر نبودن نشانه نیم‌فاصله باشد، پس نیم‌فاصله هم بررسی می‌کنیم.
                 # میمیرهههههه
                 is_valid, fixed_token_content = self.try_fix_non_joiner_in_token(fixed_token_content)
                 if is_valid:
-                    self.logger.info(f'> Found repetition token and nj : {token_content} -> {fixed_token_content}')
+                    self.trace_decision('repetition_nj', token_content, fixed_token_content)
                     return True, fixed_token_content
                 
                 # حذف حرفهای آخر کلمه و دوباره بررسی کردن تکرار
@@ -214,6 +256,9 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
     # فعلا دو مورد نیم‌فاصله و حرف تکرارشده را بررسی می‌کنیم.
 
     def try_fix_token(self, token_content, replace_nj=True):
+        return self.memoize('fix_memo', self.find_token_fix, token_content, replace_nj)
+
+    def find_token_fix(self, token_content, replace_nj=True):
         
         # درست کردن نیم‌فاصله
         is_valid, fixed_token_content = self.try_fix_non_joiner_in_token(token_content, replace_nj)
@@ -241,7 +286,14 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
             fixed_token_content = token_content.strip(' ')
             # is_valid, fixed_token_content = cache.is_token_valid(fixed_token_content)
             if not cache.is_token_valid(fixed_token_content):
-                is_valid, fixed_token_content = self.try_fix_token(fixed_token_content)
+                # اگر این نشانه ناشناخته قبلا اصلاح شده، همان اصلاح را استفاده می‌کنیم.
+                stored_token_content = self.correction_store.get('fix_tokens', fixed_token_content)
+                if stored_token_content is not None:
+                    fixed_token_content = stored_token_content
+                else:
+                    token_content = fixed_token_content
+                    is_valid, fixed_token_content = self.try_fix_token(token_content)
+                    self.remember_correction('fix_tokens', token_content, fixed_token_content)
             
             fixed_text_content += fixed_token_content.strip(' ') + " "
         fixed_text_content = fixed_text_content[:-1]
@@ -255,6 +307,9 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
     # ممکن است نشانه به حالت دیگری در مجموعه داده موجود باشد که این حالات استثنا را بررسی می‌کنیم
 
     def is_token_valid(self, token_content, replace_nj=True):
+        return self.memoize('validity_memo', self.find_valid_token, token_content, replace_nj)
+
+    def find_valid_token(self, token_content, replace_nj=True):
 
         if cache.is_token_valid(token_content):
             return True, token_content
@@ -269,6 +324,104 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
         return False, token_content
 
 
+    ###############################################################################
+    # در طول یک بار نرمال‌سازی، نشانه‌های یکسان بارها بررسی می‌شوند.
+    # نتیجه بررسی‌ها را برای همان درخواست نگه می‌داریم و در پایان آن را دور می‌ریزیم.
+    # چون یک نمونه از نرمالایزر بین تمام درخواست‌ها مشترک است، وضعیت هر درخواست برای هر نخ جداست.
+    request_state = threading.local()
+
+    # حالت سریع برای درخواست‌هایی است که پاسخ را در چند میلی‌ثانیه می‌خواهند و اصلاح کمتری را می‌پذیرند.
+    profiles = {
+        'full': {
+            'skipped_stages': (),
+            'max_part_count': 4,
+            'max_repetition_depth': None,
+        },
+        'fast': {
+            'skipped_stages': ('join_multipart_tokens3',),
+            'max_part_count': 2,
+            'max_repetition_depth': 2,
+        },
+    }
+
+    def open_request_state(self, profile_name='full', deadline_ts=None):
+        if profile_name not in self.profiles:
+            raise ValueError(f'Unknown profile {profile_name}')
+        self.request_state.validity_memo = {}
+        self.request_state.fix_memo = {}
+        self.request_state.memo_hits = 0
+        self.request_state.memo_misses = 0
+        self.request_state.profile_name = profile_name
+        self.request_state.deadline_ts = deadline_ts
+        self.request_state.ran_stages = []
+        self.request_state.skipped_stages = []
+
+    def close_request_state(self):
+        request_details = {
+            'memo_hits': self.request_state.memo_hits,
+            'memo_misses': self.request_state.memo_misses,
+            'ran_stages': self.request_state.ran_stages,
+            'skipped_stages': self.request_state.skipped_stages,
+        }
+        self.request_state.validity_memo = None
+        self.request_state.fix_memo = None
+        self.request_state.profile_name = 'full'
+        self.request_state.deadline_ts = None
+        return request_details
+
+    def get_profile(self):
+        return self.profiles[getattr(self.request_state, 'profile_name', 'full')]
+
+    # جزئیات آخرین اجرای normalize در همین نخ، مثلا مراحلی که اجرا شده‌اند
+    def get_normalize_details(self):
+        return getattr(self.request_state, 'normalize_details', {})
+
+    # نوع نشانه‌های بی‌نهایت در خروجی آخرین اجرای normalize در همین نخ (محتوای نشانه -> نوع)
+    def get_entity_kinds(self):
+        return getattr(self.request_state, 'entity_kinds', {})
+
+    # اصلاح‌های حالت سریع کامل نیستند، پس فقط اصلاح‌های حالت کامل را نگه می‌داریم.
+    def remember_correction(self, stage, token_content, fixed_token_content):
+        if getattr(self.request_state, 'profile_name', 'full') != 'full':
+            return
+        self.correction_store.put(stage, token_content, fixed_token_content)
+
+    @property
+    def correction_store(self):
+        cls = MohaverekhanCorrectionNormalizer
+        if cls.shared_correction_store is None:
+            with cls.correction_store_lock:
+                if cls.shared_correction_store is None:
+                    cls.shared_correction_store = CorrectionStore(settings.MOHAVEREKHAN_CORRECTIONS_PATH)
+        return cls.shared_correction_store
+
+    # تصمیم قاعده‌ها فقط وقتی ثبت می‌شود که ردیابی برای این درخواست روشن باشد.
+    # جاهایی که ساختن subject یا result هزینه دارد (برش لیست یا چسباندن رشته)، پیش از ساختن آن‌ها get_trace بررسی می‌شود.
+    def trace_decision(self, rule, subject, result=None):
+        trace = tracing.get_trace()
+        if trace is not None:
+            trace.add_decision(self.name, rule, subject, result)
+
+    def trace_stage(self, stage_name, input_content, output_content):
+        trace = tracing.get_trace()
+        if trace is not None:
+            trace.add_stage(self.name, stage_name, input_content, output_content)
+
+    def memoize(self, memo_name, function, token_content, replace_nj):
+        memo = getattr(self.request_state, memo_name, None)
+        if memo is None:
+            return function(token_content, replace_nj)
+
+        key = (token_content, replace_nj)
+        if key in memo:
+            self.request_state.memo_hits += 1
+            return memo[key]
+
+        self.request_state.memo_misses += 1
+        memo[key] = function(token_content, replace_nj)
+        return memo[key]
+
+
     ###############################################################################
     # چسباندن قسمت‌های جدا شده یک نشانه
     # سه شنبه | در مورد | بر اساس | با توجه به | رسانه ها | گفت و گوی | جمع آوری | راه آهن | رو به رو | آیین نامه 
@@ -276,7 +429,6 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
     move_limit = 4
     def join_multipart_tokens(self, text_content):
         token_contents = self.split_into_token_contents(text_content)
-        self.logger.debug(f'token_contents : {token_contents}')
         fixed_text_content = ''
         fixed_token_content, cutted_fixed_token_content = '', ''
         cut_count = 0
@@ -291,7 +443,6 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
             # وقتی در آخر به خود نشانه به تنهایی می‌رسیم، همون نشانه تنها رو اضافه می‌کنیم.
             # اگه به آخرین نشانه در متن رسیدیم، آن را اضافه می‌کنیم.
             if move_count == 0:
-                self.logger.debug(f'> Join the last one : {token_contents[i]}')
                 fixed_text_content += token_contents[i]
                 break
 
@@ -311,7 +462,8 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
                     ) or
                     move_count == 0
                 ):
-                    self.logger.debug(f'> Fixed nj [i:i+move_count+1] : [{i}:{i+move_count+1}] : {fixed_token_content}')
+                    if move_count > 0 and tracing.get_trace() is not None:
+                        self.trace_decision('join_nj', token_contents[i:i+move_count+1], fixed_token_content)
                     # به تعداد نشانه‌هایی که چسباندیم، در حلقه به جلو می‌پریم.
                     i = i + move_count + 1
                     fixed_text_content += fixed_token_content + ' '
@@ -333,7 +485,8 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
                             move_count == 0
                         ):
                             fixed_token_content = cutted_fixed_token_content + fixed_token_content[-j]
-                            self.logger.debug(f'> Fixed nj2 {j} [i:i+move_count+1] : [{i}:{i+move_count+1}] : {fixed_token_content}')
+                            if tracing.get_trace() is not None:
+                                self.trace_decision('join_nj_cut', token_contents[i:i+move_count+1], fixed_token_content)
                             i = i + move_count + 1
                             fixed_text_content += fixed_token_content + ' '
                             success = True
@@ -367,7 +520,8 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
                         ) 
                     ):
                         fixed_token_content += 'ی'
-                        self.logger.debug(f'> Fixed nj [i:i+move_count] + "های" : [{i}:{i+move_count+1}] : {fixed_token_content}')
+                        if tracing.get_trace() is not None:
+                            self.trace_decision('join_nj_hay', token_contents[i:i+move_count+1], fixed_token_content)
                         i = i + move_count + 1
                         fixed_text_content += fixed_token_content + ' '
                         break
@@ -431,7 +585,7 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
         if token_content[-2:] == 'یه' and token_content[-3:] != 'ایه' : 
             is_valid, fixed_token_content = self.is_token_valid(token_content[:-1])
             if is_valid:
-                self.logger.info(f'> {fixed_token_content} fixed یه')
+                self.trace_decision('ending_ye', token_content, fixed_token_content)
                 return fixed_token_content
         
         # اگر نشانه به «ست» ختم شده بود و معتبر بود، پس آن را به «ه است» تبدیل می‌کند
@@ -439,17 +593,15 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
         if token_content[-2:] == 'ست': 
             is_valid, fixed_token_content = self.is_token_valid(token_content[:-2] + 'ه')
             if is_valid:
-                self.logger.info(f'> {fixed_token_content} fixed است')
+                if tracing.get_trace() is not None:
+                    self.trace_decision('ending_ast', token_content, fixed_token_content + ' است')
                 return fixed_token_content + ' است'
 
-        self.logger.info(f'>> get_token_parts')
-
         # کلمات چسبیده شده اشتباهی باید جدا شوند.
         # متصل‌شونده‌هایی مثل کتابشونه باید جدا بشند.
         # به‌ترتیب تمام زیررشته‌های ۲ تایی و ۳ تایی و ۴ تایی را بررسی می‌کنیم.
         # اگر توالی زیررشته‌ها معتبر بود، پس آن را برمیگردانیم.
-        for part_count in range(2, 5):
-            self.logger.info(f'> {part_count} : ')
+        for part_count in range(2, self.get_profile()['max_part_count'] + 1):
             is_valid = True
             for token_parts in self.get_token_parts_list(token_content, part_count):
                 # C sequence 
@@ -480,7 +632,6 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
 
                 # قسمت‌ها رو برعکس می‌کنیم تا متصل‌شونده‌ها رو راحت‌تر بررسی کنیم.
                 reversed_token_parts = list(reversed(token_parts))
-                self.logger.info(f'> reversed({token_parts}) : {reversed_token_parts}')
                 for index, token_part in enumerate(reversed_token_parts):
 
                     # باید تمام زیر‌رشته‌ها معتبر باشند.
@@ -493,18 +644,16 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
                         token_part = fixed_token_part
                         reversed_token_parts[index] = token_part
                         token_parts = list(reversed(reversed_token_parts))
-                        self.logger.info(f'> Refined {token_parts} : {token_part} is valid')
+                        self.trace_decision('refined', token_parts, token_part)
                     else:
                         # اگر زیررشته‌ای معتبر نبود، پس کلا توالی زیررشته‌های کنونی را رد می‌کنیم.
-                        self.logger.info(f'> Rejected {token_parts} : {token_part} not in tokens')
+                        self.trace_decision('rejected_not_in_tokens', token_parts, token_part)
                         is_valid = False
                         break
 
 
-                    self.logger.info(f'>>>>>>>>>>>>>>>>>>>>>>> 1 token_part : {token_part} | end_c_sequence : {end_c_sequence} | cache.all_token_tags[token_part] : {cache.all_token_tags[token_part]}')
                     # در این‌جا وارد قسمت غیر متصل‌شونده‌ها می‌شویم.
                     if not end_c_sequence and 'C' not in cache.all_token_tags[token_part]:
-                        self.logger.info(f'>>>>>>>>>>>>>>>>>>>>>>> 2 token_part : {token_part}')
                         end_c_sequence = True
                         not_c_token_count = part_count - index
                         # اگه در توالی زیر‌رشته‌های کنونی متصل‌شونده وجود داشت، پس این موارد را باید چک کرد
@@ -519,15 +668,15 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
                                 token_part = 'دیگه'
                                 reversed_token_parts[index] = token_part
                                 token_parts = list(reversed(reversed_token_parts))
-                                self.logger.info(f'> Refine {token_parts} : {token_part} added "ه"')
+                                self.trace_decision('refined_dige', token_parts, token_part)
                             # اگه نشانه جمع محاوره‌ای مانند کتابا، خریدا و غیره بود، پس جداشون نکن و ادامه نده.
                             elif reversed_token_parts[index-1] == 'ا' and self.is_token_valid(token_part + 'ا')[0]: #token_part + 'ا' in cache.all_token_tags:
-                                self.logger.info(f'> Rejected {token_parts} : {token_part} found plural {token_part + "ا"}')
+                                self.trace_decision('rejected_plural', token_parts, token_part)
                                 is_valid = False
                                 break
                             # اکر اولین متصل‌‌شونده «ی» بود و کلمه قبلش «فعل» نبود، پس این توالی را رد کن.
                             elif token_parts[index-1][0] == 'ی' and 'V' not in cache.all_token_tags[token_part]:
-                                self.logger.info(f'> Rejected {token_parts} : {token_part} ی should be with verb')
+                                self.trace_decision('rejected_ye_without_verb', token_parts, token_part)
                                 is_valid = False
                                 break
                             #
@@ -540,7 +689,6 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
 
                         
                     if end_c_sequence:
-                        self.logger.info(f'cache.all_token_tags[{token_part}] : {cache.all_token_tags[token_part]}')
                         tags_list = list(cache.all_token_tags[token_part])
 
                         # اگر اندازه یک قسمت غیر متصل‌شونده بیشتر مساوی ۴ بود، پس احتمالا معتبر است و قبولش می‌کنیم.
@@ -559,13 +707,13 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
                             # عدد‌های زیر ۱۰
                             'U' not in tags_list
                         ):
-                            self.logger.info(f'> Rejected {token_parts} : {token_part} length 1 or R or C')
+                            self.trace_decision('rejected_length_1', token_parts, token_part)
                             is_valid = False
                             break
                         
                         # نشانه غیر متصل‌شونده اندازه کمتر از ۴ به عنوان آر مورد قبول نیست.
                         if tags_list == ['R']:
-                            self.logger.info(f'> Rejected {token_parts} : {token_part} R is not valid')
+                            self.trace_decision('rejected_r', token_parts, token_part)
                             is_valid = False
                             break
 
@@ -574,7 +722,7 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
                             not_c_token_count != part_count and
                             'C' in tags_list
                         ):
-                            self.logger.info(f'> Rejected {token_parts} : {token_part} not valid for len - 1, C or R or both')
+                            self.trace_decision('rejected_c_after_c_sequence', token_parts, token_part)
                             is_valid = False
                             break
 
@@ -593,13 +741,13 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
                                     tags_list != ['E']
                                     # ملورین : مل ور ین
                                 ):
-                                    self.logger.info(f'> Rejected {token_parts} : {token_part} length 2 not E, not valid for len - 2')
+                                    self.trace_decision('rejected_length_2_not_e', token_parts, token_part)
                                     is_valid = False
                                     break
 
                                 # سزارشیم : سزار شیم
                                 if token_part == 'شیم':
-                                    self.logger.info(f'> Rejected {token_parts} : {token_part} not valid for len - 2')
+                                    self.trace_decision('rejected_shim', token_parts, token_part)
                                     is_valid = False
                                     break
 
@@ -608,14 +756,14 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
                         # اگر متصل‌شونده‌های سوم به بعد دارای اندازه یک بودند، پس قبولشون نکن.
                         # اگر متصل‌شونده‌های «ر» و «ز» استفاده شده بود قبولشون نکن.
                         if ( index != 0 and index != 1 and len(token_part) == 1) or token_part in ('ز', 'ر'):
-                            self.logger.info(f'> Rejected {token_parts} : {token_part} 1 length or ز or ر')
+                            self.trace_decision('rejected_c_part', token_parts, token_part)
                             # self.logger.info(f'> Rejected {token_part} : {cache.all_token_tags[token_part]}')
                             is_valid = False
                             break
                 
                 # اگر عاملی نتونستیم پیدا کنیم که توالی را رد بکنیم، پس احتمالا توالی درست است و قسمت‌ها را با فاصله به هم می‌چسبانیم
                 if is_valid and end_c_sequence:
-                    self.logger.info(f'> Found {token_parts} {[cache.all_token_tags[token_part] for token_part in token_parts]}')
+                    self.trace_decision('found', token_content, ' '.join(token_parts))
                     return ' '.join(token_parts)
 
         # وقتی به اینجا برسیم، یعنی هیچ اصلاحی نتونستیم روی نشانه انجام بدهیم، پس آن را برمی‌گردانیم
@@ -627,66 +775,257 @@ class MohaverekhanCorrectionNormalizer(Normalizer):
     # فقط نشانه‌هایی که ناشناخته هستند را بررسی می‌کند.
     def fix_wrong_joined_undefined_tokens(self, text_content):
         token_contents = self.split_into_token_contents(text_content)
-        self.logger.debug(f'> token_contents : {token_contents}')
         fixed_text_content = ''
         fixed_token_content = ''
 
         for token_content in token_contents:
-            fixed_token_content = token_content.strip(' ')
-            is_valid, fixed_token_content = self.is_token_valid(fixed_token_content)
-            if is_valid:
-                self.logger.info(f'> cache.all_token_tags[{fixed_token_content}].keys() : {cache.all_token_tags[fixed_token_content].keys()} {list(cache.all_token_tags[fixed_token_content].keys()) == ["R"]}')
-
-            is_valid, fixed_token_content = self.is_token_valid(fixed_token_content)
-            if(
-                cache.has_persian_character_pattern.match(fixed_token_content) and
-                ( 
-                    not is_valid or
-                    # fixed_token_content not in cache.all_token_tags or 
-                    list(cache.all_token_tags[fixed_token_content].keys()) == ['R']
-                )
-                
-            ):
-                self.logger.debug(f'> {fixed_token_content} not in token set or R!')
-                fixed_token_content = self.fix_wrong_joined_undefined_token(fixed_token_content)
+            token_content = token_content.strip(' ')
+            # نشانه‌های معتبر بدون تغییر می‌مانند.
+            if cache.is_token_valid(token_content):
+                fixed_text_content += token_content + " "
+                continue
+
+            # اگر این نشانه ناشناخته قبلا اصلاح شده، همان اصلاح را استفاده می‌کنیم و دیگر سراغ is_token_valid نمی‌رویم.
+            stored_token_content = self.correction_store.get('fix_wrong_joined_undefined_tokens', token_content)
+            if stored_token_content is not None:
+                fixed_token_content = stored_token_content
+            else:
+                # نتیجه اصلاح همیشه در مجموعه نشانه‌ها نیست (مثل «کنده» -> «کننده»)، پس نشانه اصلاح‌شده دوباره بررسی می‌شود.
+                is_valid, fixed_token_content = self.is_token_valid(token_content)
+                is_valid, fixed_token_content = self.is_token_valid(fixed_token_content)
+                if(
+                    cache.has_persian_character_pattern.match(fixed_token_content) and
+                    ( 
+                        not is_valid or
+                        # fixed_token_content not in cache.all_token_tags or 
+                        list(cache.all_token_tags[fixed_token_content].keys()) == ['R']
+                    )
+                    
+                ):
+                    fixed_token_content = self.fix_wrong_joined_undefined_token(fixed_token_content)
+                self.remember_correction('fix_wrong_joined_undefined_tokens', token_content, fixed_token_content)
             
             fixed_text_content += fixed_token_content.strip(' ') + " "
         fixed_text_content = fixed_text_content[:-1].strip(' ')
         return fixed_text_content
 
 
+    ###############################################################################
+    # مراحلی که روی نشانه‌های متن کار می‌کنند.
+    # این مراحل از مرز جمله‌ها عبور نمی‌کنند، پس می‌توان هر جمله را جدا از بقیه به آن‌ها داد.
+    def get_token_stages(self):
+        return (
+            ('join_multipart_tokens1', self.join_multipart_tokens), # آرام کننده | در عین حال | جمع آوری | رسانه ‌ها
+            ('fix_tokens', self.fix_tokens), # fix non-joiner and repetition
+            ('join_multipart_tokens2', self.join_multipart_tokens), # فرههههههههنگ سرا
+            ('fix_wrong_joined_undefined_tokens', self.fix_wrong_joined_undefined_tokens), # آرام کنندهخوبمن 
+            ('join_multipart_tokens3', self.join_multipart_tokens), # آرام کنندهخوبی
+        )
+
+    # اگر زمان مجاز درخواست تمام شده باشد، مراحل باقی‌مانده اجرا نمی‌شوند و بهترین نتیجه تا این لحظه برگردانده می‌شود.
+    def correct_token_contents(self, text_content):
+        skipped_stages = self.get_profile()['skipped_stages']
+        deadline_ts = getattr(self.request_state, 'deadline_ts', None)
+        for stage_name, stage in self.get_token_stages():
+            if stage_name in skipped_stages or (deadline_ts is not None and time.time() >= deadline_ts):
+                self.request_state.skipped_stages.append(stage_name)
+                continue
+            with metrics.timer(self.name, stage_name):
+                fixed_text_content = stage(text_content)
+            self.request_state.ran_stages.append(stage_name)
+            self.trace_stage(stage_name, text_content, fixed_text_content)
+            text_content = fixed_text_content
+        return text_content
+
+
+    ###############################################################################
+    # متن را بعد از فاصله‌گذاری اولیه در مرز جمله‌ها جدا می‌کنیم.
+    # فقط جایی جدا می‌کنیم که علامت پایان جمله خودش یک نشانه کامل باشد تا هیچ نشانه‌ای نصف نشود.
+    # مراحل چسباندن نشانه‌ها هیچ‌وقت علامت پایان جمله را به نشانه‌های دیگر نمی‌چسبانند، پس خروجی با حالت عادی یکسان است.
+    def split_into_sentence_contents(self, text_content):
+        sentence_contents = []
+        beg = 0
+        for match in sentence_splitter_pattern.finditer(text_content):
+            end = match.end()
+            if end < len(text_content) and text_content[end] not in ' \n':
+                continue
+            sentence_contents.append(text_content[beg:end].strip(' '))
+            beg = end
+        sentence_contents.append(text_content[beg:].strip(' '))
+        return [sentence_content for sentence_content in sentence_contents if sentence_content]
+
+    # جمله‌ها در چند پردازه جدا اصلاح می‌شوند و دوباره به همان ترتیب کنار هم قرار می‌گیرند.
+    # پردازه‌ها با fork ساخته می‌شوند و مجموعه نشانه‌ها را از همین پردازه به ارث می‌برند.
+    def correct_sentences_in_parallel(self, text_content):
+        sentence_contents = self.split_into_sentence_contents(text_content)
+        self.logger.info(f'> {len(sentence_contents)} sentences')
+        if len(sentence_contents) <= 1:
+            return self.correct_token_contents(text_content)
+
+        profile_name = self.request_state.profile_name
+        deadline_ts = self.request_state.deadline_ts
+        trace = tracing.get_trace()
+        pool_number, sentence_pool = self.acquire_sentence_pool()
+        try:
+            results = sentence_pool.starmap(correct_sentence_content, [
+                (sentence_content, profile_name, deadline_ts, trace is not None) 
+                    for sentence_content in sentence_contents
+            ])
+        finally:
+            self.release_sentence_pool(pool_number)
+
+        fixed_sentence_contents = []
+        ran_stages = None
+        for fixed_sentence_content, corrections, request_details, trace_dict, samples in results:
+            fixed_sentence_contents.append(fixed_sentence_content)
+            # زمان مراحل در پردازه‌های فرزند اندازه‌گیری شده‌اند و باید در هیستوگرام‌های همین پردازه ثبت شوند.
+            metrics.record_samples(samples)
+            if trace is not None:
+                trace.extend(trace_dict)
+            # اصلاح‌هایی که پردازه‌ها یاد گرفته‌اند را در همین پردازه هم نگه می‌داریم.
+            for stage, token_content, fixed_token_content in corrections:
+                self.correction_store.put(stage, token_content, fixed_token_content)
+            self.request_state.memo_hits += request_details['memo_hits']
+            self.request_state.memo_misses += request_details['memo_misses']
+            # مرحله‌ای اجرا شده حساب می‌شود که روی تمام جمله‌ها اجرا شده باشد.
+            if ran_stages is None:
+                ran_stages = request_details['ran_stages']
+            else:
+                ran_stages = [stage_name for stage_name in ran_stages if stage_name in request_details['ran_stages']]
+
+        for stage_name, stage in self.get_token_stages():
+            if stage_name in ran_stages:
+                self.request_state.ran_stages.append(stage_name)
+            else:
+                self.request_state.skipped_stages.append(stage_name)
+        return ' '.join(fixed_sentence_contents)
+
+
+    ###############################################################################
+    # پردازه‌های فرزند هنگام fork یک کپی از مجموعه نشانه‌ها می‌گیرند، پس pool اولین بار که لازم شود ساخته می‌شود، نه در cache.init،
+    # تا دستورهای manage.py که اصلاح موازی ندارند پردازه‌ای نسازند.
+    # اگر مجموعه نشانه‌ها عوض شود، pool جدیدی ساخته می‌شود و pool قبلی بعد از تمام شدن کار آخرین درخواستی که از آن استفاده می‌کند بسته می‌شود.
+    def acquire_sentence_pool(self):
+        cls = MohaverekhanCorrectionNormalizer
+        retired_sentence_pool = None
+        with cls.sentence_pool_lock:
+            if cls.sentence_pool is not None and cls.sentence_pool_lexicon_version != cache.lexicon_version:
+                self.logger.info(f'> Lexicon changed, retiring sentence pool {cls.sentence_pool_number}.')
+                if cls.sentence_pool_number in cls.sentence_pool_users:
+                    cls.retired_sentence_pools[cls.sentence_pool_number] = cls.sentence_pool
+                else:
+                    retired_sentence_pool = cls.sentence_pool
+                cls.sentence_pool = None
+            if cls.sentence_pool is None:
+                cls.sentence_pool = multiprocessing.get_context('fork').Pool(processes=self.parallel_jobs)
+                cls.sentence_pool_number += 1
+                cls.sentence_pool_lexicon_version = cache.lexicon_version
+                self.logger.info(f'> Sentence pool {cls.sentence_pool_number} started with {self.parallel_jobs} processes.')
+            pool_number = cls.sentence_pool_number
+            cls.sentence_pool_users[pool_number] = cls.sentence_pool_users.get(pool_number, 0) + 1
+            sentence_pool = cls.sentence_pool
+        if retired_sentence_pool is not None:
+            self.close_sentence_pool(retired_sentence_pool)
+        return pool_number, sentence_pool
+
+    def release_sentence_pool(self, pool_number):
+        cls = MohaverekhanCorrectionNormalizer
+        with cls.sentence_pool_lock:
+            cls.sentence_pool_users[pool_number] -= 1
+            if cls.sentence_pool_users[pool_number]:
+                return
+            del cls.sentence_pool_users[pool_number]
+            retired_sentence_pool = cls.retired_sentence_pools.pop(pool_number, None)
+        if retired_sentence_pool is not None:
+            self.close_sentence_pool(retired_sentence_pool)
+
+    def close_sentence_pool(self, sentence_pool):
+        sentence_pool.close()
+        sentence_pool.join()
+        self.logger.info(f'> Retired sentence pool closed after its last request.')
+
+
     ###############################################################################
     # تابع شروع کننده این نرمالایزر
-    def normalize(self, text_content):
+    # parallel : جمله‌های متن به صورت موازی اصلاح می‌شوند.
+    # profile : «full» یا «fast»
+    # deadline : حداکثر زمان مجاز بر حسب میلی‌ثانیه
+    # trace : ورودی و خروجی مراحل و تصمیم قاعده‌ها در جزئیات پاسخ برگردانده می‌شود.
+    def normalize(self, text_content, parallel=False, profile='full', deadline=None, trace=False):
         beg_ts = time.time()
-        self.logger.info(f'>>> mohaverekhan-correction-normalizer : \n{text_content}')
+        deadline_ts = beg_ts + deadline / 1000 if deadline is not None else None
+        is_trace_owner = False
+        if trace:
+            trace, is_trace_owner = tracing.start_trace()
+        try:
+            text_content = self.correct_text_content(text_content, profile, deadline_ts, parallel)
+        finally:
+            if is_trace_owner:
+                tracing.stop_trace()
+        end_ts = time.time()
+        metrics.record(self.name, 'normalize', end_ts - beg_ts)
+
+        request_details = self.request_state.request_details
+        self.request_state.normalize_details = {
+            'profile': profile,
+            'ran_stages': request_details['ran_stages'],
+            'skipped_stages': request_details['skipped_stages'],
+        }
+        if is_trace_owner:
+            self.request_state.normalize_details['trace'] = trace.to_dict()
+        memo_hits, memo_misses = request_details['memo_hits'], request_details['memo_misses']
+        memo_lookups = memo_hits + memo_misses
+        memo_hit_rate = memo_hits / memo_lookups if memo_lookups else 0
+        self.logger.info(f"> (Time)({end_ts - beg_ts:.6f})(Memo)({memo_hits}/{memo_lookups})({memo_hit_rate:.2%})")
+        return text_content
 
+    def correct_text_content(self, text_content, profile, deadline_ts, parallel):
+        input_content = text_content
         text_content = cache.normalizers['mohaverekhan-basic-normalizer']\
                         .normalize(text_content)
-        self.logger.info(f'>> mohaverekhan-basic-normalizer : \n{text_content}')
+        self.trace_stage('mohaverekhan-basic-normalizer', input_content, text_content)
         
         text_content = text_content.strip(' ')
 
-        text_content = self.fix_spaces_in_text(text_content)
-        self.logger.info(f'>> fix_spaces_in_text : \n{text_content}')
-
-        text_content = self.join_multipart_tokens(text_content) # آرام کننده | در عین حال | جمع آوری | رسانه ‌ها
-        self.logger.info(f'>> join_multipart_tokens1 : \n{text_content}')
-
-        text_content = self.fix_tokens(text_content) # fix non-joiner and repetition
-        self.logger.info(f'>> fix_tokens : \n{text_content}')
-
-        text_content = self.join_multipart_tokens(text_content) # فرههههههههنگ سرا
-        self.logger.info(f'>> join_multipart_tokens2 : \n{text_content}')
-
-        text_content = self.fix_wrong_joined_undefined_tokens(text_content) # آرام کنندهخوبمن 
-        self.logger.info(f'>> fix_wrong_joined_undefined_tokens : \n{text_content}')
-
-        text_content = self.join_multipart_tokens(text_content) # آرام کنندهخوبی
-        self.logger.info(f'>> join_multipart_tokens3 : \n{text_content}')
+        self.open_request_state(profile, deadline_ts)
+        try:
+            input_content = text_content
+            with metrics.timer(self.name, 'fix_spaces_in_text'):
+                text_content, entity_kinds = self.fix_spaces_in_text(text_content)
+            self.trace_stage('fix_spaces_in_text', input_content, text_content)
+
+            if parallel:
+                text_content = self.correct_sentences_in_parallel(text_content)
+            else:
+                text_content = self.correct_token_contents(text_content)
+        finally:
+            self.request_state.request_details = self.close_request_state()
+        self.correction_store.save()
 
         text_content = text_content.replace(' newline ', '\n').strip(' ')
-        end_ts = time.time()
-        self.logger.info(f"> (Time)({end_ts - beg_ts:.6f})")
-        self.logger.info(f'>>> Result mohaverekhan-correction-normalizer : \n{text_content}')
+        self.request_state.entity_kinds = entity_kinds
         return text_content
+
+
+# این تابع در پردازه‌های فرزند اجرا می‌شود و یک جمله را اصلاح می‌کند.
+# ردیابی پردازه پدر در پردازه فرزند معتبر نیست، پس در صورت نیاز ردیابی جدیدی ساخته و برگردانده می‌شود.
+def correct_sentence_content(sentence_content, profile_name, deadline_ts, is_traced=False):
+    normalizer = cache.normalizers['mohaverekhan-correction-normalizer']
+    normalizer.correction_store.recorded_corrections = []
+    tracing.stop_trace()
+    metrics.start_recording()
+    trace_dict = None
+    if is_traced:
+        trace, is_trace_owner = tracing.start_trace()
+    normalizer.open_request_state(profile_name, deadline_ts)
+    try:
+        fixed_sentence_content = normalizer.correct_token_contents(sentence_content)
+    finally:
+        request_details = normalizer.close_request_state()
+        if is_traced:
+            trace_dict = trace.to_dict()
+            tracing.stop_trace()
+        samples = metrics.stop_recording()
+    corrections = normalizer.correction_store.recorded_corrections
+    normalizer.correction_store.recorded_corrections = None
+    return fixed_sentence_content, corrections, request_details, trace_dict, samples
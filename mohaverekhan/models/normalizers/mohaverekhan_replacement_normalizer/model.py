@@ -1,7 +1,9 @@
+import re
 import time
+import functools
 import logging
 from mohaverekhan.models import Normalizer
-from mohaverekhan import cache
+from mohaverekhan import cache, metrics
 
 class MohaverekhanReplacementNormalizer(Normalizer):
     
@@ -32,8 +34,65 @@ class MohaverekhanReplacementNormalizer(Normalizer):
         # (r'-?[0-9۰۱۲۳۴۵۶۷۸۹]+([.,][0-9۰۱۲۳۴۵۶۷۸۹]+)?', r' NUMBER ', 'number', 0, 'mohaverekhan', 'true'),
     )
     replacement_patterns = [(rp[0], rp[1]) for rp in replacement_patterns]
+
+    ###############################################################################
     replacement_patterns = cache.compile_patterns(replacement_patterns)
 
+    ###############################################################################
+    # اجرای پشت سر هم رگس‌های بالا متن را ۱۳ بار می‌خواند و کپی می‌کند.
+    # هیچ نشانه جایگزین‌شونده‌ای فاصله ندارد و نگاه به قبل و بعد رگس‌ها فقط یک حرف است، پس اثر آن‌ها روی هر تکه بین دو فاصله مستقل از بقیه متن است.
+    # پس متن فقط یک بار خوانده می‌شود و تکه‌هایی که هیچ حرفی از entity_first_characters ندارند (بیشتر کلمه‌های فارسی) دست نمی‌خورند.
+    # روی بقیه تکه‌ها (همراه با فاصله‌های دو طرفشان) همان رگس‌ها به ترتیب اجرا می‌شوند، پس نشانه‌های به هم چسبیده (مثل x1😀#tag) هم دقیقا مثل replace_sequentially جایگزین می‌شوند.
+    # تکه‌ها بسیار تکراری هستند (ایموجی‌ها، هشتگ‌ها، عددها)، پس نتیجه هر تکه در replace_chunk نگه داشته می‌شود.
+    # فاصله‌های زائد هم در همان یک بار خواندن حذف می‌شوند.
+    entity_first_characters = rf'{cache.emojies}a-zA-Z0-9۰-۹\d\.,_\+\-@#'
+    entity_chunk_pattern = re.compile(
+        rf'(?<![^ ])[^ {entity_first_characters}]*[{entity_first_characters}][^ ]*| {{2,}}')
+
+    def replace_entities(self, text_content):
+        text_length = len(text_content)
+        def replace_match(match):
+            chunk = match.group()
+            # فاصله‌های زائد
+            if chunk[0] == ' ':
+                return ' '
+            return self.replace_chunk(chunk, match.start() > 0, match.end() < text_length)
+        return self.entity_chunk_pattern.sub(replace_match, text_content)
+
+    # فاصله‌های دو طرف تکه در متن می‌مانند، پس از نتیجه حذف می‌شوند.
+    @staticmethod
+    @functools.lru_cache(maxsize=65536)
+    def replace_chunk(chunk, has_space_before, has_space_after):
+        text_content = f"{' ' if has_space_before else ''}{chunk}{' ' if has_space_after else ''}"
+        for pattern, replacement in MohaverekhanReplacementNormalizer.replacement_patterns:
+            text_content = pattern.sub(replacement, text_content)
+        if has_space_before:
+            text_content = text_content[1:]
+        if has_space_after:
+            text_content = text_content[:-1]
+        return text_content
+
+    # روش قبلی که رگس‌ها را یکی یکی اجرا می‌کند؛ برای مقایسه نتیجه و سرعت با replace_entities نگه داشته شده.
+    def replace_sequentially(self, text_content):
+        for pattern, replacement in self.replacement_patterns:
+            text_content = pattern.sub(replacement, text_content)
+            # self.logger.info(f'> After {pattern} -> {replacement} : \n{text_content}')
+        return text_content
+
+    # تعداد میلیون حرف در ثانیه هر دو روش را روی text_content اندازه می‌گیرد.
+    def benchmark_replacement_engines(self, text_content, duration=1):
+        report = {}
+        for name, replace in (('sequential', self.replace_sequentially), ('fused', self.replace_entities)):
+            count = 0
+            beg_ts = time.perf_counter()
+            while time.perf_counter() - beg_ts < duration:
+                replace(text_content)
+                count += 1
+            end_ts = time.perf_counter()
+            report[name] = count * len(text_content) / (end_ts - beg_ts) / 1e6
+            self.logger.info(f'> (Throughput)({name})({report[name]:.2f} Mchar/s)')
+        return report
+
     def normalize(self, text_content):
         beg_ts = time.time()
         # self.logger.info(f'>>> mohaverekhan_replacement_normalizer : \n{text_content}')
@@ -44,13 +103,13 @@ class MohaverekhanReplacementNormalizer(Normalizer):
         
         text_content = text_content.strip(' ')
 
-        for pattern, replacement in self.replacement_patterns:
-            text_content = pattern.sub(replacement, text_content)
-            # self.logger.info(f'> After {pattern} -> {replacement} : \n{text_content}')
+        with metrics.timer(self.name, 'replacement_patterns'):
+            text_content = self.replace_entities(text_content)
         # self.logger.info(f'>> replace_text : \n{text_content}')
         text_content = text_content.strip()
 
         end_ts = time.time()
+        metrics.record(self.name, 'normalize', end_ts - beg_ts)
         # self.logger.info(f"> (Time)({end_ts - beg_ts:.6f})")
         # self.logger.info(f'>>> Result mohaverekhan_replacement_normalizer : \n{text_content}')
         return text_content
@@ -0,0 +1,145 @@
+import time
+import queue
+import logging
+import threading
+
+import numpy as np
+
+
+###############################################################################
+# دسته‌های آموزش seq2seq
+# جفت‌های یک کلمه‌ای و متن‌های صد کلمه‌ای اگر در یک دسته باشند، بیشتر محاسبه صرف جای خالی می‌شود.
+# پس در هر دوره، جفت‌ها به صورت تصادفی به گروه‌های pool_size دسته‌ای تقسیم می‌شوند، هر گروه بر اساس طول مرتب می‌شود،
+# به دسته‌های batch_size تایی بریده می‌شود و در آخر ترتیب دسته‌ها تصادفی می‌شود.
+# ساختن آرایه‌های پرشده در یک نخ دیگر انجام می‌شود و تا prefetch دسته آماده می‌ماند، پس sess.run منتظر آماده شدن دسته‌ها نمی‌ماند.
+# X و Y می‌توانند آرایه‌های پرشده با صفر (مثلا آرایه‌های mmap) همراه طول جمله‌ها یا فهرست جمله‌ها باشند.
+class BucketedBatchLoader:
+
+    logger = logging.getLogger(__name__)
+    end_of_epoch = object()
+
+    def __init__(self, X, Y, batch_size, start_id, end_id, pool_size=100, prefetch=8, random_state=0,
+                    x_lengths=None, y_lengths=None):
+        assert len(X) == len(Y)
+        self.X, self.Y = X, Y
+        self.batch_size = batch_size
+        self.start_id, self.end_id = start_id, end_id
+        self.pool_size = pool_size
+        self.prefetch = prefetch
+        self.random_state = random_state
+        self.is_padded = isinstance(X, np.ndarray) and isinstance(Y, np.ndarray)
+        self.x_lengths = self.get_lengths(X, x_lengths)
+        self.y_lengths = self.get_lengths(Y, y_lengths)
+        # مثل tl.iterate.minibatches، جفت‌هایی که به یک دسته کامل نمی‌رسند کنار گذاشته می‌شوند.
+        self.batch_count = len(X) // batch_size
+        self.reset_stats()
+
+    def get_lengths(self, sequences, lengths):
+        if lengths is not None:
+            return np.asarray(lengths, dtype=np.int64)
+        if self.is_padded:
+            return (np.asarray(sequences) != 0).sum(axis=1)
+        return np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+
+    def reset_stats(self):
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.example_count = 0
+        self.beg_ts = time.time()
+
+    # سهم نشانه‌های واقعی از کل خانه‌های آرایه‌های encode و decode
+    def get_padding_efficiency(self):
+        return self.real_tokens / self.padded_tokens if self.padded_tokens else None
+
+    def get_examples_per_second(self):
+        return self.example_count / max(time.time() - self.beg_ts, 1e-9)
+
+    def get_batch_indexes(self, epoch):
+        generator = np.random.RandomState(self.random_state + epoch)
+        indexes = generator.permutation(len(self.X))[:self.batch_count * self.batch_size]
+        lengths = self.x_lengths + self.y_lengths
+        pool_length = self.pool_size * self.batch_size
+        batches = []
+        for offset in range(0, len(indexes), pool_length):
+            pool = indexes[offset:offset + pool_length]
+            pool = pool[np.argsort(lengths[pool], kind='stable')]
+            batches += [pool[i:i + self.batch_size] for i in range(0, len(pool), self.batch_size)]
+        generator.shuffle(batches)
+        return batches
+
+    # encode_seqs : X با صفر پر شده
+    # decode_seqs : start_id + Y
+    # target_seqs : Y + end_id
+    # target_mask : ۱ برای خانه‌هایی از target_seqs که جای خالی نیستند
+    def build_batch(self, indexes):
+        x_lengths, y_lengths = self.x_lengths[indexes], self.y_lengths[indexes] + 1
+        x_max, y_max = x_lengths.max(), y_lengths.max()
+        if self.is_padded:
+            # سطرها یک‌جا از آرایه‌ها برداشته و تا بلندترین جمله دسته بریده می‌شوند.
+            rows = np.arange(len(indexes))
+            Y = self.Y[indexes, :y_max - 1].astype(np.int64)
+            encode_seqs = self.X[indexes, :x_max].astype(np.int64)
+            decode_seqs = np.zeros((len(indexes), y_max), dtype=np.int64)
+            decode_seqs[:, 0] = self.start_id
+            decode_seqs[:, 1:] = Y
+            target_seqs = np.zeros((len(indexes), y_max), dtype=np.int64)
+            target_seqs[:, :-1] = Y
+            target_seqs[rows, y_lengths - 1] = self.end_id
+        else:
+            encode_seqs = np.zeros((len(indexes), x_max), dtype=np.int64)
+            decode_seqs = np.zeros((len(indexes), y_max), dtype=np.int64)
+            target_seqs = np.zeros((len(indexes), y_max), dtype=np.int64)
+            for row, index in enumerate(indexes):
+                x, y = self.X[index], self.Y[index]
+                encode_seqs[row, :len(x)] = x
+                decode_seqs[row, 0] = self.start_id
+                decode_seqs[row, 1:len(y) + 1] = y
+                target_seqs[row, :len(y)] = y
+                target_seqs[row, len(y)] = self.end_id
+        target_mask = (np.arange(y_max) < y_lengths[:, None]).astype(np.int64)
+        real_tokens = x_lengths.sum() + 2 * y_lengths.sum()
+        padded_tokens = encode_seqs.size + decode_seqs.size + target_seqs.size
+        return (encode_seqs, decode_seqs, target_seqs, target_mask), real_tokens, padded_tokens
+
+    # اگر حلقه آموزش زودتر تمام شود، stop_event تنظیم می‌شود و نخ سازنده منتظر جای خالی در صف نمی‌ماند.
+    def put(self, batch_queue, stop_event, item):
+        while not stop_event.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(self, epoch, batch_queue, stop_event):
+        try:
+            for indexes in self.get_batch_indexes(epoch):
+                if not self.put(batch_queue, stop_event, self.build_batch(indexes)):
+                    return
+        except Exception as e:
+            self.logger.exception(f'> Could not build training batches : {e}')
+            self.put(batch_queue, stop_event, e)
+            return
+        self.put(batch_queue, stop_event, self.end_of_epoch)
+
+    def iterate(self, epoch):
+        self.reset_stats()
+        batch_queue = queue.Queue(maxsize=self.prefetch)
+        stop_event = threading.Event()
+        producer = threading.Thread(target=self.produce, args=(epoch, batch_queue, stop_event), daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = batch_queue.get()
+                if item is self.end_of_epoch:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                batch, real_tokens, padded_tokens = item
+                self.real_tokens += real_tokens
+                self.padded_tokens += padded_tokens
+                self.example_count += len(batch[0])
+                yield batch
+        finally:
+            stop_event.set()
+            producer.join()
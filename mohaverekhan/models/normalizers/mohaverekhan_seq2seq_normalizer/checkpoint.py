@@ -0,0 +1,92 @@
+import os
+import pickle
+import random
+import logging
+import threading
+
+import numpy as np
+
+
+###############################################################################
+# نوشتن فایل‌های مدل و وضعیت آموزش در یک نخ دیگر
+# مقدار متغیرها با sess.run در همین نخ گرفته می‌شود و فقط نوشتن روی دیسک در پس‌زمینه انجام می‌شود، پس دوره بعد منتظر دیسک نمی‌ماند.
+# هر فایل اول در یک فایل موقت نوشته و سپس با os.replace جایگزین می‌شود، پس اگر آموزش وسط نوشتن متوقف شود فایل قبلی سالم می‌ماند.
+# در هر لحظه حداکثر یک نوشتن در انتظار است تا چند نسخه از متغیرها در حافظه جمع نشوند.
+class AsyncCheckpointWriter:
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self):
+        self.thread = None
+        self.error = None
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def write(self, write_function, path, *args):
+        try:
+            temp_path = f'{path}.tmp'
+            write_function(temp_path, *args)
+            os.replace(temp_path, path)
+            self.logger.info(f'> Checkpoint saved : {path}')
+        except Exception as e:
+            self.logger.exception(f'> Could not save checkpoint "{path}" : {e}')
+            self.error = e
+
+    def submit(self, write_function, path, *args):
+        self.wait()
+        self.thread = threading.Thread(target=self.write, args=(write_function, path) + args, daemon=True)
+        self.thread.start()
+
+    # همان قالب tl.files.save_npz، پس load_and_assign_npz و NumpySeq2Seq بدون تغییر آن را می‌خوانند.
+    def save_params(self, path, values):
+        params = np.empty(len(values), dtype=object)
+        for index, value in enumerate(values):
+            params[index] = value
+        def write_params(temp_path):
+            with open(temp_path, 'wb') as f:
+                np.savez(f, params=params)
+        self.submit(write_params, path)
+
+    def save_state(self, path, state):
+        def write_state(temp_path):
+            with open(temp_path, 'wb') as f:
+                pickle.dump(state, f, protocol=4)
+        self.submit(write_state, path)
+
+
+###############################################################################
+# وضعیت آموزش برای ادامه دادن بعد از توقف :
+# variables : مقدار تمام متغیرهای گراف، یعنی وزن‌های مدل، حافظه‌های Adam و توان‌های beta1 و beta2
+# epoch : تعداد دوره‌های کامل‌شده
+# best_valid_loss و bad_epochs : برای توقف زودهنگام
+# random_state : وضعیت مولدهای تصادفی random و numpy
+def get_training_state(sess, variables, **state):
+    values = sess.run(variables)
+    state['variables'] = {variable.name: value for variable, value in zip(variables, values)}
+    state['random_state'] = (random.getstate(), np.random.get_state())
+    return state
+
+
+def load_training_state(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def restore_training_state(sess, variables, state):
+    saved_values = state['variables']
+    missing_names = [variable.name for variable in variables if variable.name not in saved_values]
+    if missing_names:
+        raise Exception(f'Training state does not match the graph, missing variables : {missing_names}')
+    for variable in variables:
+        variable.load(saved_values[variable.name], sess)
+    python_state, numpy_state = state['random_state']
+    random.setstate(python_state)
+    np.random.set_state(numpy_state)
@@ -4,7 +4,10 @@ import os
 import logging
 
 import pickle
+import shutil
 import itertools
+import collections
+import multiprocessing
 from collections import defaultdict
 
 import numpy as np
@@ -72,6 +75,10 @@ def ddefault():
 def index_(tokenized_sentences, vocab_size):
     # get frequency distribution
     freq_dist = nltk.FreqDist(itertools.chain(*tokenized_sentences))
+    return index_freq_dist(freq_dist, vocab_size)
+
+
+def index_freq_dist(freq_dist, vocab_size):
     # get vocabulary of 'vocab_size' most used words
     vocab = freq_dist.most_common(vocab_size)
     # index2word
@@ -91,11 +98,9 @@ def filter_length(informals, formals):
     raw_data_len = len(informals)
 
     for i in range(0, len(informals) - 1):
-        inflen, flen = len(informals[i].split(' ')), len(formals[i].split(' '))
-        if inflen >= limit['mininf'] and inflen <= limit['maxinf']:
-            if flen >= limit['minf'] and flen <= limit['maxf']:
-                filtered_informals.append(informals[i])
-                filtered_formals.append(formals[i])
+        if is_in_length_limit(informals[i], formals[i]):
+            filtered_informals.append(informals[i])
+            filtered_formals.append(formals[i])
 
     # print the fraction of the original data, filtered
     filt_data_len = len(filtered_informals)
@@ -107,49 +112,46 @@ def filter_length(informals, formals):
     return filtered_informals, filtered_formals
 
 
+def is_in_length_limit(informal, formal):
+    inflen, flen = len(informal.split(' ')), len(formal.split(' '))
+    return limit['mininf'] <= inflen <= limit['maxinf'] and limit['minf'] <= flen <= limit['maxf']
+
+
 '''
  create the final dataset :
   - convert list of items to arrays of indices
   - add zero padding
-      return ( [array_en([indices]), array_ta([indices]) )
+      return ( array_inf([indices]), array_f([indices]), len_inf, len_f )
 
 '''
 def zero_pad(inftokenized, ftokenized, w2idx):
-    # num of rows
-    data_len = len(inftokenized)
-
-    # numpy arrays to store indices
-    idx_inf = np.zeros([data_len, limit['maxinf']], dtype=np.int32)
-    idx_f = np.zeros([data_len, limit['maxf']], dtype=np.int32)
-
-    for i in range(data_len):
-        inf_indices = pad_seq(inftokenized[i], w2idx, limit['maxinf'])
-        f_indices = pad_seq(ftokenized[i], w2idx, limit['maxf'])
-
-        #logger.info(len(idx_q[i]), len(q_indices))
-        #logger.info(len(idx_a[i]), len(a_indices))
-        idx_inf[i] = np.array(inf_indices)
-        idx_f[i] = np.array(f_indices)
-
-    return idx_inf, idx_f
+    idx_inf, len_inf = index_sequences(inftokenized, w2idx, limit['maxinf'])
+    idx_f, len_f = index_sequences(ftokenized, w2idx, limit['maxf'])
+    return idx_inf, idx_f, len_inf, len_f
 
 
 '''
- replace words with indices in a sequence
+ replace words with indices in all sequences at once
   replace with unknown if word not in lookup
-    return [list of indices]
+    return ( array([indices]) padded with zeros to maxlen, array(lengths) )
 
 '''
-def pad_seq(seq, lookup, maxlen):
-    indices = []
-    for word in seq:
-        if word in lookup:
-            indices.append(lookup[word])
-        else:
-            indices.append(lookup[UNK])
-    return indices + [0]*(maxlen - len(seq))
+# همه کلمه‌ها پشت سر هم گذاشته می‌شوند و pd.factorize به هر کلمه یکتا یک کد می‌دهد،
+# پس فقط کلمه‌های یکتا در lookup جست‌وجو می‌شوند و شناسه هر کلمه با یک اندیس‌گذاری آرایه‌ای به دست می‌آید.
+# سپس شناسه‌ها با جای سطر و ستونشان یک‌جا در آرایه صفر نوشته می‌شوند.
+def index_sequences(tokenized, lookup, maxlen):
+    lengths = np.fromiter((len(seq) for seq in tokenized), dtype=np.int32, count=len(tokenized))
+    indices = np.zeros([len(tokenized), maxlen], dtype=np.int32)
+    if lengths.sum() == 0:
+        return indices, lengths
+    codes, uniques = pd.factorize(np.fromiter(itertools.chain.from_iterable(tokenized), dtype=object))
+    unique_ids = np.array([lookup.get(word, lookup[UNK]) for word in uniques], dtype=np.int32)
+    offsets = np.cumsum(lengths) - lengths
+    rows = np.repeat(np.arange(len(tokenized)), lengths)
+    cols = np.arange(len(codes)) - np.repeat(offsets, lengths)
+    indices[rows, cols] = unique_ids[codes]
+    return indices, lengths
 
-    
 
 def log_sample(index, src, dest):
     logger.info(f'src[{index}] : {src[index]}')
@@ -195,98 +197,142 @@ def get_word_normals():
     formals.reverse()
     return informals, formals
 
-def get_data():
-    logger.info(f'>> Getting data...')
-    informals, formals = [], []
-    
-    text_informals, text_formals = get_text_normals()
-    word_informals, word_formals = get_word_normals()
-
-    count_dif = len(word_informals) - len(text_informals)
-    informals += word_informals[0:count_dif]
-    formals += word_formals[0:count_dif]
-    word_informals = word_informals[count_dif:]
-    word_formals = word_formals[count_dif:]
-    logger.info(f'> {len(word_informals)} == {len(text_informals)}')
-    for i in range(len(text_informals)):
-        informals += [text_informals[i], word_informals[i]]
-        formals += [text_formals[i], word_formals[i]]
-
-    logger.info(f'> len(informals) : {len(informals)}')
-    logger.info(f'> len(formals) : {len(formals)}')
-    logger.info(f'> {len(informals)} text + word normals exist for training.')
-    return informals, formals
-    
-
-def process_data():
-    try:
-        # informals, formals = read_from_excel()
-        informals, formals = get_data()
-
-        log_sample(20, informals, formals)
-        log_sample(21, informals, formals)
-        log_sample(-20, informals, formals)
-        log_sample(-21, informals, formals)
-
-        log_sample(-2, informals, formals)
-        log_sample(-1, informals, formals)
-
-
-        log_sample(-200, informals, formals)
-        log_sample(-201, informals, formals)
-
-        log_sample(-300, informals, formals)
-        log_sample(-301, informals, formals)
-
-
-        logger.info(f'informals[2327] : {informals[2327]}')
-        logger.info(f'formals[2327] : {formals[2327]}')
-        logger.info(f'informals[2328] : {informals[2328]}')
-        logger.info(f'formals[2328] : {formals[2328]}')
+###############################################################################
+# ساختن داده آموزش به صورت جریانی
+# جفت‌ها تکه تکه از پایگاه داده خوانده می‌شوند و هر تکه در یکی از پردازه‌های pool نرمال و بر اساس طول فیلتر می‌شود.
+# جفت‌های هر تکه در یک فایل shard جدا نوشته می‌شوند و فقط شمارش کلمه‌ها در حافظه می‌ماند.
+# بعد از ساختن واژگان، shardها یکی یکی خوانده و شناسه‌هایشان مستقیم در فایل‌های npy نوشته می‌شوند.
+# ترتیب جفت‌ها مثل قبل است: کلمه‌های اضافه و سپس یکی در میان متن و کلمه، هر دو از قدیمی به جدید.
+chunk_size = 2000
+shards_dir = os.path.join(current_dir, 'shards')
+
+
+def get_pair_chunks(chunk_size=chunk_size):
+    text_normals = TextNormal.objects.filter(is_valid=True).reverse()
+    word_normals = WordNormal.objects.filter(is_valid=True).reverse()
+    count_dif = max(word_normals.count() - text_normals.count(), 0)
+    text_pairs = text_normals.values_list('text__content', 'content').iterator(chunk_size=chunk_size)
+    word_pairs = word_normals.values_list('word__content', 'content').iterator(chunk_size=chunk_size)
+    pairs = itertools.chain(
+        itertools.islice(word_pairs, count_dif),
+        itertools.chain.from_iterable(zip(text_pairs, word_pairs))
+    )
+    while True:
+        chunk = list(itertools.islice(pairs, chunk_size))
+        if not chunk:
+            return
+        yield chunk
 
-        # filter out too long or too short sequences
-        logger.info('>> Filter length')
-        informals, formals = filter_length(informals, formals)
 
-        log_sample(30, informals, formals)
-        log_sample(130, informals, formals)
-        log_sample(-30, informals, formals)
-        log_sample(-130, informals, formals)
+# در پردازه فرزند اجرا می‌شود. پردازه‌ها با fork ساخته می‌شوند و نرمالایزر را از cache پردازه اصلی به ارث می‌برند.
+def normalize_pair_chunk(pairs):
+    normalizer = cache.normalizers['mohaverekhan-replacement-normalizer']
+    filtered_pairs = []
+    for informal, formal in pairs:
+        informal, formal = normalizer.normalize(informal), normalizer.normalize(formal)
+        if is_in_length_limit(informal, formal):
+            filtered_pairs.append((informal, formal))
+    return filtered_pairs, len(pairs)
+
+
+# Pool.imap کل ورودی را از پیش می‌خواند، پس حداکثر max_pending تکه به pool فرستاده می‌شود و نتیجه‌ها به همان ترتیب برگردانده می‌شوند.
+def normalize_pair_chunks(pair_chunks, n_jobs):
+    max_pending = 2 * n_jobs
+    with multiprocessing.get_context('fork').Pool(processes=n_jobs) as pool:
+        pending = collections.deque()
+        for pairs in pair_chunks:
+            pending.append(pool.apply_async(normalize_pair_chunk, (pairs,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def get_shard_path(index):
+    return os.path.join(shards_dir, f'pairs-{index:05d}.pkl')
+
+
+def write_shards(n_jobs):
+    if os.path.isdir(shards_dir):
+        shutil.rmtree(shards_dir)
+    os.makedirs(shards_dir)
+    # شمارش کلمه‌های غیر رسمی و رسمی جداست تا ترتیب کلمه‌های هم‌تکرار در واژگان مثل قبل باشد.
+    inf_freq_dist, f_freq_dist = nltk.FreqDist(), nltk.FreqDist()
+    raw_data_len, shard_lengths = 0, []
+    # pool پیش از خواندن جفت‌ها ساخته می‌شود و پردازه‌های فرزند از اتصال پایگاه داده استفاده نمی‌کنند.
+    for filtered_pairs, pair_count in normalize_pair_chunks(get_pair_chunks(), n_jobs):
+        raw_data_len += pair_count
+        if not filtered_pairs:
+            continue
+        for informal, formal in filtered_pairs:
+            inf_freq_dist.update(informal.split(' '))
+            f_freq_dist.update(formal.split(' '))
+        with open(get_shard_path(len(shard_lengths)), 'wb') as f:
+            pickle.dump(filtered_pairs, f)
+        shard_lengths.append(len(filtered_pairs))
+        logger.info(f'> ({len(shard_lengths)} shards)({sum(shard_lengths)} of {raw_data_len} pairs kept)')
+
+    filt_data_len = sum(shard_lengths)
+    logger.info(f'{raw_data_len - filt_data_len} of {raw_data_len} data filtered from original data')
+    inf_freq_dist.update(f_freq_dist)
+    return shard_lengths, inf_freq_dist
+
+
+def read_shard(index):
+    with open(get_shard_path(index), 'rb') as f:
+        return pickle.load(f)
+
+
+def write_index_arrays(shard_lengths, w2idx):
+    data_len = sum(shard_lengths)
+    idx_inf = np.lib.format.open_memmap(os.path.join(current_dir, 'idx_inf.npy'), mode='w+',
+                dtype=np.int32, shape=(data_len, limit['maxinf']))
+    idx_f = np.lib.format.open_memmap(os.path.join(current_dir, 'idx_f.npy'), mode='w+',
+                dtype=np.int32, shape=(data_len, limit['maxf']))
+    len_inf = np.zeros(data_len, dtype=np.int32)
+    len_f = np.zeros(data_len, dtype=np.int32)
+    offset = 0
+    for index, shard_length in enumerate(shard_lengths):
+        pairs = read_shard(index)
+        inftokenized = [ informal.split(' ') for informal, _ in pairs ]
+        ftokenized = [ formal.split(' ') for _, formal in pairs ]
+        rows = slice(offset, offset + shard_length)
+        idx_inf[rows], idx_f[rows], len_inf[rows], len_f[rows] = zero_pad(inftokenized, ftokenized, w2idx)
+        offset += shard_length
+    idx_inf.flush()
+    idx_f.flush()
+    np.save(os.path.join(current_dir, 'len_inf.npy'), len_inf)
+    np.save(os.path.join(current_dir, 'len_f.npy'), len_f)
+    return idx_inf, idx_f
 
-        # # data fixing
-        # logger.info('>> Fix data')
-        # informals, formals = fix_data(informals, formals)
 
-        # convert list of [lines of text] into list of [list of words ]
-        logger.info('>> Tokenized (Segment lines into words)')
-        inftokenized = [ wordlist.split(' ') for wordlist in informals ]
-        ftokenized = [ wordlist.split(' ') for wordlist in formals ]
+def process_data(n_jobs=None):
+    try:
+        n_jobs = n_jobs or os.cpu_count()
+        logger.info(f'>> Normalize, filter length and write shards with {n_jobs} processes')
+        shard_lengths, freq_dist = write_shards(n_jobs)
+        if not shard_lengths:
+            logger.error('error : no training pairs remained after filtering')
+            return
 
-        log_sample(10, inftokenized, ftokenized)
-        log_sample(90, inftokenized, ftokenized)
-        log_sample(-10, inftokenized, ftokenized)
-        log_sample(-90, inftokenized, ftokenized)
+        pairs = read_shard(0)
+        log_sample(0, *zip(*pairs))
+        log_sample(-1, *zip(*pairs))
 
         # indexing -> idx2w, w2idx : informal/formal
         logger.info(' >> Index words')
-        idx2w, w2idx, freq_dist = index_( inftokenized + ftokenized , vocab_size=VOCAB_SIZE)
+        idx2w, w2idx, freq_dist = index_freq_dist(freq_dist, vocab_size=VOCAB_SIZE)
 
         logger.info(f'idx2w[20] : {idx2w[20]}')
         logger.info(f'w2idx[idx2w[20]] : {w2idx[idx2w[20]]}')
 
-        logger.info(' >> Zero Padding')
-        idx_inf, idx_f = zero_pad(inftokenized, ftokenized, w2idx)
-
-        logger.info(f'idx_inf[67] : {idx_inf[67]}')
-        logger.info([idx2w[idx] for idx in idx_inf[67] if idx != 0])
-        logger.info(f'idx_f[67] : {idx_f[67]}')
-        logger.info([idx2w[idx] for idx in idx_f[67] if idx != 0])
-
+        logger.info(' >> Zero Padding and save numpy arrays to disk')
+        idx_inf, idx_f = write_index_arrays(shard_lengths, w2idx)
 
-        logger.info(' >> Save numpy arrays to disk')
-        # save them
-        np.save(os.path.join(current_dir, 'idx_inf.npy'), idx_inf)
-        np.save(os.path.join(current_dir, 'idx_f.npy'), idx_f)
+        logger.info(f'idx_inf[0] : {idx_inf[0]}')
+        logger.info([idx2w[idx] for idx in idx_inf[0] if idx != 0])
+        logger.info(f'idx_f[0] : {idx_f[0]}')
+        logger.info([idx2w[idx] for idx in idx_f[0] if idx != 0])
 
         # let us now save the necessary dictionaries
         metadata = {
@@ -309,7 +355,22 @@ def process_data():
 
 
 
-def load_data(PATH=''):
+'''
+ read only the data control dictionaries
+  the inference model needs the vocabulary, not the dataset
+    return dict(metadata)
+
+'''
+def load_metadata(PATH=''):
+    with open(PATH + 'metadata.pkl', 'rb') as f:
+        metadata = pickle.load(f)
+    # freq_dist is only used while building the vocabulary
+    metadata.pop('freq_dist', None)
+    return metadata
+
+
+# آرایه‌ها با mmap_mode باز می‌شوند، پس فقط سطرهایی که هر دسته لازم دارد از دیسک خوانده می‌شوند.
+def load_data(PATH='', mmap_mode='r'):
     # read data control dictionaries
     try:
         with open(PATH + 'metadata.pkl', 'rb') as f:
@@ -317,10 +378,28 @@ def load_data(PATH=''):
     except:
         metadata = None
     # read numpy arrays
-    idx_inf = np.load(PATH + 'idx_inf.npy')
-    idx_f = np.load(PATH + 'idx_f.npy')
+    idx_inf = np.load(PATH + 'idx_inf.npy', mmap_mode=mmap_mode)
+    idx_f = np.load(PATH + 'idx_f.npy', mmap_mode=mmap_mode)
     return metadata, idx_inf, idx_f
 
+
+'''
+ read the length of each sequence
+  older datasets have no length files, so lengths are counted from the padded arrays
+    return ( array(len_inf), array(len_f) )
+
+'''
+def load_lengths(PATH, idx_inf, idx_f):
+    try:
+        len_inf = np.load(PATH + 'len_inf.npy')
+        len_f = np.load(PATH + 'len_f.npy')
+    except FileNotFoundError:
+        logger.info('> Length files do not exist, counting lengths from the padded arrays.')
+        len_inf = (np.asarray(idx_inf) != 0).sum(axis=1).astype(np.int32)
+        len_f = (np.asarray(idx_f) != 0).sum(axis=1).astype(np.int32)
+    assert len(len_inf) == len(idx_inf) and len(len_f) == len(idx_f)
+    return len_inf, len_f
+
 import numpy as np
 from random import sample
 
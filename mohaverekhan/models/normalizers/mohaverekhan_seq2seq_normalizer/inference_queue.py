@@ -0,0 +1,96 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+from mohaverekhan import metrics
+
+
+###############################################################################
+# صف استنتاج دسته‌ای برای درخواست‌های هم‌زمان
+# هر درخواست متن خود را در صف می‌گذارد و یک Future می‌گیرد.
+# یک نخ جدا اولین درخواست را برمی‌دارد و تا max_wait ثانیه یا تا رسیدن به max_batch_size درخواست، درخواست‌های بعدی را هم جمع می‌کند.
+# سپس همه با یک فراخوانی batch_function رمزگشایی می‌شوند و نتیجه هر درخواست در Future خودش قرار می‌گیرد.
+# چون فقط همین نخ مدل را اجرا می‌کند، درخواست‌ها برای نشست TensorFlow با هم رقابت نمی‌کنند.
+# طول صف، اندازه دسته‌ها و زمان انتظار در صف در metrics ثبت می‌شوند.
+class InferenceQueue:
+
+    logger = logging.getLogger(__name__)
+    stop_item = object()
+
+    def __init__(self, batch_function, model_name, max_batch_size=32, max_wait=0.005):
+        self.batch_function = batch_function
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name=f'{self.model_name}-inference-queue', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            if self.thread is None:
+                return
+            self.requests.put(self.stop_item)
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, item):
+        future = Future()
+        self.start()
+        self.requests.put((item, future, time.perf_counter()))
+        metrics.record_value(self.model_name, 'queue_depth', self.requests.qsize())
+        return future
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout=timeout)
+
+    # اولین درخواست منتظر می‌ماند، درخواست‌هایی که از قبل در صف هستند بدون انتظار برداشته می‌شوند.
+    def collect_batch(self, first_request):
+        batch = [first_request]
+        deadline_ts = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline_ts - time.perf_counter()
+            try:
+                request = self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is self.stop_item:
+                self.requests.put(self.stop_item)
+                break
+            batch.append(request)
+        return batch
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is self.stop_item:
+                return
+            self.process_batch(self.collect_batch(request))
+
+    def process_batch(self, batch):
+        # درخواست‌هایی که Futureشان لغو شده است رمزگشایی نمی‌شوند.
+        batch = [request for request in batch if request[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        beg_ts = time.perf_counter()
+        metrics.record_value(self.model_name, 'batch_size', len(batch))
+        for _, _, enqueued_ts in batch:
+            metrics.record(self.model_name, 'queue_wait', beg_ts - enqueued_ts)
+        try:
+            with metrics.timer(self.model_name, 'queue_batch_inference'):
+                results = self.batch_function([item for item, _, _ in batch])
+        except Exception as e:
+            self.logger.exception(f'> Batch inference failed for {len(batch)} requests : {e}')
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
@@ -9,20 +9,43 @@ http://suriyadeepan.github.io/2016-12-31-practical-seq2seq/
 import time 
 import logging
 import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 import numpy as np
-import tensorflow as tf
-import tensorlayer as tl
 
 from tqdm import tqdm
-from sklearn.utils import shuffle
-from tensorlayer.layers import DenseLayer, EmbeddingInputlayer, Seq2Seq, retrieve_seq_length_op2
 
 from . import data
+from .batching import BucketedBatchLoader
+from .inference_queue import InferenceQueue
+from .normal_lexicon import NormalLexicon
+from .checkpoint import AsyncCheckpointWriter, get_training_state, load_training_state, restore_training_state
+from .numpy_engine import NumpySeq2Seq
 # from mohaverekhan import utils
 
 from mohaverekhan.models import Normalizer, Text, TextNormal
-from mohaverekhan import cache
+from mohaverekhan import cache, metrics
+
+
+###############################################################################
+# TensorFlow و TensorLayer فقط برای آموزش و موتور tensorflow لازم هستند و وارد کردن آن‌ها چند ثانیه طول می‌کشد.
+# پس وقتی وارد می‌شوند که برای اولین بار لازم شوند.
+tf, tl = None, None
+DenseLayer, EmbeddingInputlayer, Seq2Seq, retrieve_seq_length_op2 = None, None, None, None
+
+def import_tensorflow():
+    global tf, tl, DenseLayer, EmbeddingInputlayer, Seq2Seq, retrieve_seq_length_op2
+    if tf is not None:
+        return
+    import tensorflow
+    import tensorlayer
+    from tensorlayer.layers import DenseLayer, EmbeddingInputlayer, Seq2Seq, retrieve_seq_length_op2
+    tf, tl = tensorflow, tensorlayer
+
+
+# نشانه‌ای که با یکی از این حروف تمام شود، آخرین نشانه جمله است.
+sentence_end_characters = '!.?⸮؟'
 
 
 class MohaverekhanSeq2SeqNormalizer(Normalizer):
@@ -30,15 +53,42 @@ class MohaverekhanSeq2SeqNormalizer(Normalizer):
     class Meta:
         proxy = True
 
-    sess_config = None
-    inference, cleanup = None, None
+    inference, batch_inference, cleanup = None, None, None
+    inference_lock = threading.Lock()
+    # هر دسته یک نسخه از مدل را برمی‌دارد. نشست مدلی که کنار گذاشته شده است بعد از پایان آخرین دسته‌اش بسته می‌شود.
+    # inference_users : (شماره مدل)(تعداد دسته‌های در حال اجرا) و retired_cleanups : (شماره مدل)(cleanup) مدل‌های کنار گذاشته شده
+    inference_version = 0
     logger = logging.getLogger(__name__)
     current_dir = os.path.abspath(os.path.dirname(__file__))
     model_path = os.path.join(current_dir, 'model.npz')
+    training_state_path = os.path.join(current_dir, 'training_state.pkl')
+    emb_dim = 1024
+    seeds = ["بریم خونه",
+        "اونا میان",
+        "غذاش خیلی عالیه",
+        "نون",
+        "بازم ازش خرید میکنم، بهتریییییییییییییییییین منطقست.",
+        "چرا جدیدا اخر همه فیلما بی نتیجه تموم میشه الان تهش چی شد",
+        "اين دستگاه جزء اولين و شايد تنها سريه که تا الان از نسل چهارم سي پي يوهاي اينتل استفاده ميکنه"
+        ]
+
+    # موتور استنتاج : «tensorflow» یا «numpy»
+    inference_backend = os.environ.get('MOHAVEREKHAN_SEQ2SEQ_BACKEND', 'tensorflow')
+    # فقط برای موتور numpy : دقت ماتریس‌های embeddings و output و اندازه فهرست کوتاه کلمه‌های پرتکرار (۰ یعنی بدون فهرست کوتاه)
+    inference_precision = os.environ.get('MOHAVEREKHAN_SEQ2SEQ_PRECISION', 'float32')
+    inference_shortlist_size = int(os.environ.get('MOHAVEREKHAN_SEQ2SEQ_SHORTLIST', '0'))
+    # درخواست‌های هم‌زمان normalize در صف استنتاج جمع و با هم رمزگشایی می‌شوند.
+    inference_queue = None
+    inference_max_batch_size = int(os.environ.get('MOHAVEREKHAN_SEQ2SEQ_MAX_BATCH_SIZE', '32'))
+    inference_max_wait_ms = float(os.environ.get('MOHAVEREKHAN_SEQ2SEQ_MAX_WAIT_MS', '5'))
+    # حداکثر زمان انتظار یک درخواست normalize برای نتیجه‌های صف استنتاج (ثانیه)
+    inference_timeout = float(os.environ.get('MOHAVEREKHAN_SEQ2SEQ_INFERENCE_TIMEOUT', '60'))
+    # متن‌هایی که جفت‌های نرمال معتبر کاملا پاسخشان را دارند به مدل داده نمی‌شوند.
+    normal_lexicon = NormalLexicon()
 
-    sess_config = tf.ConfigProto(allow_soft_placement=True, log_device_placement=False)
     def __init__(self, *args, **kwargs):
         super(MohaverekhanSeq2SeqNormalizer, self).__init__(*args, **kwargs)
+        self.inference_users, self.retired_cleanups = {}, {}
         # if os.path.isfile(self.model_path):
         #     self.train(True)
     
@@ -51,17 +101,33 @@ class MohaverekhanSeq2SeqNormalizer(Normalizer):
     batch_size : Batch size for training on minibatches
     num_epochs : Number of epochs for training
     learning_rate : Learning rate to use when training model
+    resume : Continue from training_state.pkl (weights, Adam slots, epoch, RNG) if it exists
+    patience : Stop after this many epochs without a lower validation loss (0 disables early stopping)
+
+    model.npz always holds the weights with the lowest validation loss. Checkpoints are 
+    written in a background thread and training_state.pkl is removed when training ends normally.
     """
-    def train(self, inference_mode=False, batch_size=256, num_epochs=10, learning_rate=0.003):
-        if self.cleanup is not None:
-            self.cleanup()
+    def train(self, inference_mode=False, batch_size=256, num_epochs=10, learning_rate=0.003, resume=True, patience=3):
+        if inference_mode:
+            version, batch_inference = self.acquire_batch_inference()
+            try:
+                self.logger.info('Test : خونه')
+                sentence = batch_inference(['خونه'])[0]
+                self.logger.info(f' > {sentence}')
+            finally:
+                self.release_batch_inference(version)
+            return
+
+        import_tensorflow()
 
         self.logger.info(f'> inference_mode : {inference_mode}')
         self.logger.info(f'> batch_size : {batch_size}')
         self.logger.info(f'> num_epochs : {num_epochs}')
         self.logger.info(f'> learning_rate : {learning_rate}')
+        self.logger.info(f'> resume : {resume}')
+        self.logger.info(f'> patience : {patience}')
 
-        metadata, trainX, trainY, testX, testY, validX, validY = self.initial_setup()
+        metadata, trainX, trainY, testX, testY, validX, validY, lengths = self.initial_setup()
         # Parameters
         src_len = len(trainX)
         tgt_len = len(trainY)
@@ -73,26 +139,16 @@ class MohaverekhanSeq2SeqNormalizer(Normalizer):
         self.logger.info(f'len(validY) : {len(validY)}')
         assert src_len == tgt_len
 
-        n_step = src_len // batch_size
-        src_vocab_size = len(metadata['idx2w']) # 8002 (0~8001)
         self.logger.info(f"len(metadata['idx2w'] : {len(metadata['idx2w'])}")
         self.logger.info(f"len(metadata['w2idx'] : {len(metadata['w2idx'])}")
-        emb_dim = 1024
-
-        word2idx = metadata['w2idx']   # dict  word 2 index
-        idx2word = metadata['idx2w']   # list index 2 word
-
-        unk_id = word2idx['unk']   # 1
-        pad_id = word2idx['_']     # 0
-
-        start_id = src_vocab_size  # 8002
-        end_id = src_vocab_size + 1  # 8003
+        emb_dim = self.emb_dim
 
-        word2idx.update({'start_id': start_id})
-        word2idx.update({'end_id': end_id})
-        idx2word = idx2word + ['start_id', 'end_id']
-
-        src_vocab_size = tgt_vocab_size = src_vocab_size + 2
+        vocabulary = self.get_vocabulary(metadata)
+        word2idx = vocabulary['word2idx']
+        idx2word = vocabulary['idx2word']
+        start_id = vocabulary['start_id']
+        end_id = vocabulary['end_id']
+        src_vocab_size = tgt_vocab_size = vocabulary['vocab_size']
 
         """ A data for Seq2Seq should look like this:
         input_seqs : ['how', 'are', 'you', '<PAD_ID'>]
@@ -101,19 +157,20 @@ class MohaverekhanSeq2SeqNormalizer(Normalizer):
         target_mask : [1, 1, 1, 1, 0]
         """
         # Preprocessing
-        target_seqs = tl.prepro.sequences_add_end_id([trainY[10]], end_id=end_id)[0]
-        decode_seqs = tl.prepro.sequences_add_start_id([trainY[10]], start_id=start_id, remove_last=False)[0]
+        train_x_lengths, train_y_lengths = lengths['train']
+        sample_x, sample_y = trainX[10][:train_x_lengths[10]].tolist(), trainY[10][:train_y_lengths[10]].tolist()
+        target_seqs = tl.prepro.sequences_add_end_id([sample_y], end_id=end_id)[0]
+        decode_seqs = tl.prepro.sequences_add_start_id([sample_y], start_id=start_id, remove_last=False)[0]
         target_mask = tl.prepro.sequences_get_mask([target_seqs])[0]
-        if not inference_mode:
-            self.logger.info(f'encode_seqs {[idx2word[id] for id in trainX[10]]}')
-            self.logger.info(f'target_seqs {[idx2word[id] for id in target_seqs]}')
-            self.logger.info(f'decode_seqs {[idx2word[id] for id in decode_seqs]}')
-            self.logger.info(f'target_mask {target_mask}')
-            self.logger.info(f'{len(target_seqs)} {len(decode_seqs)} {len(target_mask)}')
+        self.logger.info(f'encode_seqs {[idx2word[id] for id in sample_x]}')
+        self.logger.info(f'target_seqs {[idx2word[id] for id in target_seqs]}')
+        self.logger.info(f'decode_seqs {[idx2word[id] for id in decode_seqs]}')
+        self.logger.info(f'target_mask {target_mask}')
+        self.logger.info(f'{len(target_seqs)} {len(decode_seqs)} {len(target_mask)}')
 
         # Init Session
         tf.reset_default_graph()
-        sess = tf.Session(config=self.sess_config)
+        sess = tf.Session(config=self.get_sess_config())
         # Training Data Placeholders
         encode_seqs = tf.placeholder(dtype=tf.int64, shape=[batch_size, None], name="encode_seqs")
         decode_seqs = tf.placeholder(dtype=tf.int64, shape=[batch_size, None], name="decode_seqs")
@@ -130,8 +187,11 @@ class MohaverekhanSeq2SeqNormalizer(Normalizer):
         self.logger.info(f' src_vocab_size : {src_vocab_size}')
         self.logger.info(f' emb_dim : {emb_dim}')
         # Inference Data Placeholders
-        encode_seqs2 = tf.placeholder(dtype=tf.int64, shape=[1, None], name="encode_seqs")
-        decode_seqs2 = tf.placeholder(dtype=tf.int64, shape=[1, None], name="decode_seqs")
+        # گراف استنتاج برای محاسبه خطای validation و رمزگشایی دسته‌ای جمله‌های نمونه هم استفاده می‌شود.
+        encode_seqs2 = tf.placeholder(dtype=tf.int64, shape=[None, None], name="encode_seqs")
+        decode_seqs2 = tf.placeholder(dtype=tf.int64, shape=[None, None], name="decode_seqs")
+        target_seqs2 = tf.placeholder(dtype=tf.int64, shape=[None, None], name="target_seqs")
+        target_mask2 = tf.placeholder(dtype=tf.int64, shape=[None, None], name="target_mask")
         self.logger.info(f' encode_seqs2 : {encode_seqs2}')
         self.logger.info(f' decode_seqs2 : {decode_seqs2}')
 
@@ -148,6 +208,8 @@ class MohaverekhanSeq2SeqNormalizer(Normalizer):
         loss = tl.cost.cross_entropy_seq_with_mask(logits=net_out.outputs, target_seqs=target_seqs, 
                                                     input_mask=target_mask, return_details=False, name='cost')
         self.logger.info(f'loss : {loss}')
+        valid_loss = tl.cost.cross_entropy_seq_with_mask(logits=net.outputs, target_seqs=target_seqs2, 
+                                                    input_mask=target_mask2, return_details=False, name='valid_cost')
 
         # Optimizer
         train_op = tf.train.AdamOptimizer(learning_rate=learning_rate).minimize(loss)
@@ -157,107 +219,446 @@ class MohaverekhanSeq2SeqNormalizer(Normalizer):
         self.logger.info(f'sess_run : {sess_run}')
 
         # Load Model
-        self.logger.info(f'model_path : {self.model_path}')
-        load_and_assign_npz = tl.files.load_and_assign_npz(sess=sess, name=self.model_path, network=net)
-        self.logger.info(f'load_and_assign_npz : {load_and_assign_npz}')
+        variables = tf.global_variables()
+        training_state = load_training_state(self.training_state_path) if resume else None
+        if training_state is not None:
+            restore_training_state(sess, variables, training_state)
+            start_epoch = training_state['epoch']
+            best_valid_loss, bad_epochs = training_state['best_valid_loss'], training_state['bad_epochs']
+            self.logger.info(f'> Resumed from {self.training_state_path} : (epoch)({start_epoch})'
+                            f'(best_valid_loss)({best_valid_loss})(bad_epochs)({bad_epochs})')
+        else:
+            self.logger.info(f'model_path : {self.model_path}')
+            load_and_assign_npz = tl.files.load_and_assign_npz(sess=sess, name=self.model_path, network=net)
+            self.logger.info(f'load_and_assign_npz : {load_and_assign_npz}')
+            start_epoch, best_valid_loss, bad_epochs = 0, None, 0
+
+        # رمزگشای جمله‌های نمونه فقط مال همین نشست آموزش است و مدل استنتاجی که درخواست‌ها را پاسخ می‌دهد دست نمی‌خورد.
+        decode_ids = self.create_tensorflow_decoder(sess, net, net_rnn, y, encode_seqs2, decode_seqs2, vocabulary)
+        _, training_batch_inference = self.create_inference_function(decode_ids, vocabulary)
+
+        batch_loader = BucketedBatchLoader(trainX, trainY, batch_size, start_id, end_id, 
+                            x_lengths=train_x_lengths, y_lengths=train_y_lengths)
+        valid_x_lengths, valid_y_lengths = lengths['valid']
+        valid_loader = BucketedBatchLoader(validX, validY, max(min(batch_size, len(validX)), 1), start_id, end_id, 
+                            x_lengths=valid_x_lengths, y_lengths=valid_y_lengths)
+        checkpoint_writer = AsyncCheckpointWriter()
+        try:
+            for epoch in range(start_epoch, num_epochs):
+                total_loss, n_iter = 0, 0
+                for X, _decode_seqs, _target_seqs, _target_mask in tqdm(batch_loader.iterate(epoch), 
+                                total=batch_loader.batch_count, desc='Epoch[{}/{}]'.format(epoch + 1, num_epochs), leave=False):
+
+                    ## Uncomment to view the data here
+                    # for i in range(len(X)):
+                    #     self.logger.info(i, [idx2word[id] for id in X[i]])
+                    #     self.logger.info(i, [idx2word[id] for id in Y[i]])
+                    #     self.logger.info(i, [idx2word[id] for id in _target_seqs[i]])
+                    #     self.logger.info(i, [idx2word[id] for id in _decode_seqs[i]])
+                    #     self.logger.info(i, _target_mask[i])
+                    #     self.logger.info(len(_target_seqs[i]), len(_decode_seqs[i]), len(_target_mask[i]))
+                    _, loss_iter = sess.run([train_op, loss], {encode_seqs: X, decode_seqs: _decode_seqs,
+                                    target_seqs: _target_seqs, target_mask: _target_mask})
+                    total_loss += loss_iter
+                    n_iter += 1
+
+                # printing average loss after every epoch
+                self.logger.info('Epoch [{}/{}]: loss {:.4f}'.format(epoch + 1, num_epochs, total_loss / max(n_iter, 1)))
+                self.logger.info(f'> (Padding efficiency)({batch_loader.get_padding_efficiency():.3f})'
+                                f'(Examples per second)({batch_loader.get_examples_per_second():.1f})')
+
+                epoch_valid_loss = self.evaluate(sess, valid_loss, (encode_seqs2, decode_seqs2, target_seqs2, target_mask2), 
+                                                valid_loader)
+                self.logger.info(f'> (Epoch)({epoch + 1})(valid_loss)({epoch_valid_loss})(best_valid_loss)({best_valid_loss})')
+
+                # فقط وزن‌هایی که خطای validation را کمتر کرده‌اند در model.npz نوشته می‌شوند.
+                if epoch_valid_loss is None or best_valid_loss is None or epoch_valid_loss < best_valid_loss:
+                    best_valid_loss, bad_epochs = epoch_valid_loss, 0
+                    checkpoint_writer.save_params(self.model_path, sess.run(net.all_params))
+                    for seed, sentence in zip(self.seeds, training_batch_inference(self.seeds)):
+                        self.logger.info(f'> {seed} : {sentence}')
+                else:
+                    bad_epochs += 1
+
+                checkpoint_writer.save_state(self.training_state_path, get_training_state(sess, variables, 
+                    epoch=epoch + 1, best_valid_loss=best_valid_loss, bad_epochs=bad_epochs))
+
+                if patience and bad_epochs >= patience:
+                    self.logger.info(f'> Early stopping : validation loss has not improved for {bad_epochs} epochs.')
+                    break
+        finally:
+            checkpoint_writer.wait()
+        # آموزش کامل شده است، پس اجرای بعدی از model.npz شروع می‌شود.
+        if os.path.isfile(self.training_state_path):
+            os.remove(self.training_state_path)
+        self.logger.info(f'> Seq2Seq training session destroyed.')
+        sess.close()
+        # مدل استنتاج دفعه بعد از روی model.npz جدید ساخته می‌شود.
+        self.unload_inference_model()
+
+
+    # میانگین خطای جمله‌های validation، وزن هر دسته تعداد نشانه‌های واقعی آن است.
+    def evaluate(self, sess, loss, placeholders, batch_loader):
+        if batch_loader.batch_count == 0:
+            return None
+        total_loss, total_tokens = 0.0, 0
+        for batch in batch_loader.iterate(0):
+            loss_iter = sess.run(loss, dict(zip(placeholders, batch)))
+            tokens = batch[3].sum()
+            total_loss += loss_iter * tokens
+            total_tokens += tokens
+        return total_loss / total_tokens
 
-        """
-        Inference using pre-trained model
-        """
-        def inference_function(seed):
-            self.logger.info(f'> {seed}')
-            seed_id = [word2idx.get(w, unk_id) for w in seed.split(" ")]
-            
+    """
+    Vocabulary
+
+    start_id and end_id are appended after the words of metadata.
+    """
+    def get_vocabulary(self, metadata):
+        word2idx = metadata['w2idx']   # dict  word 2 index
+        idx2word = metadata['idx2w']   # list index 2 word
+        vocab_size = len(idx2word)
+
+        start_id = vocab_size
+        end_id = vocab_size + 1
+        word2idx.update({'start_id': start_id})
+        word2idx.update({'end_id': end_id})
+
+        return {
+            'word2idx': word2idx,
+            'idx2word': idx2word + ['start_id', 'end_id'],
+            'unk_id': word2idx['unk'],
+            'pad_id': word2idx['_'],
+            'start_id': start_id,
+            'end_id': end_id,
+            'vocab_size': vocab_size + 2,
+        }
+
+    """
+    In-graph greedy decoding
+
+    The whole decode loop is a tf.while_loop, so a batch of sentences costs one sess.run.
+    Each step does the LSTMCell math of the 3 decoder layers with their trained weights, 
+    takes the argmax of the output logits and feeds it back. There is no softmax and no sort.
+    Like dynamic_rnn with a zero decode length, feeding pad_id keeps the state and gives zero outputs.
+    The first word is always kept, then a sentence finishes on end_id or after len(seed) + 10 steps.
+    """
+    def create_decode_loop(self, net, encode_seqs, final_state_encode, vocabulary):
+        params = {param.name: param for param in net.all_params}
+        embeddings = params['model/embedding/seq_embedding/embeddings:0']
+        output_W, output_b = params['model/output/W:0'], params['model/output/b:0']
+        decode_params = [param for param in net.all_params if '/decode/' in param.name]
+        decode_layers = list(zip(decode_params[0::2], decode_params[1::2])) # (kernel, bias) for each cell
+        pad_id, start_id, end_id = vocabulary['pad_id'], vocabulary['start_id'], vocabulary['end_id']
+
+        batch_size = tf.shape(encode_seqs)[0]
+        max_lengths = tf.cast(retrieve_seq_length_op2(encode_seqs), tf.int32) + 10
+        max_steps = tf.reduce_max(max_lengths) + 1
+
+        def condition(step, w_ids, states, is_finished, lengths, outputs):
+            return tf.logical_and(step < max_steps, tf.logical_not(tf.reduce_all(is_finished)))
+
+        def body(step, w_ids, states, is_finished, lengths, outputs):
+            is_pad = tf.equal(w_ids, pad_id)
+            x = tf.nn.embedding_lookup(embeddings, w_ids)
+            next_states = []
+            for (kernel, bias), (c, h) in zip(decode_layers, states):
+                i, j, f, o = tf.split(tf.matmul(tf.concat([x, h], 1), kernel) + bias, 4, axis=1)
+                next_c = tf.sigmoid(f + 1.0) * c + tf.sigmoid(i) * tf.tanh(j) # forget_bias = 1.0
+                next_h = tf.sigmoid(o) * tf.tanh(next_c)
+                next_states.append(tf.nn.rnn_cell.LSTMStateTuple(
+                    tf.where(is_pad, c, next_c), tf.where(is_pad, h, next_h)))
+                x = next_h
+            logits = tf.matmul(tf.where(is_pad, tf.zeros_like(x), x), output_W) + output_b
+            w_ids = tf.argmax(logits, axis=1)
+            is_finished = tf.logical_or(is_finished, tf.logical_and(step > 0, tf.logical_or(
+                step - 1 >= max_lengths, tf.equal(w_ids, end_id))))
+            lengths += tf.cast(tf.logical_not(is_finished), tf.int32)
+            return step + 1, w_ids, tuple(next_states), is_finished, lengths, outputs.write(step, w_ids)
+
+        _, _, _, _, lengths, outputs = tf.while_loop(condition, body, loop_vars=(
+            tf.constant(0), 
+            tf.fill([batch_size], tf.constant(start_id, dtype=tf.int64)), 
+            tuple(final_state_encode), 
+            tf.zeros([batch_size], dtype=tf.bool), 
+            tf.zeros([batch_size], dtype=tf.int32), 
+            tf.TensorArray(dtype=tf.int64, size=0, dynamic_size=True)))
+        return tf.transpose(outputs.stack()), lengths
+
+    """
+    Inference using pre-trained model
+
+    Greedy decoding of a batch of sentences in lockstep. The sentences are padded with pad_id and
+    encoded together. With in_graph, create_decode_loop decodes them in one sess.run, 
+    otherwise every step feeds the last word of all sentences in its own sess.run.
+    A sentence that reached end_id or its max length (len(seed) + 10) is finished and its 
+    later words are ignored, so each result equals decoding that sentence alone.
+    create_tensorflow_decoder must be called in the graph of the model.
+    """
+    def create_tensorflow_decoder(self, sess, net, net_rnn, y, encode_seqs2, decode_seqs2, vocabulary):
+        start_id, end_id = vocabulary['start_id'], vocabulary['end_id']
+        decoded_ids, decoded_lengths = self.create_decode_loop(net, encode_seqs2, net_rnn.final_state_encode, vocabulary)
+
+        def step_decode(encode_ids, max_lengths):
             # Encode and get state
             state = sess.run(net_rnn.final_state_encode,
-                            {encode_seqs2: [seed_id]})
+                            {encode_seqs2: encode_ids})
             # Decode, feed start_id and get first word [https://github.com/zsdonghao/tensorlayer/blob/master/example/tutorial_ptb_lstm_state_is_tuple.py]
             o, state = sess.run([y, net_rnn.final_state_decode],
                             {net_rnn.initial_state_decode: state,
-                            decode_seqs2: [[start_id]]})
-            w_id = tl.nlp.sample_top(o[0], top_k=1)
-            w = idx2word[w_id]
+                            decode_seqs2: np.full((len(encode_ids), 1), start_id, dtype=np.int64)})
+            w_ids = o.argmax(axis=1)
+            sentences = [[w_id] for w_id in w_ids]
             # Decode and feed state iteratively
-            sentence = [w]
-            for _ in range(len(seed_id) + 10): # max sentence length
+            is_finished = np.zeros(len(encode_ids), dtype=bool)
+            for step in range(max_lengths.max()):
+                is_finished |= step >= max_lengths
+                if is_finished.all():
+                    break
                 o, state = sess.run([y, net_rnn.final_state_decode],
                                 {net_rnn.initial_state_decode: state,
-                                decode_seqs2: [[w_id]]})
-                w_id = tl.nlp.sample_top(o[0], top_k=1)
-                w = idx2word[w_id]
-                if w_id == end_id:
-                    break
-                sentence = sentence + [w]
-            return " ".join([word for word in sentence if word is not '_'])
+                                decode_seqs2: w_ids.reshape(-1, 1)})
+                w_ids = o.argmax(axis=1)
+                is_finished |= w_ids == end_id
+                for index in np.flatnonzero(~is_finished):
+                    sentences[index].append(w_ids[index])
+            return sentences
+
+        def decode_ids(encode_ids, max_lengths, in_graph=True):
+            if not in_graph:
+                return step_decode(encode_ids, max_lengths)
+            w_ids, lengths = sess.run([decoded_ids, decoded_lengths], {encode_seqs2: encode_ids})
+            return [w_ids[index, :lengths[index]] for index in range(len(encode_ids))]
+
+        return decode_ids
+
+    # decode_ids شناسه‌های جمله‌های پرشده و حداکثر طول هر جمله را می‌گیرد و شناسه‌های خروجی هر جمله را برمی‌گرداند.
+    def create_inference_function(self, decode_ids, vocabulary):
+        word2idx, idx2word = vocabulary['word2idx'], vocabulary['idx2word']
+        unk_id, pad_id = vocabulary['unk_id'], vocabulary['pad_id']
+
+        def batch_inference_function(seeds, **decode_options):
+            seed_ids = [[word2idx.get(w, unk_id) for w in seed.split(" ")] for seed in seeds]
+            max_lengths = np.array([len(seed_id) + 10 for seed_id in seed_ids]) # max sentence length
+            encode_ids = np.full((len(seed_ids), max(map(len, seed_ids))), pad_id, dtype=np.int64)
+            for index, seed_id in enumerate(seed_ids):
+                encode_ids[index, :len(seed_id)] = seed_id
+
+            sentences = decode_ids(encode_ids, max_lengths, **decode_options)
+            return [" ".join([word for word in (idx2word[w_id] for w_id in sentence) if word != '_']) for sentence in sentences]
 
-        def cleanup_function():
-            # session cleanup
-            sess.close()
+        def inference_function(seed):
+            return batch_inference_function([seed])[0]
 
-        self.inference = inference_function
-        self.cleanup = cleanup_function
+        return inference_function, batch_inference_function
 
-        if inference_mode:
-            self.logger.info('Test : خونه')
-            sentence = self.inference('خونه')
-            self.logger.info(f' > {sentence}')
-            return
+    def get_sess_config(self):
+        return tf.ConfigProto(allow_soft_placement=True, log_device_placement=False)
 
-        seeds = ["بریم خونه",
-                    "اونا میان",
-                    "غذاش خیلی عالیه",
-                    "نون",
-                    "بازم ازش خرید میکنم، بهتریییییییییییییییییین منطقست.",
-                    "چرا جدیدا اخر همه فیلما بی نتیجه تموم میشه الان تهش چی شد",
-                    "اين دستگاه جزء اولين و شايد تنها سريه که تا الان از نسل چهارم سي پي يوهاي اينتل استفاده ميکنه"
-                    ]
-        for epoch in range(num_epochs):
-            # try:
-            trainX, trainY = shuffle(trainX, trainY, random_state=0)
-            total_loss, n_iter = 0, 0
-            for X, Y in tqdm(tl.iterate.minibatches(inputs=trainX, targets=trainY, batch_size=batch_size, shuffle=False), 
-                            total=n_step, desc='Epoch[{}/{}]'.format(epoch + 1, num_epochs), leave=False):
-
-                X = tl.prepro.pad_sequences(X)
-                _target_seqs = tl.prepro.sequences_add_end_id(Y, end_id=end_id)
-                _target_seqs = tl.prepro.pad_sequences(_target_seqs)
-                _decode_seqs = tl.prepro.sequences_add_start_id(Y, start_id=start_id, remove_last=False)
-                _decode_seqs = tl.prepro.pad_sequences(_decode_seqs)
-                _target_mask = tl.prepro.sequences_get_mask(_target_seqs)
-                ## Uncomment to view the data here
-                # for i in range(len(X)):
-                #     self.logger.info(i, [idx2word[id] for id in X[i]])
-                #     self.logger.info(i, [idx2word[id] for id in Y[i]])
-                #     self.logger.info(i, [idx2word[id] for id in _target_seqs[i]])
-                #     self.logger.info(i, [idx2word[id] for id in _decode_seqs[i]])
-                #     self.logger.info(i, _target_mask[i])
-                #     self.logger.info(len(_target_seqs[i]), len(_decode_seqs[i]), len(_target_mask[i]))
-                _, loss_iter = sess.run([train_op, loss], {encode_seqs: X, decode_seqs: _decode_seqs,
-                                target_seqs: _target_seqs, target_mask: _target_mask})
-                total_loss += loss_iter
-                n_iter += 1
-
-            # printing average loss after every epoch
-            self.logger.info('Epoch [{}/{}]: loss {:.4f}'.format(epoch + 1, num_epochs, total_loss / n_iter))
-            
-            # inference after every epoch
-            for seed in seeds:
-                # self.logger.info(f'Query > {seed}')
-                # for _ in range(3):
-                sentence = self.inference(seed)
-                self.logger.info(f'> {sentence}')
-            
-            self.logger.info(f'> seq2seq model saved.')
-            # saving the model
-            tl.files.save_npz(net.all_params, name=self.model_path, sess=sess)
-            # except Exception as e:
-                # self.logger.exception(f'> Exception : {e}')
-                # self.logger.info(f'> Seq2Seq training session destroyed.')
-                # sess.close()
-                # return
-        self.logger.info(f'> Seq2Seq training session destroyed.')
-        sess.close()
+    """
+    Inference-only loading
+
+    Only model.npz and the vocabulary of metadata.pkl are read. The training data, the training 
+    graph and the optimizer are not needed for serving requests.
+    The tensorflow backend builds only the [None, None] inference graph in its own tf.Graph.
+    The numpy backend runs the same model with NumPy and does not import TensorFlow at all.
+    """
+    def load_vocabulary(self):
+        metadata = data.load_metadata(PATH=f'{self.current_dir}/')
+        return self.get_vocabulary(metadata)
+
+    def load_tensorflow_decoder(self, vocabulary):
+        import_tensorflow()
+        graph = tf.Graph()
+        with graph.as_default():
+            encode_seqs2 = tf.placeholder(dtype=tf.int64, shape=[None, None], name="encode_seqs")
+            decode_seqs2 = tf.placeholder(dtype=tf.int64, shape=[None, None], name="decode_seqs")
+            net, net_rnn = self.create_model(encode_seqs2, decode_seqs2, vocabulary['vocab_size'], 
+                                            self.emb_dim, is_train=False, reuse=False)
+            y = tf.nn.softmax(net.outputs)
+            sess = tf.Session(graph=graph, config=self.get_sess_config())
+            tl.files.load_and_assign_npz(sess=sess, name=self.model_path, network=net)
+            decode_ids = self.create_tensorflow_decoder(sess, net, net_rnn, y, encode_seqs2, decode_seqs2, vocabulary)
+        graph.finalize()
+        return decode_ids, sess.close
+
+    # شناسه کلمه‌های رسمی هر کلمه غیر رسمی در جفت‌های معتبر WordNormal
+    def get_word_normal_ids(self, vocabulary):
+        word2idx, unk_id = vocabulary['word2idx'], vocabulary['unk_id']
+        word_normal_ids = {}
+        informals, formals = data.get_word_normals()
+        for informal, formal in zip(informals, formals):
+            formal_ids = {word2idx.get(w, unk_id) for w in formal.split(' ')}
+            for w in informal.split(' '):
+                word_normal_ids.setdefault(word2idx.get(w, unk_id), set()).update(formal_ids)
+        return {w_id: np.array(sorted(ids), dtype=np.int64) for w_id, ids in word_normal_ids.items()}
+
+    # فهرست کوتاه هر جمله : کلمه‌های خود جمله، کلمه‌های رسمی آن‌ها در WordNormal و shortlist_size کلمه پرتکرار
+    # idx2w بعد از «_» و «unk» به ترتیب تکرار مرتب شده است، پس کلمه‌های پرتکرار همان شناسه‌های ۲ به بعد هستند.
+    def create_shortlist_function(self, vocabulary, shortlist_size, word_normal_ids):
+        frequent_ids = np.arange(2, min(2 + shortlist_size, vocabulary['start_id']), dtype=np.int64)
+        empty_ids = np.array([], dtype=np.int64)
+
+        def shortlist_function(encode_ids):
+            candidates = []
+            for row in encode_ids:
+                input_ids = np.unique(row[row > 0])
+                candidates.append(np.unique(np.concatenate(
+                    [frequent_ids, input_ids] + [word_normal_ids.get(w_id, empty_ids) for w_id in input_ids])))
+            return candidates
+
+        return shortlist_function
+
+    def load_numpy_decoder(self, vocabulary, precision=None, shortlist_size=None, word_normal_ids=None):
+        precision = precision or self.inference_precision
+        shortlist_size = self.inference_shortlist_size if shortlist_size is None else shortlist_size
+        engine = NumpySeq2Seq(self.model_path, vocabulary, precision=precision)
+        shortlist_function = None
+        if shortlist_size:
+            if word_normal_ids is None:
+                word_normal_ids = self.get_word_normal_ids(vocabulary)
+            shortlist_function = self.create_shortlist_function(vocabulary, shortlist_size, word_normal_ids)
+
+        def decode_ids(encode_ids, max_lengths):
+            candidates = shortlist_function(encode_ids) if shortlist_function else None
+            return engine.decode(encode_ids, max_lengths, candidates=candidates)
+
+        return decode_ids, lambda: None
+
+    def load_inference_model(self, backend=None):
+        backend = backend or self.inference_backend
+        with self.inference_lock:
+            if self.inference is not None:
+                return
+            if not os.path.isfile(self.model_path):
+                raise Exception(f'Seq2seq model "{self.model_path}" does not exist, train the normalizer first.')
+            beg_ts = time.time()
+            self.logger.info(f'>> Trying to load {backend} inference model from "{self.model_path}"')
+            vocabulary = self.load_vocabulary()
+            if backend == 'numpy':
+                decode_ids, cleanup_function = self.load_numpy_decoder(vocabulary)
+            else:
+                decode_ids, cleanup_function = self.load_tensorflow_decoder(vocabulary)
+            self.cleanup = cleanup_function
+            self.inference, self.batch_inference = self.create_inference_function(decode_ids, vocabulary)
+            self.inference_version += 1
+            self.logger.info(f'> Inference model loaded in {time.time() - beg_ts:.3f}s')
+
+    # مدل فعلی کنار گذاشته می‌شود. اگر دسته‌ای هنوز با آن کار می‌کند، نشستش بعد از پایان آن دسته بسته می‌شود.
+    def unload_inference_model(self):
+        with self.inference_lock:
+            if self.inference is None:
+                return
+            version, cleanup = self.inference_version, self.cleanup
+            self.inference, self.batch_inference, self.cleanup = None, None, None
+            if self.inference_users.get(version):
+                self.retired_cleanups[version] = cleanup
+                self.logger.info(f'> Inference model {version} retired, it is closed after its running batches.')
+                return
+        cleanup()
+        self.logger.info(f'> Inference model {version} unloaded.')
+
+    # خروجی : (شماره مدل)(batch_inference)، اگر مدلی بارگذاری نشده باشد ابتدا بارگذاری می‌شود.
+    def acquire_batch_inference(self):
+        while True:
+            with self.inference_lock:
+                if self.batch_inference is not None:
+                    version = self.inference_version
+                    self.inference_users[version] = self.inference_users.get(version, 0) + 1
+                    return version, self.batch_inference
+            self.load_inference_model()
+
+    def release_batch_inference(self, version):
+        with self.inference_lock:
+            self.inference_users[version] -= 1
+            if self.inference_users[version]:
+                return
+            del self.inference_users[version]
+            cleanup = self.retired_cleanups.pop(version, None)
+        if cleanup is not None:
+            cleanup()
+            self.logger.info(f'> Inference model {version} closed after its last batch.')
+
+    def run_batch_inference(self, text_contents):
+        version, batch_inference = self.acquire_batch_inference()
+        try:
+            return batch_inference(text_contents)
+        finally:
+            self.release_batch_inference(version)
+
+    # رمزگشایی کلمه به کلمه، رمزگشایی داخل گراف و موتور NumPy را روی جمله‌های نمونه مقایسه می‌کند.
+    # خروجی رمزگشایی کلمه به کلمه مرجع است و تعداد خروجی‌های متفاوت هر روش هم گزارش می‌شود.
+    def compare_decoders(self, seeds=None, repeat=5):
+        seeds = seeds or self.seeds
+        vocabulary = self.load_vocabulary()
+        tensorflow_decode_ids, tensorflow_cleanup = self.load_tensorflow_decoder(vocabulary)
+        numpy_decode_ids, _ = self.load_numpy_decoder(vocabulary)
+        decoders = {
+            'step': (tensorflow_decode_ids, {'in_graph': False}),
+            'in_graph': (tensorflow_decode_ids, {'in_graph': True}),
+            'numpy': (numpy_decode_ids, {}),
+        }
+        report, references = {}, None
+        try:
+            for name, (decode_ids, decode_options) in decoders.items():
+                _, batch_inference = self.create_inference_function(decode_ids, vocabulary)
+                beg_ts = time.perf_counter()
+                for _ in range(repeat):
+                    results = [batch_inference([seed], **decode_options)[0] for seed in seeds]
+                elapsed = time.perf_counter() - beg_ts
+                references = references or results
+                report[name] = {
+                    'latency_ms': elapsed * 1000 / (repeat * len(seeds)),
+                    'mismatches': sum(result != reference for result, reference in zip(results, references)),
+                }
+                self.logger.info(f"> ({name})(Latency per sentence {report[name]['latency_ms']:.2f}ms)(mismatches {report[name]['mismatches']})")
+        finally:
+            tensorflow_cleanup()
+        return report
+
+    """
+    Accuracy vs latency of the reduced-precision and shortlist options
 
+    Every precision is decoded with the full output layer and with the shortlist on the first 
+    sample_size sentences of the validation split. Accuracy is measured against the formal targets 
+    and agreement against the float32 full-output decoding.
+    """
+    def report_reduced_precision(self, sample_size=500, shortlist_size=2000, batch_size=32):
+        vocabulary = self.load_vocabulary()
+        word_normal_ids = self.get_word_normal_ids(vocabulary)
+        _, idx_inf, idx_f = data.load_data(PATH=f'{self.current_dir}/')
+        _, _, (validX, validY) = data.split_dataset(idx_inf, idx_f)
+        validX, validY = validX[:sample_size].astype(np.int64), validY[:sample_size]
+        targets = [row[row > 0].tolist() for row in validY]
+
+        report, references = {}, None
+        for size in (0, shortlist_size):
+            for precision in ('float32', 'float16', 'int8'):
+                decode_ids, _ = self.load_numpy_decoder(vocabulary, precision, size, word_normal_ids)
+                outputs = []
+                beg_ts = time.perf_counter()
+                for offset in range(0, len(validX), batch_size):
+                    encode_ids = validX[offset:offset + batch_size]
+                    lengths = (encode_ids > 0).sum(axis=1)
+                    encode_ids = encode_ids[:, :max(lengths.max(), 1)]
+                    outputs += [[int(w_id) for w_id in sentence if w_id != vocabulary['pad_id']] 
+                        for sentence in decode_ids(encode_ids, lengths + 10)]
+                elapsed = time.perf_counter() - beg_ts
+                references = references or outputs
+
+                matched_tokens = sum(
+                    sum(a == b for a, b in zip(output, target)) 
+                        for output, target in zip(outputs, targets))
+                total_tokens = sum(max(len(output), len(target)) for output, target in zip(outputs, targets))
+                name = f'{precision}_shortlist_{size}' if size else f'{precision}_full'
+                report[name] = {
+                    'latency_ms': elapsed * 1000 / len(validX),
+                    'sentence_accuracy': sum(output == target for output, target in zip(outputs, targets)) / len(validX),
+                    'token_accuracy': matched_tokens / max(total_tokens, 1),
+                    'float32_agreement': sum(output == reference for output, reference in zip(outputs, references)) / len(validX),
+                }
+                self.logger.info(f'> ({name}) {report[name]}')
+        return report
 
     def normalize(self, text_content):
         beg_ts = time.time()
@@ -266,11 +667,115 @@ class MohaverekhanSeq2SeqNormalizer(Normalizer):
                             .normalize(text_content)
         self.logger.info(f'>> mohaverekhan-replacement-normalizer : \n{text_content}')
 
-        text_content = self.inference(text_content)    
+        line_pieces = self.split_into_pieces(text_content)
+        pieces = [piece for pieces in line_pieces for piece in pieces]
+        results = [self.lookup_normal_lexicon(piece) for piece in pieces]
+        indexes = [index for index, result in enumerate(results) if result is None]
+        self.logger.info(f'> ({len(pieces)} pieces)({len(pieces) - len(indexes)} answered from the normal lexicon)')
+        if indexes:
+            # تکه‌های یک متن با هم به صف می‌رسند و در یک دسته رمزگشایی می‌شوند.
+            with metrics.timer(self.name, 'inference'):
+                inference_queue = self.get_inference_queue()
+                futures = [inference_queue.submit(pieces[index]) for index in indexes]
+                deadline_ts = time.time() + self.inference_timeout
+                try:
+                    for index, future in zip(indexes, futures):
+                        results[index] = future.result(timeout=max(deadline_ts - time.time(), 0))
+                except FutureTimeoutError:
+                    # تکه‌هایی که هنوز در صف هستند رمزگشایی نمی‌شوند.
+                    for future in futures:
+                        future.cancel()
+                    metrics.record_value(self.name, 'inference_timeout', 1)
+                    self.logger.error(f'> Inference timed out after {self.inference_timeout}s : '
+                                    f'({len(indexes)} pieces)(queue_depth)({inference_queue.requests.qsize()})')
+                    raise Exception(f'Seq2seq inference did not finish in {self.inference_timeout}s.')
+        text_content = self.join_pieces(line_pieces, results)
         end_ts = time.time()
+        metrics.record(self.name, 'normalize', end_ts - beg_ts)
         self.logger.info(f"> (Time)({end_ts - beg_ts:.6f})")
         self.logger.info(f'> Result : \n{text_content}')
         return text_content
+
+    ###############################################################################
+    # مدل روی جمله‌های حداکثر limit['maxinf'] کلمه‌ای آموزش دیده است و رمزگشایی len(seed) + 10 گام طول می‌کشد.
+    # پس متن ابتدا در شکستگی‌های خط و سپس در مرز جمله‌ها به تکه‌هایی با حداکثر max_tokens کلمه تقسیم می‌شود.
+    # جمله‌ها تا جایی که جا دارند کنار هم در یک تکه می‌مانند و جمله‌ای که از max_tokens بلندتر باشد بریده می‌شود.
+    # خروجی : برای هر خط، فهرست تکه‌های آن
+    def split_into_pieces(self, text_content, max_tokens=None):
+        max_tokens = max_tokens or data.limit['maxinf']
+        line_pieces = []
+        for line in text_content.split('\n'):
+            sentences, sentence = [], []
+            for token_content in line.split(' '):
+                if not token_content:
+                    continue
+                sentence.append(token_content)
+                if token_content[-1] in sentence_end_characters:
+                    sentences.append(sentence)
+                    sentence = []
+            if sentence:
+                sentences.append(sentence)
+
+            pieces, piece = [], []
+            for sentence in sentences:
+                if piece and len(piece) + len(sentence) > max_tokens:
+                    pieces.append(piece)
+                    piece = []
+                while len(sentence) > max_tokens:
+                    pieces.append(sentence[:max_tokens])
+                    sentence = sentence[max_tokens:]
+                piece += sentence
+            if piece:
+                pieces.append(piece)
+            line_pieces.append([' '.join(piece) for piece in pieces])
+        return line_pieces
+
+    def join_pieces(self, line_pieces, results):
+        results = iter(results)
+        return '\n'.join(' '.join(next(results) for _ in pieces) for pieces in line_pieces)
+
+    # نرخ پاسخ از جدول، میانگین lexicon_hit در metrics است.
+    def lookup_normal_lexicon(self, text_content):
+        with metrics.timer(self.name, 'lexicon_lookup'):
+            fixed_text_content = self.normal_lexicon.lookup(text_content)
+        metrics.record_value(self.name, 'lexicon_hit', int(fixed_text_content is not None))
+        return fixed_text_content
+
+    # هر دسته مدل را با run_batch_inference برمی‌دارد، پس اگر مدل دوباره بارگذاری شود صف با مدل جدید کار می‌کند.
+    def get_inference_queue(self):
+        with self.inference_lock:
+            if self.inference_queue is None:
+                self.inference_queue = InferenceQueue(self.run_batch_inference, self.name,
+                    max_batch_size=self.inference_max_batch_size, max_wait=self.inference_max_wait_ms / 1000)
+        return self.inference_queue
+
+    # جمله‌ها بر اساس طول مرتب می‌شوند تا جمله‌های هم‌طول در یک دسته باشند و جای خالی کمتری پر شود.
+    def normalize_batch(self, text_contents, batch_size=32):
+        beg_ts = time.time()
+        replacement_normalizer = cache.normalizers['mohaverekhan-replacement-normalizer']
+        text_contents = [replacement_normalizer.normalize(text_content) for text_content in text_contents]
+
+        text_line_pieces = [self.split_into_pieces(text_content) for text_content in text_contents]
+        pieces = [piece for line_pieces in text_line_pieces for pieces in line_pieces for piece in pieces]
+        results = [self.lookup_normal_lexicon(piece) for piece in pieces]
+        order = sorted(
+            (index for index, result in enumerate(results) if result is None), 
+            key=lambda index: len(pieces[index].split(' ')))
+        with metrics.timer(self.name, 'batch_inference'):
+            for offset in range(0, len(order), batch_size):
+                indexes = order[offset:offset + batch_size]
+                batch_results = self.run_batch_inference([pieces[index] for index in indexes])
+                for index, result in zip(indexes, batch_results):
+                    results[index] = result
+        offset, text_results = 0, []
+        for line_pieces in text_line_pieces:
+            piece_count = sum(len(pieces) for pieces in line_pieces)
+            text_results.append(self.join_pieces(line_pieces, results[offset:offset + piece_count]))
+            offset += piece_count
+        end_ts = time.time()
+        metrics.record(self.name, 'normalize_batch', end_ts - beg_ts)
+        self.logger.info(f"> (Time)({end_ts - beg_ts:.6f})({len(text_contents)} texts)({len(pieces)} pieces)")
+        return text_results
         
     """
     Creates the LSTM Model
@@ -320,18 +825,15 @@ class MohaverekhanSeq2SeqNormalizer(Normalizer):
         data_corpus_path = f'{self.current_dir}/'
         self.logger.info(f'data_corpus_path : {data_corpus_path}')
         metadata, idx_inf, idx_f = data.load_data(PATH=data_corpus_path)
+        len_inf, len_f = data.load_lengths(data_corpus_path, idx_inf, idx_f)
+        # آرایه‌ها به فهرست پایتون تبدیل نمی‌شوند. طول هر جمله در آرایه جدا نگه داشته می‌شود.
         (trainX, trainY), (testX, testY), (validX, validY) = data.split_dataset(idx_inf, idx_f)
-        trainX = tl.prepro.remove_pad_sequences(trainX.tolist())
-        trainY = tl.prepro.remove_pad_sequences(trainY.tolist())
-        testX = tl.prepro.remove_pad_sequences(testX.tolist())
-        testY = tl.prepro.remove_pad_sequences(testY.tolist())
-        validX = tl.prepro.remove_pad_sequences(validX.tolist())
-        validY = tl.prepro.remove_pad_sequences(validY.tolist())
+        lengths = dict(zip(('train', 'test', 'valid'), data.split_dataset(len_inf, len_f)))
         self.logger.info('initial setup completed.')
-        return metadata, trainX, trainY, testX, testY, validX, validY
+        return metadata, trainX, trainY, testX, testY, validX, validY, lengths
 
 
-    def process_data(self):
-        data.process_data()
+    def process_data(self, n_jobs=None):
+        data.process_data(n_jobs=n_jobs)
 
  
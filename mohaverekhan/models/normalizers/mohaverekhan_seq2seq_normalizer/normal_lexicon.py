@@ -0,0 +1,103 @@
+import time
+import logging
+import threading
+
+from mohaverekhan import cache
+from . import data
+
+
+###############################################################################
+# جدول جفت‌های نرمال معتبر برای پاسخ دادن بدون مدل
+# متن‌های ورودی تکراری هستند و خیلی از آن‌ها عینا در TextNormalهای معتبر وجود دارند یا تمام کلمه‌هایشان در WordNormalهای معتبر هستند.
+# text_normals : متن غیر رسمی نرمال‌شده -> متن رسمی
+# word_normals : کلمه غیر رسمی -> کلمه رسمی
+# formal_words : کلمه‌های سمت رسمی جفت‌ها که بدون تغییر می‌مانند، به جز کلمه‌هایی که در جفتی دیگر غیر رسمی بوده‌اند و تغییر کرده‌اند
+# (مثلا «میان» در «در میان ما» رسمی است ولی در «اونا میان -> آن‌ها می‌آیند» غیر رسمی است، پس باید به مدل برسد.)
+# اگر متن در text_normals باشد یا تمام کلمه‌هایش در یکی از دو جدول کلمه‌ها باشند، نتیجه بدون اجرای مدل ساخته می‌شود.
+# جدول همیشه در یک نخ دیگر ساخته می‌شود و تا اولین ساخت تمام نشده، همه متن‌ها به مدل می‌روند.
+# وقتی نسخه مجموعه نشانه‌ها عوض شود یا یک TextNormal یا WordNormal معتبر ذخیره شود (invalidate)، جدول دوباره ساخته می‌شود و تا آن زمان جدول قبلی استفاده می‌شود.
+class NormalLexicon:
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = None
+        self.lexicon_version = None
+        self.is_invalidated = False
+        self.refresh_thread = None
+
+    def build(self):
+        beg_ts = time.time()
+        text_informals, text_formals = data.get_text_normals()
+        word_informals, word_formals = data.get_word_normals()
+        text_normals, word_normals, formal_words = self.build_tables(
+            text_informals, text_formals, word_informals, word_formals)
+        self.logger.info(f'> Normal lexicon built in {time.time() - beg_ts:.3f}s : '
+                        f'({len(text_normals)} texts)({len(word_normals)} words)({len(formal_words)} formal words)')
+        return text_normals, word_normals, formal_words
+
+    def build_tables(self, text_informals, text_formals, word_informals, word_formals):
+        # جفت‌ها از قدیمی به جدید هستند، پس اگر یک ورودی چند بار آمده باشد جفت جدیدتر می‌ماند.
+        text_normals = dict(zip(text_informals, text_formals))
+        word_normals = {
+            informal: formal
+                for informal, formal in zip(word_informals, word_formals)
+                    if ' ' not in informal
+        }
+        formal_words, informal_words = set(), set()
+        # کلمه‌ای غیر رسمی است که در سمت غیر رسمی یک جفت آمده باشد ولی در سمت رسمی همان جفت نیامده باشد.
+        for informal, formal in zip(text_informals + word_informals, text_formals + word_formals):
+            formal_split = formal.split(' ')
+            formal_words.update(formal_split)
+            informal_words.update(set(informal.split(' ')) - set(formal_split))
+        formal_words -= informal_words
+        formal_words.discard('')
+        return text_normals, word_normals, formal_words
+
+    # اگر ساختن جدول ناموفق باشد، جدول قبلی (یا جدول خالی) استفاده می‌شود و همه متن‌ها به مدل می‌روند.
+    def refresh(self, lexicon_version):
+        try:
+            tables = self.build()
+        except Exception as e:
+            self.logger.exception(f'> Could not build normal lexicon : {e}')
+            tables = self.tables or ({}, {}, set())
+        with self.lock:
+            self.tables = tables
+            self.lexicon_version = lexicon_version
+            self.refresh_thread = None
+
+    # جفت‌های معتبر عوض شده‌اند؛ جدول در اولین جستجوی بعدی دوباره ساخته می‌شود.
+    def invalidate(self):
+        with self.lock:
+            self.is_invalidated = True
+
+    # درخواست منتظر ساختن جدول نمی‌ماند. اگر جدول هنوز ساخته نشده باشد None برمی‌گرداند.
+    def get_tables(self):
+        lexicon_version = cache.lexicon_version
+        with self.lock:
+            is_stale = self.tables is None or self.lexicon_version != lexicon_version or self.is_invalidated
+            if is_stale and self.refresh_thread is None:
+                # اگر در حین ساختن جدول جفت دیگری معتبر شود، جدول بعد از این ساخت دوباره ساخته می‌شود.
+                self.is_invalidated = False
+                self.refresh_thread = threading.Thread(target=self.refresh, args=(lexicon_version,), daemon=True)
+                self.refresh_thread.start()
+            return self.tables
+
+    # متن نرمال‌شده با normalizer جایگزینی را می‌گیرد و اگر جدول آماده نباشد یا نتواند تمام آن را پاسخ دهد None برمی‌گرداند.
+    def lookup(self, text_content):
+        tables = self.get_tables()
+        if tables is None:
+            return None
+        text_normals, word_normals, formal_words = tables
+        if text_content in text_normals:
+            return text_normals[text_content]
+        fixed_token_contents = []
+        for token_content in text_content.split(' '):
+            if token_content in word_normals:
+                fixed_token_contents.append(word_normals[token_content])
+            elif token_content in formal_words:
+                fixed_token_contents.append(token_content)
+            else:
+                return None
+        return ' '.join(fixed_token_contents)
@@ -0,0 +1,140 @@
+import numpy as np
+
+
+###############################################################################
+# موتور استنتاج مدل seq2seq فقط با NumPy
+# برای اجرای مدل آموزش‌دیده، وارد کردن TensorFlow و TensorLayer چند ثانیه طول می‌کشد و حافظه زیادی می‌گیرد.
+# این موتور پارامترهای model.npz را به ترتیب net.all_params می‌خواند:
+#   embeddings، (kernel, bias) سه لایه encode، (kernel, bias) سه لایه decode، W و b لایه output
+# سپس encoder و رمزگشایی حریصانه را با ضرب ماتریس‌ها روی کل دسته انجام می‌دهد.
+# محاسبه‌ها همان محاسبه‌های LSTMCell و dynamic_rnn و create_decode_loop هستند، پس خروجی با precision برابر float32 باید با مسیر TensorFlow یکی باشد.
+# اگر برای هر جمله فهرست کوتاهی از کلمه‌های ممکن داده شود، لایه output فقط برای همان کلمه‌ها حساب می‌شود.
+def sigmoid(x):
+    return 0.5 * np.tanh(0.5 * x) + 0.5
+
+
+###############################################################################
+# ماتریس‌های embeddings و output که هر سطرشان مال یک کلمه است، با دقت کمتر نگه داشته می‌شوند.
+# با float16 حافظه نصف و با int8 یک چهارم می‌شود. در int8 هر سطر ضریب خودش را دارد تا کلمه‌های کم‌تکرار با وزن‌های کوچک دقتشان را از دست ندهند.
+# فقط سطرهایی که لازم هستند (کلمه‌های ورودی یا کلمه‌های فهرست کوتاه) به float32 برگردانده می‌شوند.
+precisions = ('float32', 'float16', 'int8')
+
+class RowMatrix:
+
+    def __init__(self, matrix, precision='float32'):
+        if precision not in precisions:
+            raise Exception(f'Unknown precision "{precision}", use one of {precisions}')
+        self.precision = precision
+        self.scales = None
+        if precision == 'int8':
+            self.scales = np.abs(matrix).max(axis=1) / 127
+            self.scales[self.scales == 0] = 1
+            self.values = np.round(matrix / self.scales[:, None]).astype(np.int8)
+            self.scales = self.scales.astype(np.float32)
+        else:
+            self.values = np.ascontiguousarray(matrix, dtype=precision)
+
+    def __len__(self):
+        return len(self.values)
+
+    def get_rows(self, ids=None):
+        rows = self.values if ids is None else self.values[ids]
+        if self.scales is None:
+            return rows.astype(np.float32, copy=False)
+        scales = self.scales if ids is None else self.scales[ids]
+        return rows.astype(np.float32) * scales[:, None]
+
+    # x @ matrix.T بدون برگرداندن کل ماتریس به float32؛ سطرها تکه تکه برگردانده می‌شوند و ضریب‌های int8 بعد از ضرب اعمال می‌شوند.
+    def dot_rows(self, x, block_size=1024):
+        if self.precision == 'float32':
+            return x @ self.values.T
+        result = np.empty((len(x), len(self.values)), dtype=np.float32)
+        for beg in range(0, len(self.values), block_size):
+            result[:, beg:beg + block_size] = x @ self.values[beg:beg + block_size].astype(np.float32).T
+        if self.scales is not None:
+            result *= self.scales
+        return result
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+
+class NumpySeq2Seq:
+
+    forget_bias = 1.0
+
+    def __init__(self, model_path, vocabulary, n_layer=3, precision='float32'):
+        with np.load(model_path, allow_pickle=True) as model_file:
+            params = [np.asarray(param, dtype=np.float32) for param in model_file['params']]
+        if len(params) != 1 + 4 * n_layer + 2:
+            raise Exception(f'Unexpected number of parameters in "{model_path}" : {len(params)}')
+        self.precision = precision
+        self.embeddings = RowMatrix(params[0], precision)
+        self.encode_layers = list(zip(params[1:1 + 2 * n_layer:2], params[2:2 + 2 * n_layer:2]))
+        self.decode_layers = list(zip(params[1 + 2 * n_layer:1 + 4 * n_layer:2], params[2 + 2 * n_layer:2 + 4 * n_layer:2]))
+        self.n_hidden = params[-2].shape[0]
+        self.output_W, self.output_b = RowMatrix(params[-2].T, precision), params[-1]
+        del params
+        self.pad_id = vocabulary['pad_id']
+        self.unk_id = vocabulary['unk_id']
+        self.start_id = vocabulary['start_id']
+        self.end_id = vocabulary['end_id']
+
+    # یک گام از لایه‌های LSTM، سطرهایی که is_active آن‌ها False است حالتشان را نگه می‌دارند و خروجی صفر دارند.
+    def step(self, layers, w_ids, states, is_active):
+        x = self.embeddings.get_rows(w_ids)
+        next_states = []
+        for (kernel, bias), (c, h) in zip(layers, states):
+            i, j, f, o = np.split(np.concatenate([x, h], axis=1) @ kernel + bias, 4, axis=1)
+            next_c = sigmoid(f + self.forget_bias) * c + sigmoid(i) * np.tanh(j)
+            next_h = sigmoid(o) * np.tanh(next_c)
+            active = is_active[:, None]
+            next_states.append((np.where(active, next_c, c), np.where(active, next_h, h)))
+            x = next_h
+        return np.where(is_active[:, None], x, 0), next_states
+
+    # مثل retrieve_seq_length_op2، طول هر جمله تعداد شناسه‌های غیر صفر آن است.
+    def encode(self, encode_ids):
+        lengths = (encode_ids > 0).sum(axis=1)
+        zeros = np.zeros((len(encode_ids), self.n_hidden), dtype=np.float32)
+        states = [(zeros, zeros) for _ in self.encode_layers]
+        for step in range(encode_ids.shape[1]):
+            _, states = self.step(self.encode_layers, encode_ids[:, step], states, step < lengths)
+        return states
+
+    # کلمه‌های همه جمله‌های دسته با هم جمع می‌شوند و برای هر جمله، کلمه‌هایی که در فهرست خودش نیستند کنار گذاشته می‌شوند.
+    # end_id، pad_id و unk_id همیشه در فهرست هستند تا رمزگشایی بتواند مثل قبل تمام شود.
+    def get_output_function(self, candidates=None):
+        if candidates is None:
+            def output_function(outputs):
+                return (self.output_W.dot_rows(outputs) + self.output_b).argmax(axis=1)
+            return output_function
+
+        always = np.array([self.end_id, self.pad_id, self.unk_id])
+        candidates = [np.union1d(sentence_candidates, always) for sentence_candidates in candidates]
+        union_ids = np.unique(np.concatenate(candidates))
+        is_candidate = np.stack([np.isin(union_ids, sentence_candidates) for sentence_candidates in candidates])
+        union_W, union_b = self.output_W.get_rows(union_ids), self.output_b[union_ids]
+        def output_function(outputs):
+            logits = outputs @ union_W.T + union_b
+            logits[~is_candidate] = -np.inf
+            return union_ids[logits.argmax(axis=1)]
+        return output_function
+
+    def decode(self, encode_ids, max_lengths, candidates=None):
+        output_function = self.get_output_function(candidates)
+        states = self.encode(encode_ids)
+        w_ids = np.full(len(encode_ids), self.start_id, dtype=np.int64)
+        sentences = [[] for _ in range(len(encode_ids))]
+        is_finished = np.zeros(len(encode_ids), dtype=bool)
+        for step in range(max_lengths.max() + 1):
+            outputs, states = self.step(self.decode_layers, w_ids, states, w_ids != self.pad_id)
+            w_ids = output_function(outputs)
+            if step > 0:
+                is_finished |= (step - 1 >= max_lengths) | (w_ids == self.end_id)
+            for index in np.flatnonzero(~is_finished):
+                sentences[index].append(w_ids[index])
+            if is_finished.all():
+                break
+        return sentences
@@ -0,0 +1,390 @@
+import os
+import time
+import heapq
+import pickle
+import bisect
+import hashlib
+import logging
+import traceback
+import multiprocessing
+from nltk.tag import BrillTagger
+from nltk.tag.brill_trainer import BrillTaggerTrainer
+from nltk.tag.util import untag
+from nltk.tbl.rule import Rule
+from mohaverekhan.models.taggers.indexed_brill_tagger import IndexedBrillTagger
+from mohaverekhan import spawn_worker
+
+
+###############################################################################
+# فایل‌های میانی آموزش برچسب‌زن‌ها
+# هر مرحله آموزش (زنجیره n-gram و قاعده‌های Brill) در فایل جدای خود ذخیره می‌شود.
+# fingerprint از روی داده آموزش و تنظیمات مرحله ساخته می‌شود و اگر با فایل یکی نباشد، فایل نادیده گرفته می‌شود.
+# فایل اول در یک فایل موقت نوشته و سپس با os.replace جایگزین می‌شود، پس اگر آموزش وسط نوشتن متوقف شود فایل قبلی سالم می‌ماند.
+logger = logging.getLogger(__name__)
+
+def get_fingerprint(*values):
+    return hashlib.sha1(pickle.dumps(values, protocol=4)).hexdigest()
+
+
+def save_checkpoint(path, fingerprint, state):
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump(dict(state, fingerprint=fingerprint), f, protocol=4)
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(path, fingerprint):
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+    except Exception as e:
+        logger.exception(f'> Could not load checkpoint "{path}" : {e}')
+        return None
+    if state.get('fingerprint', None) != fingerprint:
+        logger.info(f'> Checkpoint "{path}" belongs to other training data, ignored')
+        return None
+    return state
+
+
+# شناسه قالب‌ها (Template.id) با ترتیب ساخته شدن قالب‌ها در هر پردازه عوض می‌شود و hash قاعده‌ها هم در هر پردازه فرق دارد.
+# پس قاعده‌های ذخیره‌شده با قالب هم‌شکل از templates فعلی دوباره ساخته می‌شوند.
+def remap_rules(rules, templates):
+    template_ids = {repr(template._features): template.id for template in templates}
+    return [
+        Rule(
+            template_ids.get(repr([feature for feature, _ in rule._conditions]), rule.templateid),
+            rule.original_tag, rule.replacement_tag, rule._conditions
+        )
+            for rule in rules
+    ]
+
+
+###############################################################################
+# بخشی از جمله‌های آموزش که در یک پردازه جدا نگه داشته می‌شود.
+# همان جدول‌های BrillTaggerTrainer (مکان‌های هر قاعده و امتیاز آن‌ها) فقط برای جمله‌های همین بخش ساخته و به‌روز می‌شوند.
+# تغییر امتیاز قاعده‌ها بعد از هر دستور برگردانده می‌شود تا ParallelBrillTrainer جمع امتیازها را داشته باشد.
+# قاعده‌ها با repr خود فرستاده می‌شوند و خود شیء Rule فقط اولین بار، چون pickle کردن Ruleها کند است.
+# جمله‌ها ابتدا با برچسب‌زن اولیه و قاعده‌های قبلی (اگر آموزش ادامه داده می‌شود) برچسب می‌خورند.
+class BrillShard(BrillTaggerTrainer):
+
+    def __init__(self, initial_tagger, templates, train_sents, rules):
+        super(BrillShard, self).__init__(initial_tagger, templates, deterministic=True)
+        self.train_sents = train_sents
+        self.changed_rules = []
+        self.reported_scores = {}
+        tagger = IndexedBrillTagger(BrillTagger(initial_tagger, rules))
+        self.test_sents = [list(tagged_tokens) for tagged_tokens in tagger.tag_sents(untag(sentence) for sentence in train_sents)]
+        self.token_count = sum(len(sentence) for sentence in train_sents)
+        self.error_count = sum(
+            tag != correct_tag
+                for test_sent, train_sent in zip(self.test_sents, train_sents)
+                    for (_, tag), (_, correct_tag) in zip(test_sent, train_sent)
+        )
+        self._init_mappings(self.test_sents, self.train_sents)
+
+    def _update_rule_applies(self, rule, sentnum, wordnum, train_sents):
+        self.changed_rules.append(rule)
+        super(BrillShard, self)._update_rule_applies(rule, sentnum, wordnum, train_sents)
+
+    def _update_rule_not_applies(self, rule, sentnum, wordnum):
+        self.changed_rules.append(rule)
+        super(BrillShard, self)._update_rule_not_applies(rule, sentnum, wordnum)
+
+    # (repr قاعده -> تغییر امتیاز، قاعده‌هایی که تا حالا فرستاده نشده‌اند)
+    def pop_score_changes(self):
+        score_changes, new_rules = {}, []
+        for rule in set(self.changed_rules):
+            key = repr(rule)
+            score = self._rule_scores[rule]
+            reported_score = self.reported_scores.get(key, None)
+            if reported_score is None:
+                new_rules.append(rule)
+                reported_score = 0
+            if score != reported_score:
+                score_changes[key] = score - reported_score
+            self.reported_scores[key] = score
+        self.changed_rules = []
+        return score_changes, new_rules
+
+    def get_stats(self):
+        return self.token_count, self.error_count, self.pop_score_changes()
+
+    # امتیاز قاعده‌ها در این بخش : مکان‌هایی که برچسب اولیه قاعده را دارند و هنوز بررسی نشده‌اند، بررسی می‌شوند.
+    # مثل BrillTaggerTrainer._best_rule، اگر امتیاز قاعده بیشتر از allowance کم شود بررسی همان‌جا متوقف می‌شود،
+    # چون دیگر قاعده اول نیست و ادامه بررسی فقط لازم است اگر دوباره قاعده اول شود.
+    # قاعده‌هایی که تا انتها بررسی شده‌اند را _update_rules در BrillTaggerTrainer دقیق نگه می‌دارد.
+    def verify(self, rule_allowances):
+        unfinished_keys = []
+        for rule, allowance in rule_allowances:
+            positions = self._tag_positions[rule.original_tag]
+            first_unknown_position = self._first_unknown_position.get(rule, (0, -1))
+            min_score = self._rule_scores[rule] - allowance
+            for index in range(bisect.bisect_left(positions, first_unknown_position), len(positions)):
+                sentnum, wordnum = positions[index]
+                if rule.applies(self.test_sents[sentnum], wordnum):
+                    self._update_rule_applies(rule, sentnum, wordnum, self.train_sents)
+                    if self._rule_scores[rule] < min_score:
+                        self._first_unknown_position[rule] = (sentnum, wordnum + 1)
+                        unfinished_keys.append(repr(rule))
+                        break
+            else:
+                self._first_unknown_position[rule] = (len(self.train_sents) + 1, 0)
+        return self.pop_score_changes(), unfinished_keys
+
+    def apply(self, rule):
+        self._apply_rule(rule, self.test_sents)
+        self._update_tag_positions(rule)
+        self._update_rules(rule, self.train_sents, self.test_sents)
+        return self.pop_score_changes()
+
+
+def run_shard(connection, initial_tagger, templates, train_sents, rules):
+    try:
+        shard = BrillShard(initial_tagger, templates, train_sents, rules)
+        connection.send((True, shard.get_stats()))
+        while True:
+            command, args = connection.recv()
+            if command == 'stop':
+                break
+            connection.send((True, getattr(shard, command)(*args)))
+    except Exception:
+        connection.send((False, traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+# بخش‌ها در پردازه‌های جدا اجرا می‌شوند و دستورها با Pipe فرستاده می‌شوند.
+# ابتدا دستور به تمام بخش‌ها فرستاده و سپس جواب‌ها گرفته می‌شوند تا بخش‌ها هم‌زمان کار کنند.
+# آموزش از یک نخ سرور شروع می‌شود و fork کردن پردازه‌ای که چند نخ دارد ممکن است قفل‌های گرفته‌شده را به فرزند ببرد،
+# پس بخش‌ها با spawn ساخته می‌شوند و وضعیت هر بخش (برچسب‌زن اولیه، قالب‌ها، جمله‌ها و قاعده‌ها) با pickle فرستاده می‌شود.
+class ShardProcess:
+
+    def __init__(self, context, initial_tagger, templates, train_sents, rules):
+        self.connection, child_connection = context.Pipe()
+        payload = pickle.dumps((run_shard, (initial_tagger, templates, train_sents, rules)), protocol=4)
+        self.process = context.Process(
+            target=spawn_worker.run, args=(payload, child_connection), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def send(self, command, *args):
+        self.connection.send((command, args))
+
+    def receive(self):
+        is_done, result = self.connection.recv()
+        if not is_done:
+            raise Exception(f'Brill training shard failed :\n{result}')
+        return result
+
+    def stop(self):
+        try:
+            self.connection.send(('stop', ()))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=10)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+
+
+# وقتی فقط یک پردازه خواسته شده است، بخش در همین پردازه اجرا می‌شود.
+class LocalShard:
+
+    def __init__(self, initial_tagger, templates, train_sents, rules):
+        self.shard = BrillShard(initial_tagger, templates, train_sents, rules)
+        self.result = self.shard.get_stats()
+
+    def send(self, command, *args):
+        self.result = getattr(self.shard, command)(*args)
+
+    def receive(self):
+        return self.result
+
+    def stop(self):
+        self.shard = None
+
+
+###############################################################################
+# آموزش قاعده‌های Brill در چند پردازه
+# جمله‌های آموزش بین n_jobs پردازه تقسیم می‌شوند و هر پردازه جدول‌های BrillTaggerTrainer را برای جمله‌های خودش دارد.
+# امتیاز هر قاعده (درست‌شده‌ها منهای خراب‌شده‌ها) جمع امتیاز آن در تمام بخش‌ها است.
+# امتیازهای BrillTaggerTrainer تا قبل از بررسی کامل، حد بالای امتیاز واقعی هستند.
+# پس قاعده‌ها به ترتیب امتیاز در یک heap هستند و هر بار verify_size قاعده اول که بررسی کامل نشده‌اند در تمام بخش‌ها با هم بررسی می‌شوند،
+# تا قاعده اول heap تا انتها بررسی‌شده باشد. آن قاعده بهترین قاعده است و در تمام بخش‌ها اعمال می‌شود.
+# بین قاعده‌های با امتیاز برابر، مثل BrillTaggerTrainer با deterministic=True قاعده‌ای که repr آن کوچک‌تر است انتخاب می‌شود، پس نتیجه به تعداد پردازه‌ها بستگی ندارد.
+# قاعده‌های پیدا‌شده هر checkpoint_interval قاعده در checkpoint_path ذخیره می‌شوند.
+# اگر آموزش متوقف شود، دفعه بعد جمله‌ها با قاعده‌های ذخیره‌شده برچسب می‌خورند و آموزش از قاعده بعدی ادامه پیدا می‌کند.
+# progress_function هر progress_interval ثانیه با تعداد قاعده‌ها، امتیاز آخرین قاعده و زمان باقی‌مانده صدا زده می‌شود.
+class ParallelBrillTrainer:
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, initial_tagger, templates, n_jobs=None, checkpoint_path=None, fingerprint=None,
+                 checkpoint_interval=10, progress_function=None, progress_interval=5, verify_size=16):
+        self.initial_tagger = initial_tagger
+        self.templates = templates
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.checkpoint_path = checkpoint_path
+        self.fingerprint = fingerprint
+        self.checkpoint_interval = checkpoint_interval
+        self.progress_function = progress_function
+        self.progress_interval = progress_interval
+        self.verify_size = verify_size
+        self.progress_ts = 0
+
+    def start_shards(self, train_sents, rules):
+        shard_count = max(1, min(self.n_jobs, len(train_sents)))
+        shard_size = -(-len(train_sents) // shard_count)
+        shard_sents = [train_sents[beg:beg + shard_size] for beg in range(0, len(train_sents), shard_size)]
+        if len(shard_sents) == 1:
+            return [LocalShard(self.initial_tagger, self.templates, shard_sents[0], rules)]
+        context = multiprocessing.get_context('spawn')
+        return [
+            ShardProcess(context, self.initial_tagger, self.templates, sentences, rules)
+                for sentences in shard_sents
+        ]
+
+    def run_command(self, command, *args):
+        for shard in self.shards:
+            shard.send(command, *args)
+        return [shard.receive() for shard in self.shards]
+
+    # امتیازها، heap و قاعده‌های بررسی‌شده با repr قاعده‌ها نگه داشته می‌شوند.
+    def add_score_changes(self, shard_result):
+        score_changes, new_rules = shard_result
+        for rule in new_rules:
+            self.rules_by_key.setdefault(repr(rule), rule)
+        for key, change in score_changes.items():
+            self.scores[key] = self.scores.get(key, 0) + change
+            heapq.heappush(self.heap, (-self.scores[key], key))
+
+    def pop_valid_entry(self, excluded_keys):
+        while self.heap:
+            negative_score, key = self.heap[0]
+            if self.scores.get(key, 0) == -negative_score and key not in excluded_keys:
+                return -negative_score, key
+            heapq.heappop(self.heap)
+        return None, None
+
+    # allowance هر قاعده : چقدر امتیازش می‌تواند کم شود و هنوز از قاعده بعد از این دسته کمتر نباشد.
+    def get_best_rule(self, min_score):
+        min_score = max(min_score, 1)
+        while True:
+            top_keys = []
+            while len(top_keys) < self.verify_size:
+                score, key = self.pop_valid_entry(top_keys)
+                if key is None or score < min_score or (key in self.verified_keys and top_keys):
+                    break
+                if key in self.verified_keys:
+                    return self.rules_by_key[key]
+                top_keys.append(heapq.heappop(self.heap)[1])
+            if not top_keys:
+                return None
+            next_score, _ = self.pop_valid_entry(top_keys)
+            next_score = max(next_score or 0, min_score - 1)
+            rule_allowances = [(self.rules_by_key[key], self.scores[key] - next_score) for key in top_keys]
+            unfinished_keys = set()
+            for shard_result, shard_unfinished_keys in self.run_command('verify', rule_allowances):
+                self.add_score_changes(shard_result)
+                unfinished_keys.update(shard_unfinished_keys)
+            for key in top_keys:
+                if key not in unfinished_keys:
+                    self.verified_keys.add(key)
+                heapq.heappush(self.heap, (-self.scores[key], key))
+
+    def report_progress(self, stage, rules, max_rules, beg_ts, rule_count, force=False):
+        if self.progress_function is None:
+            return
+        now_ts = time.time()
+        if not force and now_ts - self.progress_ts < self.progress_interval:
+            return
+        self.progress_ts = now_ts
+        new_rule_count = len(rules) - rule_count
+        seconds_per_rule = (now_ts - beg_ts) / new_rule_count if new_rule_count else None
+        self.progress_function({
+            'stage': stage,
+            'rules': len(rules),
+            'max_rules': max_rules,
+            'score': self.rule_scores[-1] if self.rule_scores else None,
+            'elapsed_seconds': round(now_ts - beg_ts, 1),
+            'eta_seconds': round(seconds_per_rule * (max_rules - len(rules)), 1) if seconds_per_rule else None,
+            'shards': len(self.shards),
+        })
+
+    def save_checkpoint(self, rules, initial_errors, is_complete):
+        if self.checkpoint_path is None:
+            return
+        save_checkpoint(self.checkpoint_path, self.fingerprint, {
+            'rules': rules,
+            'rule_scores': self.rule_scores,
+            'initial_errors': initial_errors,
+            'is_complete': is_complete,
+        })
+        self.logger.info(f'> Brill checkpoint saved : ({len(rules)} rules) "{self.checkpoint_path}"')
+
+    def train(self, train_sents, max_rules=200, min_score=2):
+        checkpoint = None
+        if self.checkpoint_path is not None:
+            checkpoint = load_checkpoint(self.checkpoint_path, self.fingerprint)
+        rules, self.rule_scores, initial_errors, is_complete = [], [], None, False
+        if checkpoint is not None:
+            rules = remap_rules(checkpoint['rules'], self.templates)[:max_rules]
+            self.rule_scores = list(checkpoint['rule_scores'])[:max_rules]
+            initial_errors, is_complete = checkpoint['initial_errors'], checkpoint['is_complete']
+            self.logger.info(f'> Brill training resumed from {len(rules)} rules')
+
+        self.shards = []
+        token_count = sum(len(sentence) for sentence in train_sents)
+        if initial_errors is None or not (is_complete or len(rules) >= max_rules):
+            self.scores, self.heap, self.rules_by_key = {}, [], {}
+            self.verified_keys = set()
+            beg_ts = time.time()
+            self.report_progress('brill-init', rules, max_rules, beg_ts, len(rules), force=True)
+            try:
+                self.shards = self.start_shards(train_sents, rules)
+                error_count = 0
+                for shard in self.shards:
+                    _, shard_error_count, shard_result = shard.receive()
+                    error_count += shard_error_count
+                    self.add_score_changes(shard_result)
+                if initial_errors is None:
+                    initial_errors = error_count
+                self.logger.info(f'> Brill training started : ({len(self.shards)} shards)({len(train_sents)} sentences)'
+                                 f'({len(self.scores)} useful rules)({error_count} errors)')
+
+                rule_count = len(rules)
+                is_complete = False
+                while len(rules) < max_rules:
+                    rule = self.get_best_rule(min_score)
+                    if rule is None:
+                        is_complete = True
+                        break
+                    rules.append(rule)
+                    self.rule_scores.append(self.scores[repr(rule)])
+                    self.logger.info(f'> Rule {len(rules)} (score {self.rule_scores[-1]}) : {rule}')
+                    for shard_result in self.run_command('apply', rule):
+                        self.add_score_changes(shard_result)
+                    if len(rules) % self.checkpoint_interval == 0:
+                        self.save_checkpoint(rules, initial_errors, False)
+                    self.report_progress('brill-rules', rules, max_rules, beg_ts, rule_count)
+                self.save_checkpoint(rules, initial_errors, is_complete)
+                self.report_progress('brill-rules', rules, max_rules, beg_ts, rule_count, force=True)
+            finally:
+                for shard in self.shards:
+                    shard.stop()
+
+        trainstats = {
+            'min_acc': None,
+            'min_score': min_score,
+            'tokencount': token_count,
+            'sequencecount': len(train_sents),
+            'templatecount': len(self.templates),
+            'rulescores': self.rule_scores,
+            'initialerrors': initial_errors,
+            'initialacc': 1 - initial_errors / token_count,
+        }
+        trainstats['finalerrors'] = initial_errors - sum(self.rule_scores)
+        trainstats['finalacc'] = 1 - trainstats['finalerrors'] / token_count
+        return BrillTagger(self.initial_tagger, rules, trainstats)
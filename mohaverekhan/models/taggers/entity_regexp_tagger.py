@@ -0,0 +1,58 @@
+import re
+import threading
+import nltk
+from mohaverekhan import cache
+
+
+###############################################################################
+# نرمالایزر نوع نشانه‌های بی‌نهایت را پیدا کرده است، پس RegexpTagger برای آن‌ها دوباره رگس‌ها را بررسی نمی‌کند.
+# برچسب این نشانه‌ها برای هر درخواست جدا و برای هر نخ جداست، چون یک نمونه از برچسب‌زن بین تمام درخواست‌ها مشترک است.
+# برای نشانه‌های دیگر دقیقا مثل RegexpTagger رفتار می‌کند.
+request_state = threading.local()
+
+class EntityRegexpTagger(nltk.RegexpTagger):
+
+    def choose_tag(self, tokens, index, history):
+        entity_tags = getattr(request_state, 'entity_tags', None)
+        if entity_tags and index in entity_tags:
+            return entity_tags[index]
+        return super(EntityRegexpTagger, self).choose_tag(tokens, index, history)
+
+
+# RegexpTagger داخل زنجیره برچسب‌زن آموزش‌دیده را با EntityRegexpTagger عوض می‌کند.
+# فقط کلاس شیء عوض می‌شود، پس زنجیره backoff و فایل ذخیره‌شده دست نمی‌خورند.
+def get_regexp_taggers(main_tagger):
+    initial_tagger = getattr(main_tagger, '_initial_tagger', main_tagger)
+    return [
+        tagger for tagger in getattr(initial_tagger, '_taggers', [initial_tagger])
+            if isinstance(tagger, nltk.RegexpTagger)
+    ]
+
+def use_entity_tags(main_tagger):
+    for tagger in get_regexp_taggers(main_tagger):
+        if type(tagger) is nltk.RegexpTagger:
+            tagger.__class__ = EntityRegexpTagger
+    return main_tagger
+
+
+# رگس‌های RegexpTagger همراه برچسب‌زن در فایل ذخیره می‌شوند، پس اگر الگوهایی مثل cache.link عوض شوند، برچسب‌زن بارگذاری‌شده هنوز الگوی قدیمی را دارد.
+# رگس‌ها را از روی word_patterns فعلی دوباره می‌سازیم تا اصلاح الگوها بدون آموزش دوباره اعمال شود.
+def use_word_patterns(main_tagger, word_patterns):
+    for tagger in get_regexp_taggers(main_tagger):
+        tagger._regexps = [(re.compile(regexp), tag) for regexp, tag in word_patterns]
+    return main_tagger
+
+
+# نوع نشانه‌های بی‌نهایت فقط به محتوای آن‌ها بستگی دارد، پس شماره نشانه‌ها با جستجوی محتوای هر نشانه پیدا می‌شود.
+def get_entity_tags(entity_kinds, token_contents):
+    if not entity_kinds:
+        return {}
+    return {
+        index: cache.entity_tags[entity_kinds[token_content]]
+            for index, token_content in enumerate(token_contents)
+                if token_content in entity_kinds
+    }
+
+
+def set_entity_tags(entity_tags):
+    request_state.entity_tags = entity_tags
@@ -0,0 +1,323 @@
+from collections import defaultdict
+import numpy as np
+import nltk
+from nltk.tag import brill
+from nltk.tbl.rule import Rule
+from mohaverekhan.models.taggers.entity_regexp_tagger import set_entity_tags
+
+
+###############################################################################
+# اجرای قاعده‌های Brill با اندیس
+# BrillTagger.tag برای هر قاعده تمام مکان‌هایی که برچسب اولیه قاعده را دارند بررسی می‌کند، حتی اگر کلمه یا برچسبی که شرط قاعده است در جمله نباشد.
+# این موتور برچسب‌ها و کلمه‌های شرط‌ها را به شناسه عددی تبدیل می‌کند و برای هر جمله مکان هر کلمه و هر برچسب را نگه می‌دارد.
+# برای هر قاعده، از شرطی که کمترین مکان را دارد فقط همان مکان‌ها (منهای فاصله شرط) بررسی می‌شوند
+# و اگر کلمه یا برچسب یکی از شرط‌ها در جمله نباشد، قاعده اصلا بررسی نمی‌شود.
+# قاعده‌ها به همان ترتیب و هر قاعده روی وضعیت قبل از خودش اعمال می‌شود، پس خروجی دقیقا برابر BrillTagger است.
+# اگر قاعده‌ای ویژگی دیگری جز Word و Pos داشته باشد، همان BrillTagger.tag اجرا می‌شود.
+# برای برچسب‌زدن دسته‌ای تعداد زیادی جمله، tag_sents را ببینید.
+class IndexedBrillTagger:
+
+    # برچسب‌زن‌هایی که برچسبشان فقط به خود کلمه بستگی دارد.
+    word_tagger_types = (nltk.UnigramTagger, nltk.AffixTagger, nltk.RegexpTagger, nltk.DefaultTagger)
+
+    def __init__(self, brill_tagger):
+        self.brill_tagger = brill_tagger
+        self.initial_tagger = brill_tagger._initial_tagger
+        self.tag_ids, self.tags = {}, []
+        self.word_ids = {}
+        self.rules = self.compile_rules(brill_tagger.rules())
+        self.ngram_tables, self.word_tagger = self.compile_initial_tagger()
+
+    def get_tag_id(self, tag):
+        if tag not in self.tag_ids:
+            self.tag_ids[tag] = len(self.tags)
+            self.tags.append(tag)
+        return self.tag_ids[tag]
+
+    def get_word_id(self, word):
+        return self.word_ids.setdefault(word, len(self.word_ids))
+
+    # هر قاعده : (شناسه برچسب اولیه، شناسه برچسب جدید، شرط‌ها)
+    # هر شرط : (آیا شرط روی کلمه است، فاصله‌ها، شناسه مقدار)
+    def compile_rules(self, rules):
+        compiled_rules = []
+        for rule in rules:
+            if type(rule) is not Rule:
+                return None
+            conditions = []
+            for feature, value in rule._conditions:
+                if type(feature) is brill.Word:
+                    conditions.append((True, tuple(feature.positions), self.get_word_id(value)))
+                elif type(feature) is brill.Pos:
+                    conditions.append((False, tuple(feature.positions), self.get_tag_id(value)))
+                else:
+                    return None
+            compiled_rules.append((
+                self.get_tag_id(rule.original_tag),
+                self.get_tag_id(rule.replacement_tag),
+                tuple(conditions)
+            ))
+        return compiled_rules
+
+    # زنجیره backoff برچسب‌زن اولیه به دو بخش تقسیم می‌شود :
+    # ngram_tables : برای هر NgramTagger ابتدای زنجیره (Trigram و Bigram)، کلیدهای عددی مرتب‌شده زمینه‌ها و شناسه برچسب هر زمینه
+    # word_tagger : بقیه زنجیره (Unigram و Regexp و Affix و Default) که برچسبش فقط به کلمه بستگی دارد و برای هر کلمه یک بار اجرا می‌شود.
+    # اگر زنجیره به این شکل نباشد، (None، None) برگردانده می‌شود.
+    def compile_initial_tagger(self):
+        taggers = getattr(self.initial_tagger, '_taggers', None)
+        if not taggers:
+            return None, None
+        ngram_taggers = []
+        for tagger in taggers:
+            if (isinstance(tagger, nltk.NgramTagger) and not isinstance(tagger, nltk.UnigramTagger)
+                    and type(tagger).context is nltk.NgramTagger.context):
+                ngram_taggers.append(tagger)
+            else:
+                break
+        word_taggers = taggers[len(ngram_taggers):]
+        if not all(isinstance(tagger, self.word_tagger_types) for tagger in word_taggers):
+            return None, None
+
+        contexts_list = [
+            [
+                (tuple(self.get_tag_id(tag) for tag in tag_context), self.get_word_id(word), self.get_tag_id(tag))
+                    for (tag_context, word), tag in tagger._context_to_tag.items()
+            ]
+                for tagger in ngram_taggers
+        ]
+        self.context_tag_count, self.context_word_count = len(self.tags), len(self.word_ids)
+        ngram_tables = []
+        for tagger, contexts in zip(ngram_taggers, contexts_list):
+            history_size = tagger._n - 1
+            keys = np.array([
+                self.get_context_key((0,) * (history_size - len(tag_ids)) + tuple(tag_id + 1 for tag_id in tag_ids), word_id)
+                    for tag_ids, word_id, _ in contexts
+            ], dtype=np.int64)
+            values = np.array([tag_id for _, _, tag_id in contexts], dtype=np.int32)
+            order = np.argsort(keys)
+            ngram_tables.append((history_size, keys[order], values[order]))
+        return ngram_tables, (word_taggers[0] if word_taggers else None)
+
+    # کد هر برچسب زمینه یکی بیشتر از شناسه آن است و ۰ یعنی جمله قبل از این مکان شروع شده است.
+    def get_context_key(self, tag_codes, word_id):
+        key = 0
+        for tag_code in tag_codes:
+            key = key * (self.context_tag_count + 1) + tag_code
+        return key * self.context_word_count + word_id
+
+    def rules(self):
+        return self.brill_tagger.rules()
+
+    def tag(self, tokens):
+        if self.rules is None:
+            return self.brill_tagger.tag(tokens)
+        tagged_tokens = self.initial_tagger.tag(tokens)
+        return self.apply_rules(tagged_tokens)
+
+    def apply_rules(self, tagged_tokens):
+        # برچسب‌هایی که در قاعده‌ها نیستند فقط برای همین جمله شناسه می‌گیرند.
+        tag_names = list(self.tags)
+        extra_tag_ids = {}
+        words, tags = [], []
+        word_positions, tag_positions = defaultdict(list), defaultdict(set)
+        for index, (token, tag) in enumerate(tagged_tokens):
+            word_id = self.word_ids.get(token, -1)
+            tag_id = self.tag_ids.get(tag, None)
+            if tag_id is None:
+                tag_id = extra_tag_ids.get(tag, None)
+                if tag_id is None:
+                    tag_id = extra_tag_ids[tag] = len(tag_names)
+                    tag_names.append(tag)
+            words.append(word_id)
+            tags.append(tag_id)
+            if word_id >= 0:
+                word_positions[word_id].append(index)
+            tag_positions[tag_id].add(index)
+
+        length = len(tagged_tokens)
+        for original_tag_id, replacement_tag_id, conditions in self.rules:
+            positions = tag_positions.get(original_tag_id, None)
+            if not positions:
+                continue
+            candidates = positions
+            for is_word, offsets, value_id in conditions:
+                occurrences = (word_positions if is_word else tag_positions).get(value_id, None)
+                if not occurrences:
+                    candidates = None
+                    break
+                if len(occurrences) * len(offsets) < len(candidates):
+                    candidates = candidates.intersection(
+                        occurrence - offset for occurrence in occurrences for offset in offsets)
+            if not candidates:
+                continue
+
+            changed = []
+            for index in candidates:
+                for is_word, offsets, value_id in conditions:
+                    values = words if is_word else tags
+                    for offset in offsets:
+                        position = index + offset
+                        if 0 <= position < length and values[position] == value_id:
+                            break
+                    else:
+                        break
+                else:
+                    changed.append(index)
+
+            for index in changed:
+                tags[index] = replacement_tag_id
+                tag_positions[original_tag_id].remove(index)
+                tag_positions[replacement_tag_id].add(index)
+
+        return [(token, tag_names[tag_id]) for (token, _), tag_id in zip(tagged_tokens, tags)]
+
+    def get_local_tag_id(self, tag, tag_names, extra_tag_ids):
+        tag_id = self.tag_ids.get(tag, None)
+        if tag_id is None:
+            tag_id = extra_tag_ids.get(tag, None)
+            if tag_id is None:
+                tag_id = extra_tag_ids[tag] = len(tag_names)
+                tag_names.append(tag)
+        return tag_id
+
+    ###########################################################################
+    # برچسب‌زدن دسته‌ای جمله‌ها با آرایه‌های numpy
+    # جمله‌ها بر اساس طول مرتب و به دسته‌های batch_size تایی تقسیم می‌شوند تا جای خالی ماتریس‌ها کم باشد.
+    # هر دسته یک ماتریس شناسه کلمه‌ها و یک ماتریس شناسه برچسب‌ها است.
+    # برچسب‌زن اولیه : مکان‌ها یکی‌یکی جلو می‌روند، ولی هر مکان برای تمام جمله‌ها با هم و با جست‌وجو در کلیدهای مرتب‌شده ngram_tables برچسب می‌خورد.
+    # اگر زمینه‌ای پیدا نشود، برچسب word_tagger برای آن کلمه استفاده می‌شود که برای هر کلمه یکتای دسته فقط یک بار محاسبه شده است.
+    # قاعده‌ها : هر قاعده یک ماسک روی کل ماتریس است و تمام تغییرهای یک قاعده بعد از محاسبه ماسک با هم اعمال می‌شوند.
+    # entity_tags_list : برچسب نشانه‌های بی‌نهایت هر جمله (شماره نشانه -> برچسب)، مثل set_entity_tags برای tag
+    # خروجی دقیقا برابر tag برای هر جمله است.
+    def tag_sents(self, sentences, entity_tags_list=None, batch_size=1024):
+        sentences = [list(sentence) for sentence in sentences]
+        if entity_tags_list is None:
+            entity_tags_list = [None] * len(sentences)
+        if self.rules is None or self.ngram_tables is None:
+            tagged_sentences = []
+            for sentence, entity_tags in zip(sentences, entity_tags_list):
+                set_entity_tags(entity_tags)
+                try:
+                    tagged_sentences.append(self.tag(sentence))
+                finally:
+                    set_entity_tags(None)
+            return tagged_sentences
+
+        order = sorted(range(len(sentences)), key=lambda index: len(sentences[index]))
+        tagged_sentences = [None] * len(sentences)
+        for beg in range(0, len(order), batch_size):
+            indices = order[beg:beg + batch_size]
+            batch_tagged_sentences = self.tag_batch(
+                [sentences[index] for index in indices],
+                [entity_tags_list[index] for index in indices]
+            )
+            for index, tagged_sentence in zip(indices, batch_tagged_sentences):
+                tagged_sentences[index] = tagged_sentence
+        return tagged_sentences
+
+    def tag_batch(self, sentences, entity_tags_list):
+        tag_names = list(self.tags)
+        extra_tag_ids = {}
+        lengths = np.array([len(sentence) for sentence in sentences], dtype=np.int64)
+        sentence_count, max_length = len(sentences), int(lengths.max(initial=0))
+
+        # شناسه کلمه‌های یکتای دسته و شناسه آن‌ها در واژگان مدل (-1 برای کلمه‌های ناشناخته)
+        unique_ids = {}
+        unique_matrix = np.zeros((sentence_count, max_length), dtype=np.int64)
+        for row, sentence in enumerate(sentences):
+            unique_matrix[row, :len(sentence)] = [unique_ids.setdefault(token, len(unique_ids)) for token in sentence]
+        unique_words = list(unique_ids)
+        unique_word_ids = np.array([self.word_ids.get(word, -1) for word in unique_words], dtype=np.int64)
+        words = unique_word_ids[unique_matrix] if unique_words else np.full((sentence_count, max_length), -1, dtype=np.int64)
+
+        set_entity_tags(None)
+        word_tag_ids = np.array([
+            self.get_local_tag_id(self.tag_word(word), tag_names, extra_tag_ids) for word in unique_words
+        ], dtype=np.int64)
+        entity_positions = defaultdict(list)
+        for row, (sentence, entity_tags) in enumerate(zip(sentences, entity_tags_list)):
+            for index, entity_tag in (entity_tags or {}).items():
+                if 0 <= index < len(sentence):
+                    tag = self.tag_word(sentence[index], entity_tag)
+                    entity_positions[index].append((row, self.get_local_tag_id(tag, tag_names, extra_tag_ids)))
+
+        tags = np.full((sentence_count, max_length), -1, dtype=np.int64)
+        for index in range(max_length):
+            # جمله‌ها به ترتیب طول هستند، پس جمله‌هایی که به این مکان رسیده‌اند انتهای ماتریس هستند.
+            beg_row = int(np.searchsorted(lengths, index, side='right'))
+            word_ids = words[beg_row:, index]
+            position_tag_ids = word_tag_ids[unique_matrix[beg_row:, index]]
+            for row, tag_id in entity_positions.get(index, ()):
+                position_tag_ids[row - beg_row] = tag_id
+            is_tagged = np.zeros(len(word_ids), dtype=bool)
+            for history_size, keys, values in self.ngram_tables:
+                is_valid = ~is_tagged & (word_ids >= 0)
+                key = np.zeros(len(word_ids), dtype=np.int64)
+                for history_index in range(index - history_size, index):
+                    if history_index < 0:
+                        tag_codes = np.zeros(len(word_ids), dtype=np.int64)
+                    else:
+                        history_tag_ids = tags[beg_row:, history_index]
+                        is_valid &= history_tag_ids < self.context_tag_count
+                        tag_codes = history_tag_ids + 1
+                    key = key * (self.context_tag_count + 1) + tag_codes
+                key = key * self.context_word_count + word_ids
+                found_indices = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+                is_found = is_valid & (keys[found_indices] == key) if len(keys) else np.zeros(len(key), dtype=bool)
+                position_tag_ids[is_found] = values[found_indices[is_found]]
+                is_tagged |= is_found
+            tags[beg_row:, index] = position_tag_ids
+
+        tags = self.apply_rules_to_matrix(words, tags, lengths, len(tag_names))
+        tag_names = np.array(tag_names, dtype=object)
+        return [
+            list(zip(sentence, tag_names[tags[row, :len(sentence)]].tolist()))
+                for row, sentence in enumerate(sentences)
+        ]
+
+    # برچسب word_tagger برای یک کلمه، با برچسب نشانه بی‌نهایت اگر داده شده باشد.
+    def tag_word(self, word, entity_tag=None):
+        if self.word_tagger is None:
+            return None
+        if entity_tag is None:
+            return self.word_tagger.tag_one([word], 0, [])
+        set_entity_tags({0: entity_tag})
+        try:
+            return self.word_tagger.tag_one([word], 0, [])
+        finally:
+            set_entity_tags(None)
+
+    # ماتریس‌ها از دو طرف به اندازه بیشترین فاصله شرط‌ها با -2 پر می‌شوند تا مکان‌های بیرون جمله با هیچ شرطی برابر نباشند.
+    def apply_rules_to_matrix(self, words, tags, lengths, tag_count):
+        margin = max([
+            abs(offset) for _, _, conditions in self.rules for _, offsets, _ in conditions for offset in offsets
+        ], default=0)
+        sentence_count, max_length = tags.shape
+        is_inside = np.arange(max_length) < lengths[:, None]
+        word_matrix = np.full((sentence_count, max_length + 2 * margin), -2, dtype=np.int64)
+        tag_matrix = np.full((sentence_count, max_length + 2 * margin), -2, dtype=np.int64)
+        word_matrix[:, margin:margin + max_length] = np.where(is_inside, words, -2)
+        tag_matrix[:, margin:margin + max_length] = np.where(is_inside, tags, -2)
+        center_tags = tag_matrix[:, margin:margin + max_length]
+
+        tag_counts = np.bincount(tags[is_inside], minlength=tag_count)
+        present_word_ids = set(np.unique(words[is_inside]).tolist())
+        for original_tag_id, replacement_tag_id, conditions in self.rules:
+            if not tag_counts[original_tag_id]:
+                continue
+            if not all(value_id in present_word_ids if is_word else tag_counts[value_id]
+                       for is_word, _, value_id in conditions):
+                continue
+            mask = center_tags == original_tag_id
+            for is_word, offsets, value_id in conditions:
+                values = word_matrix if is_word else tag_matrix
+                is_matched = np.zeros_like(mask)
+                for offset in offsets:
+                    is_matched |= values[:, margin + offset:margin + offset + max_length] == value_id
+                mask &= is_matched
+            changed_count = int(np.count_nonzero(mask))
+            if changed_count:
+                center_tags[mask] = replacement_tag_id
+                tag_counts[original_tag_id] -= changed_count
+                tag_counts[replacement_tag_id] += changed_count
+        return center_tags
@@ -0,0 +1,53 @@
+import os
+import logging
+import threading
+
+
+###############################################################################
+# مدل‌های آموزش‌دیده برچسب‌زن‌ها در هر پردازه فقط یک بار بارگذاری می‌شوند.
+# جنگو برای هر سطر queryset (پنل مدیریت، فهرست‌های REST و cache_taggers) یک نمونه جدید از مدل می‌سازد،
+# پس نمونه‌ها فایل مدل را باز نمی‌کنند و فقط هنگام برچسب‌زدن مدل را از اینجا می‌گیرند.
+# مدل‌ها با مسیر فایل شناخته می‌شوند و نسخه هر مدل زمان تغییر و اندازه فایل است.
+# اگر فایل عوض شود (مثلا بعد از آموزش در پردازه‌ای دیگر)، دفعه بعد مدل جدید بارگذاری می‌شود.
+logger = logging.getLogger(__name__)
+models = {} # path -> (version, model)
+lock = threading.Lock()
+load_locks = {}
+
+def get_version(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def get_load_lock(path):
+    with lock:
+        return load_locks.setdefault(path, threading.Lock())
+
+# load_function(path) مدل را از فایل می‌خواند. اگر فایل وجود نداشته باشد None برگردانده می‌شود.
+# اگر چند نخ هم‌زمان مدل را بخواهند، فقط یکی فایل را می‌خواند و بقیه منتظر همان مدل می‌مانند.
+def get_model(path, load_function):
+    try:
+        version = get_version(path)
+    except FileNotFoundError:
+        return None
+    entry = models.get(path, None)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    with get_load_lock(path):
+        entry = models.get(path, None)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        model = load_function(path)
+        with lock:
+            models[path] = (version, model)
+        logger.info(f'> Model "{path}" loaded, version : {version}')
+        return model
+
+# بعد از ذخیره مدل تازه آموزش‌دیده، همان شیء ثبت می‌شود تا دوباره از فایل خوانده نشود.
+def put_model(path, model):
+    version = get_version(path)
+    with lock:
+        models[path] = (version, model)
+
+def forget_model(path):
+    with lock:
+        models.pop(path, None)
@@ -2,13 +2,17 @@ from __future__ import unicode_literals
 import os
 import time
 import logging
+import threading
 import nltk
 from nltk.tag import brill, brill_trainer 
 # from hazm import *
 from pickle import dump, load
 from django.db.models import Count, Q
 from mohaverekhan.models import Tagger, Text, TextTag, TagSet
-from mohaverekhan import cache
+from mohaverekhan import cache, tracing, metrics
+from mohaverekhan.models.taggers import model_registry, brill_training
+from mohaverekhan.models.taggers.indexed_brill_tagger import IndexedBrillTagger
+from mohaverekhan.models.taggers.entity_regexp_tagger import use_entity_tags, use_word_patterns, get_entity_tags, set_entity_tags
 
 
 class MohaverekhanCorrectionTagger(Tagger):
@@ -17,6 +21,10 @@ class MohaverekhanCorrectionTagger(Tagger):
         proxy = True
     
     logger = logging.getLogger(__name__)
+
+    tag_options = {'trace': bool}
+    # جزئیات آخرین اجرای tag برای هر نخ جداست.
+    request_state = threading.local()
     
     """
     Emoji => X
@@ -33,7 +41,7 @@ class MohaverekhanCorrectionTagger(Tagger):
         (rf'^.*(یم)|(ید)|(ند)$', 'V'),
         (rf'^.*(می)|(خواه).*$', 'V'), #می
         (r'^\\n$', 'O'), #mohaverekhan
-        (rf'^({cache.num})|(cache.numf)$', 'U'),
+        (rf'^({cache.num})|({cache.numf})$', 'U'),
         (rf'^[{cache.punctuations}{cache.typographies}]+$', 'O'),
         # (rf'^.*(ی)$', 'A'), # اقتصادی آمریکایی اجرایی
         # (rf'^.*(ه)$', 'A'), # خوبه عالیه خارجه
@@ -48,27 +56,31 @@ class MohaverekhanCorrectionTagger(Tagger):
     current_path = os.path.abspath(os.path.dirname(__file__))
 
     main_tagger_path = os.path.join(current_path, 'metadata.pkl')
+    initial_tagger_path = os.path.join(current_path, 'initial_tagger.pkl')
+    brill_rules_path = os.path.join(current_path, 'brill_rules.pkl')
+    brill_n_jobs = int(os.environ.get('MOHAVEREKHAN_BRILL_N_JOBS', 0)) or None
     main_tagger = None
     accuracy = 0
     train_data, test_data = [], []
     mohaverekhan_text_tag_index = -1
 
-    def __init__(self, *args, **kwargs):
-        super(MohaverekhanCorrectionTagger, self).__init__(*args, **kwargs)
-        if os.path.isfile(self.main_tagger_path):
-            self.load_trained_main_tagger()
-
     def save_trained_main_tagger(self):
         self.logger.info(f'>> Trying to save main tagger in "{self.main_tagger_path}"')
         output = open(self.main_tagger_path, 'wb')
         dump(self.main_tagger, output, -1)
         output.close()
 
-    def load_trained_main_tagger(self):
-        self.logger.info(f'>> Trying to load main tagger from "{self.main_tagger_path}"')
-        input = open(self.main_tagger_path, 'rb')
-        self.main_tagger = load(input)
-        input.close()
+    def load_trained_main_tagger(self, path):
+        self.logger.info(f'>> Trying to load main tagger from "{path}"')
+        with open(path, 'rb') as input:
+            return IndexedBrillTagger(use_entity_tags(use_word_patterns(load(input), self.word_patterns)))
+
+    # نمونه‌ها فایل مدل را باز نمی‌کنند. مدل هنگام اولین برچسب‌زدن، فقط یک بار در هر پردازه خوانده می‌شود و تمام نمونه‌ها همان را استفاده می‌کنند.
+    def get_main_tagger(self):
+        main_tagger = model_registry.get_model(self.main_tagger_path, self.load_trained_main_tagger)
+        if main_tagger is None:
+            raise Exception(f'Main tagger "{self.main_tagger_path}" does not exist, train the tagger first.')
+        return main_tagger
 
     def separate_train_and_test_data(self, data):
         self.logger.info('>> Separate train and test data')
@@ -79,8 +91,8 @@ class MohaverekhanCorrectionTagger(Tagger):
         self.logger.info(f'len(train_data) : {len(self.train_data)}')
         self.logger.info(f'len(test_data) : {len(self.test_data)}')
         
-    def create_main_tagger(self):
-        self.logger.info('>> Create main tagger')
+    def create_initial_tagger(self):
+        self.logger.info('>> Create initial tagger')
         default_tagger = nltk.DefaultTagger('N')
         # default_tagger = nltk.DefaultTagger('R')
         suffix_tagger = nltk.AffixTagger(self.train_data, backoff=default_tagger, affix_length=-3, min_stem_length=2, verbose=True)
@@ -95,11 +107,35 @@ class MohaverekhanCorrectionTagger(Tagger):
         bigram_tagger = nltk.BigramTagger(self.train_data, backoff=unigram_tagger, verbose=True)
         # bigram_tagger = nltk.BigramTagger(self.train_data, verbose=True)
         trigram_tagger = nltk.TrigramTagger(self.train_data, backoff=bigram_tagger, verbose=True)
-        # self.main_tagger = trigram_tagger
+        return trigram_tagger
+
+    # زنجیره n-gram و قاعده‌های Brill هر کدام در فایل جدای خود ذخیره می‌شوند و اگر آموزش متوقف شود، دفعه بعد از همان‌جا ادامه پیدا می‌کند.
+    # قاعده‌های Brill با ParallelBrillTrainer در brill_n_jobs پردازه پیدا می‌شوند و پیشرفت آن در model_details['training'] نوشته می‌شود.
+    def get_initial_tagger(self, fingerprint):
+        checkpoint = brill_training.load_checkpoint(self.initial_tagger_path, fingerprint)
+        if checkpoint is not None:
+            self.logger.info(f'> Initial tagger loaded from "{self.initial_tagger_path}"')
+            return checkpoint['initial_tagger']
+        self.save_training_progress({'stage': 'initial-tagger'})
+        initial_tagger = self.create_initial_tagger()
+        brill_training.save_checkpoint(self.initial_tagger_path, fingerprint, {'initial_tagger': initial_tagger})
+        return initial_tagger
+
+    def save_training_progress(self, progress):
+        self.model_details['training'] = progress
+        self.save(update_fields=['model_details'])
+
+    def create_main_tagger(self):
+        self.logger.info('>> Create main tagger')
+        fingerprint = brill_training.get_fingerprint(self.train_data, self.word_patterns)
+        initial_tagger = self.get_initial_tagger(fingerprint)
 
         templates = brill.fntbl37()
-        brill_trainer_result = brill_trainer.BrillTaggerTrainer( 
-                trigram_tagger, templates, deterministic=True) 
+        brill_trainer_result = brill_training.ParallelBrillTrainer(
+                initial_tagger, templates, n_jobs=self.brill_n_jobs,
+                checkpoint_path=self.brill_rules_path,
+                fingerprint=brill_training.get_fingerprint(fingerprint, 'fntbl37', 30),
+                progress_function=self.save_training_progress)
         brill_tagger = brill_trainer_result.train(self.train_data, max_rules=300, min_score=30)
         self.logger.info(f'>brill_tagger.print_template_statistics() => in console :(')
         brill_tagger.print_template_statistics()
@@ -107,12 +143,14 @@ class MohaverekhanCorrectionTagger(Tagger):
         self.logger.info(f'>brill_tagger.rules() : \n{rules}')
         self.main_tagger = brill_tagger
 
+        self.save_training_progress(dict(self.model_details.get('training', {}), stage='evaluate'))
         self.accuracy = self.main_tagger.evaluate(self.test_data)
         self.logger.info(f'>> Main tagger evaluate accuracy : {self.accuracy}')
 
 
     normalizer = None
-    def train(self):
+    # جمله‌های برچسب‌خورده معتبر برای آموزش و ارزیابی
+    def get_tagged_sentences(self):
         bijankhan_tag_set = TagSet.objects.get(name='bijankhan-tag-set')
         # text_tokens_list = TextTag.objects.filter(tagger__tag_set=bijankhan_tag_set).values_list('tagged_tokens', flat=True)
         self.logger.info(f'> self.tag_set : {self.tag_set}')
@@ -123,7 +161,7 @@ class MohaverekhanCorrectionTagger(Tagger):
         self.logger.info(f'> text_tokens_list.count() : {text_tokens_list.count()}')
         if text_tokens_list.count() == 0:
             self.logger.error(f'> text_tokens_list count == 0 !!!')
-            return
+            return None
 
         self.normalizer = cache.normalizers['mohaverekhan-basic-normalizer']
         tagged_sentences = []
@@ -155,30 +193,99 @@ class MohaverekhanCorrectionTagger(Tagger):
         self.logger.info(f'> self.mohaverekhan_text_tag_index : {self.mohaverekhan_text_tag_index}')
         self.logger.info(f'> tagged_sentences[0] : \n\n{tagged_sentences[0]}\n\n')
         self.logger.info(f'> tagged_sentences[-1] : \n\n{tagged_sentences[-1]}\n\n')
+        return tagged_sentences
+
+    def train(self):
+        tagged_sentences = self.get_tagged_sentences()
+        if tagged_sentences is None:
+            return
         self.separate_train_and_test_data(tagged_sentences)
         self.create_main_tagger()
         self.save_trained_main_tagger()
+        model_registry.put_model(self.main_tagger_path, IndexedBrillTagger(use_entity_tags(self.main_tagger)))
         self.model_details['state'] = 'ready'
         self.model_details['accuracy'] = self.accuracy
+        self.model_details['training'] = dict(self.model_details.get('training', {}), stage='done')
         self.save()
 
-    
-    def tag(self, text_content):
+    # سرعت BrillTagger و IndexedBrillTagger (جمله به جمله و دسته‌ای) روی test_data مقایسه و برابری خروجی آن‌ها بررسی می‌شود.
+    def benchmark_brill_tagging(self, repeat=3):
+        if not self.test_data:
+            tagged_sentences = self.get_tagged_sentences()
+            if tagged_sentences is None:
+                return None
+            self.separate_train_and_test_data(tagged_sentences)
+        indexed_tagger = self.get_main_tagger()
+        sentences = [[token_content for token_content, _ in tagged_sentence] for tagged_sentence in self.test_data]
+        token_count = sum(len(sentence) for sentence in sentences)
+        report, outputs = {}, {}
+        tag_functions = (
+            ('nltk', lambda: [indexed_tagger.brill_tagger.tag(sentence) for sentence in sentences]),
+            ('indexed', lambda: [indexed_tagger.tag(sentence) for sentence in sentences]),
+            ('batch', lambda: indexed_tagger.tag_sents(sentences)),
+        )
+        for name, tag_function in tag_functions:
+            beg_ts = time.perf_counter()
+            for _ in range(repeat):
+                outputs[name] = tag_function()
+            elapsed = (time.perf_counter() - beg_ts) / repeat
+            report[name] = {
+                'seconds': elapsed,
+                'tokens_per_second': token_count / elapsed if elapsed else None,
+            }
+        report['speedup'] = report['nltk']['seconds'] / report['indexed']['seconds'] if report['indexed']['seconds'] else None
+        report['batch_speedup'] = report['nltk']['seconds'] / report['batch']['seconds'] if report['batch']['seconds'] else None
+        report['is_equal'] = outputs['nltk'] == outputs['indexed'] == outputs['batch']
+        report['sentence_count'] = len(sentences)
+        report['token_count'] = token_count
+        self.logger.info(f'> Brill tagging benchmark : {report}')
+        return report
+
+    def get_tag_details(self):
+        return getattr(self.request_state, 'tag_details', {})
+
+    # trace : ورودی و خروجی مراحل نرمالایزر و برچسب‌زن در جزئیات پاسخ برگردانده می‌شود.
+    def tag(self, text_content, trace=False):
         beg_ts = time.time()
-        self.logger.info(f'>>> mohaverekhan_correction_tagger : \n{text_content}')
+        self.request_state.tag_details = {}
+        is_trace_owner = False
+        if trace:
+            trace, is_trace_owner = tracing.start_trace()
+        try:
+            tagged_tokens = self.tag_text_content(text_content)
+        finally:
+            if is_trace_owner:
+                tracing.stop_trace()
+        if is_trace_owner:
+            self.request_state.tag_details = {'trace': trace.to_dict()}
+
+        end_ts = time.time()
+        metrics.record(self.name, 'tag', end_ts - beg_ts)
+        self.logger.info(f"> (Time)({end_ts - beg_ts:.6f})")
+        return tagged_tokens
 
-        text_content = cache.normalizers['mohaverekhan-correction-normalizer']\
-                        .normalize(text_content)
-        self.logger.info(f'>>> mohaverekhan_correction_normalizer: \n{text_content}')
+    def tag_text_content(self, text_content):
+        normalizer = cache.normalizers['mohaverekhan-correction-normalizer']
+        text_content = normalizer.normalize(text_content)
 
         token_contents = text_content.replace('\n', ' \\n ').split(' ')
-        if not self.main_tagger:
-            if os.path.isfile(self.main_tagger_path):
-                self.load_trained_main_tagger()
-            else:
-                raise Exception()
+        main_tagger = self.get_main_tagger()
         
-        tagged_tokens = self.main_tagger.tag(token_contents)
+        # نوع نشانه‌های بی‌نهایت را نرمالایزر پیدا کرده و RegexpTagger آن‌ها را دوباره بررسی نمی‌کند.
+        set_entity_tags(get_entity_tags(normalizer.get_entity_kinds(), token_contents))
+        try:
+            with metrics.timer(self.name, 'brill_tag'):
+                tagged_tokens = main_tagger.tag(token_contents)
+        finally:
+            set_entity_tags(None)
+        trace = tracing.get_trace()
+        tagged_tokens = self.fix_r_tags(tagged_tokens, trace)
+
+        if trace is not None:
+            trace.add_stage(self.name, 'tag', token_contents, [list(tagged_token) for tagged_token in tagged_tokens])
+        return tagged_tokens
+
+    def fix_r_tags(self, tagged_tokens, trace=None):
         token, tag = '', ''
         most = 0
         for index, tagged_token in enumerate(tagged_tokens):
@@ -191,10 +298,28 @@ class MohaverekhanCorrectionTagger(Tagger):
                             most = value
                             tag = key
                             tagged_tokens[index] = (token, tag)
-
-        end_ts = time.time()
-        self.logger.info(f"> (Time)({end_ts - beg_ts:.6f})")
-        self.logger.info(f'>>> Result mohaverekhan_correction_tagger : \n{tagged_tokens}')
+                    if trace is not None:
+                        trace.add_decision(self.name, 'most_frequent_tag_for_r', token, tag)
         return tagged_tokens
 
+    # برچسب‌زدن دسته‌ای متن‌ها، مثلا برای برچسب‌زدن دوباره تمام متن‌ها.
+    # تمام متن‌ها با هم به IndexedBrillTagger.tag_sents داده می‌شوند و خروجی برای هر متن برابر tag است.
+    def tag_batch(self, text_contents, batch_size=1024):
+        beg_ts = time.time()
+        normalizer = cache.normalizers['mohaverekhan-correction-normalizer']
+        token_contents_list, entity_tags_list = [], []
+        for text_content in text_contents:
+            text_content = normalizer.normalize(text_content)
+            token_contents = text_content.replace('\n', ' \\n ').split(' ')
+            token_contents_list.append(token_contents)
+            entity_tags_list.append(get_entity_tags(normalizer.get_entity_kinds(), token_contents))
+
+        main_tagger = self.get_main_tagger()
+        with metrics.timer(self.name, 'brill_tag_batch'):
+            tagged_tokens_list = main_tagger.tag_sents(token_contents_list, entity_tags_list, batch_size)
+        tagged_tokens_list = [self.fix_r_tags(tagged_tokens) for tagged_tokens in tagged_tokens_list]
 
+        end_ts = time.time()
+        metrics.record(self.name, 'tag_batch', end_ts - beg_ts)
+        self.logger.info(f"> (Time)({end_ts - beg_ts:.6f})({len(text_contents)} texts)")
+        return tagged_tokens_list
@@ -8,7 +8,10 @@ from nltk.tag import brill, brill_trainer
 from pickle import dump, load
 from django.db.models import Count, Q
 from mohaverekhan.models import Tagger, Text, TextTag, TagSet
-from mohaverekhan import cache
+from mohaverekhan import cache, metrics
+from mohaverekhan.models.taggers import model_registry, brill_training
+from mohaverekhan.models.taggers.indexed_brill_tagger import IndexedBrillTagger
+from mohaverekhan.models.taggers.entity_regexp_tagger import use_word_patterns
 
 
 class MohaverekhanSeq2SeqTagger(Tagger):
@@ -31,7 +34,7 @@ class MohaverekhanSeq2SeqTagger(Tagger):
         (rf'^.*(یم)|(ید)|(ند)$', 'V'),
         (rf'^.*(می)|(خواه).*$', 'V'),
         (r'^\\n$', 'O'), #mohaverekhan
-        (rf'^({cache.num})|(cache.numf)$', 'U'),
+        (rf'^({cache.num})|({cache.numf})$', 'U'),
         (rf'^[{cache.punctuations}{cache.typographies}]+$', 'O'),
         (rf'^([{cache.emojies}]+)|(EMOJI)$', 'X'), #hazm emoticons - symbols & pictographs - pushpin & round pushpin
         (rf'^({cache.id})|(ID)$', 'S'), #hazm
@@ -44,27 +47,31 @@ class MohaverekhanSeq2SeqTagger(Tagger):
     current_path = os.path.abspath(os.path.dirname(__file__))
 
     main_tagger_path = os.path.join(current_path, 'metadata.pkl')
+    initial_tagger_path = os.path.join(current_path, 'initial_tagger.pkl')
+    brill_rules_path = os.path.join(current_path, 'brill_rules.pkl')
+    brill_n_jobs = int(os.environ.get('MOHAVEREKHAN_BRILL_N_JOBS', 0)) or None
     main_tagger = None
     accuracy = 0
     train_data, test_data = [], []
     mohaverekhan_text_tag_index = -1
 
-    def __init__(self, *args, **kwargs):
-        super(MohaverekhanSeq2SeqTagger, self).__init__(*args, **kwargs)
-        if os.path.isfile(self.main_tagger_path):
-            self.load_trained_main_tagger()
-
     def save_trained_main_tagger(self):
         self.logger.info(f'>> Trying to save main tagger in "{self.main_tagger_path}"')
         output = open(self.main_tagger_path, 'wb')
         dump(self.main_tagger, output, -1)
         output.close()
 
-    def load_trained_main_tagger(self):
-        self.logger.info(f'>> Trying to load main tagger from "{self.main_tagger_path}"')
-        input = open(self.main_tagger_path, 'rb')
-        self.main_tagger = load(input)
-        input.close()
+    def load_trained_main_tagger(self, path):
+        self.logger.info(f'>> Trying to load main tagger from "{path}"')
+        with open(path, 'rb') as input:
+            return IndexedBrillTagger(use_word_patterns(load(input), self.word_patterns))
+
+    # نمونه‌ها فایل مدل را باز نمی‌کنند. مدل هنگام اولین برچسب‌زدن، فقط یک بار در هر پردازه خوانده می‌شود و تمام نمونه‌ها همان را استفاده می‌کنند.
+    def get_main_tagger(self):
+        main_tagger = model_registry.get_model(self.main_tagger_path, self.load_trained_main_tagger)
+        if main_tagger is None:
+            raise Exception(f'Main tagger "{self.main_tagger_path}" does not exist, train the tagger first.')
+        return main_tagger
 
     def separate_train_and_test_data(self, data):
         self.logger.info('>> Separate train and test data')
@@ -75,8 +82,8 @@ class MohaverekhanSeq2SeqTagger(Tagger):
         self.logger.info(f'len(train_data) : {len(self.train_data)}')
         self.logger.info(f'len(test_data) : {len(self.test_data)}')
         
-    def create_main_tagger(self):
-        self.logger.info('>> Create main tagger')
+    def create_initial_tagger(self):
+        self.logger.info('>> Create initial tagger')
         default_tagger = nltk.DefaultTagger('N')
         # default_tagger = nltk.DefaultTagger('R')
         suffix_tagger = nltk.AffixTagger(self.train_data, backoff=default_tagger, affix_length=-3, min_stem_length=2, verbose=True)
@@ -86,11 +93,35 @@ class MohaverekhanSeq2SeqTagger(Tagger):
         unigram_tagger = nltk.UnigramTagger(self.train_data, backoff=regexp_tagger, verbose=True)
         bigram_tagger = nltk.BigramTagger(self.train_data, backoff=unigram_tagger, verbose=True)
         trigram_tagger = nltk.TrigramTagger(self.train_data, backoff=bigram_tagger, verbose=True)
-        # main_tagger = trigram_tagger
+        return trigram_tagger
+
+    # زنجیره n-gram و قاعده‌های Brill هر کدام در فایل جدای خود ذخیره می‌شوند و اگر آموزش متوقف شود، دفعه بعد از همان‌جا ادامه پیدا می‌کند.
+    # قاعده‌های Brill با ParallelBrillTrainer در brill_n_jobs پردازه پیدا می‌شوند و پیشرفت آن در model_details['training'] نوشته می‌شود.
+    def get_initial_tagger(self, fingerprint):
+        checkpoint = brill_training.load_checkpoint(self.initial_tagger_path, fingerprint)
+        if checkpoint is not None:
+            self.logger.info(f'> Initial tagger loaded from "{self.initial_tagger_path}"')
+            return checkpoint['initial_tagger']
+        self.save_training_progress({'stage': 'initial-tagger'})
+        initial_tagger = self.create_initial_tagger()
+        brill_training.save_checkpoint(self.initial_tagger_path, fingerprint, {'initial_tagger': initial_tagger})
+        return initial_tagger
+
+    def save_training_progress(self, progress):
+        self.model_details['training'] = progress
+        self.save(update_fields=['model_details'])
+
+    def create_main_tagger(self):
+        self.logger.info('>> Create main tagger')
+        fingerprint = brill_training.get_fingerprint(self.train_data, self.word_patterns)
+        initial_tagger = self.get_initial_tagger(fingerprint)
 
         templates = brill.fntbl37()
-        brill_trainer_result = brill_trainer.BrillTaggerTrainer( 
-                trigram_tagger, templates, deterministic=True) 
+        brill_trainer_result = brill_training.ParallelBrillTrainer(
+                initial_tagger, templates, n_jobs=self.brill_n_jobs,
+                checkpoint_path=self.brill_rules_path,
+                fingerprint=brill_training.get_fingerprint(fingerprint, 'fntbl37', 30),
+                progress_function=self.save_training_progress)
         brill_tagger = brill_trainer_result.train(self.train_data, max_rules=300, min_score=30)
         self.logger.info(f'>brill_tagger.print_template_statistics() => in console :(')
         brill_tagger.print_template_statistics()
@@ -98,6 +129,7 @@ class MohaverekhanSeq2SeqTagger(Tagger):
         self.logger.info(f'>brill_tagger.rules() : \n{rules}')
         self.main_tagger = brill_tagger
 
+        self.save_training_progress(dict(self.model_details.get('training', {}), stage='evaluate'))
         self.accuracy = self.main_tagger.evaluate(self.test_data)
         self.logger.info(f'>> Main tagger evaluate accuracy : {self.accuracy}')
 
@@ -149,8 +181,10 @@ class MohaverekhanSeq2SeqTagger(Tagger):
         self.separate_train_and_test_data(tagged_sentences)
         self.create_main_tagger()
         self.save_trained_main_tagger()
+        model_registry.put_model(self.main_tagger_path, IndexedBrillTagger(self.main_tagger))
         self.model_details['state'] = 'ready'
         self.model_details['accuracy'] = self.accuracy
+        self.model_details['training'] = dict(self.model_details.get('training', {}), stage='done')
         self.save()
 
     
@@ -163,17 +197,30 @@ class MohaverekhanSeq2SeqTagger(Tagger):
         self.logger.info(f'>>> mohaverekhan_seq2seq_normalizer: \n{text_content}')
 
         token_contents = text_content.replace('\n', ' \\n ').split(' ')
-        if not self.main_tagger:
-            if os.path.isfile(self.main_tagger_path):
-                self.load_trained_main_tagger()
-            else:
-                raise Exception()
+        main_tagger = self.get_main_tagger()
         
-        tagged_tokens = self.main_tagger.tag(token_contents)
+        with metrics.timer(self.name, 'brill_tag'):
+            tagged_tokens = main_tagger.tag(token_contents)
         
         end_ts = time.time()
+        metrics.record(self.name, 'tag', end_ts - beg_ts)
         self.logger.info(f"> (Time)({end_ts - beg_ts:.6f})")
         self.logger.info(f'>>> Result mohaverekhan_seq2seq_tagger : \n{tagged_tokens}')
         return tagged_tokens
 
+    # برچسب‌زدن دسته‌ای متن‌ها، مثلا برای برچسب‌زدن دوباره تمام متن‌ها.
+    # متن‌ها با normalize_batch نرمال و با IndexedBrillTagger.tag_sents برچسب‌زده می‌شوند و خروجی برای هر متن برابر tag است.
+    def tag_batch(self, text_contents, batch_size=1024):
+        beg_ts = time.time()
+        text_contents = cache.normalizers['mohaverekhan-seq2seq-normalizer']\
+                        .normalize_batch(text_contents)
+        token_contents_list = [text_content.replace('\n', ' \\n ').split(' ') for text_content in text_contents]
+        main_tagger = self.get_main_tagger()
 
+        with metrics.timer(self.name, 'brill_tag_batch'):
+            tagged_tokens_list = main_tagger.tag_sents(token_contents_list, batch_size=batch_size)
+
+        end_ts = time.time()
+        metrics.record(self.name, 'tag_batch', end_ts - beg_ts)
+        self.logger.info(f"> (Time)({end_ts - beg_ts:.6f})({len(text_contents)} texts)")
+        return tagged_tokens_list
@@ -0,0 +1,19 @@
+import os
+import sys
+import types
+import pickle
+
+
+###############################################################################
+# پردازه‌ای که با spawn ساخته می‌شود Django را راه‌اندازی نکرده است و وارد کردن mohaverekhan.models (مدل‌های Django) در آن خطا می‌دهد.
+# کدهایی مثل آموزش Brill که در زیربسته‌های mohaverekhan.models هستند به مدل‌ها نیازی ندارند،
+# پس بسته mohaverekhan.models بدون اجرای __init__ آن (فقط با مسیر زیربسته‌ها) ساخته می‌شود و سپس تابع و آرگومان‌هایش از payload خوانده می‌شوند.
+# payload : pickle جفت (تابع، آرگومان‌ها)
+# args : آرگومان‌هایی که خودشان باید با Process فرستاده شوند (مثل Connection) و قبل از آرگومان‌های payload به تابع داده می‌شوند.
+def run(payload, *args):
+    if 'mohaverekhan.models' not in sys.modules:
+        models_package = types.ModuleType('mohaverekhan.models')
+        models_package.__path__ = [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')]
+        sys.modules['mohaverekhan.models'] = models_package
+    function, payload_args = pickle.loads(payload)
+    return function(*args, *payload_args)
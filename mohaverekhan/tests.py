@@ -1,16 +1,27 @@
-from django.test import TestCase
+import os
+import time
+import random
+from django.test import TestCase, SimpleTestCase
 from rest_framework.test import APIClient
 from rest_framework import status
 # from rest_framework.test import APIRequestFactory
 from django.urls import reverse
 
-from .models import (Normalizer, Text, NormalText, 
+from .models import (Normalizer, Text, 
             TagSet, Tag, Tagger,
-            Sentence, TaggedSentence, TranslationCharacter, 
-            RefinementPattern)
+            MohaverekhanReplacementNormalizer, MohaverekhanCorrectionNormalizer, 
+            MohaverekhanCorrectionTagger)
 
 import json
-from mohaverekhan import data_importer
+import nltk
+import tempfile
+import threading
+from mohaverekhan import data_importer, cache, metrics
+from mohaverekhan.models.normalizers.mohaverekhan_seq2seq_normalizer.inference_queue import InferenceQueue
+from mohaverekhan.models.normalizers.mohaverekhan_seq2seq_normalizer.normal_lexicon import NormalLexicon
+from mohaverekhan.models.taggers.indexed_brill_tagger import IndexedBrillTagger
+from mohaverekhan.models.taggers.brill_training import ParallelBrillTrainer
+from nltk.tag import brill, brill_trainer
 
 base_api_url = r'http://127.0.0.1:8000/mohaverekhan/api'
 normalizers_url = fr'{base_api_url}/normalizers'
@@ -79,6 +90,368 @@ class NormalizerViewTests(TestCase):
         # self.assertContains(response, "No polls are available.")
         # self.assertQuerysetEqual(response.context['latest_question_list'], [])
 
+sample_inputs_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_inputs.txt')
+
+class ReplacementNormalizerTests(SimpleTestCase):
+    def setUp(self):
+        self.normalizer = MohaverekhanReplacementNormalizer()
+        with open(sample_inputs_path, 'r', encoding='utf-8') as sample_inputs_file:
+            self.sample_inputs = sample_inputs_file.read().split('\n')
+
+    # جمله‌هایی که نشانه‌های آن‌ها با فاصله، حروف فارسی یا علامت از هم جدا شده‌اند یا بدون فاصله به هم چسبیده‌اند.
+    def generate_texts(self, count, seed=0):
+        words = ('😀', '😂😂', '🙏🏻', 'سلام', 'خوبی', '.', '،', '؟', '!', 'ali@gmail.com', '@bitianist', 
+            '#tag', '#هشتگ', 'http://www.x.ir', 'www.site.com/a', 'site.com', '۱۲۴', '124', '۱۲۴.۵', 
+            '3,5', '-4', '+۱', 'ab', 'x1', '\n', '«', '»', ':', '(', ')')
+        glues = ('', '', ' ', ' ', '  ')
+        generator = random.Random(seed)
+        texts = []
+        for i in range(count):
+            text_content = ''
+            for j in range(generator.randint(1, 10)):
+                text_content += generator.choice(words) + generator.choice(glues)
+            texts.append(text_content)
+        return texts
+
+    def test_fused_engine_parity(self):
+        for text_content in self.sample_inputs + self.generate_texts(20000):
+            self.assertEqual(
+                self.normalizer.replace_entities(text_content),
+                self.normalizer.replace_sequentially(text_content),
+                msg=repr(text_content))
+
+class CorrectionNormalizerTests(SimpleTestCase):
+    # اصلاح موازی جمله‌ها در pool مشترک باید همان خروجی اصلاح پشت سر هم را داشته باشد.
+    def test_parallel_output_equals_serial_output(self):
+        correction_normalizer = cache.normalizers['mohaverekhan-correction-normalizer']
+        with open(sample_inputs_path, 'r', encoding='utf-8') as sample_inputs_file:
+            text_contents = sample_inputs_file.read().split('\n')
+        text_contents.append(' '.join(text_contents))
+        for text_content in text_contents:
+            self.assertEqual(
+                correction_normalizer.normalize(text_content, parallel=True),
+                correction_normalizer.normalize(text_content),
+                msg=repr(text_content))
+
+    def test_fast_profile_skips_last_join(self):
+        correction_normalizer = cache.normalizers['mohaverekhan-correction-normalizer']
+        correction_normalizer.normalize('آرام کنندهخوبی', profile='fast')
+        normalize_details = correction_normalizer.get_normalize_details()
+        self.assertEqual(normalize_details['profile'], 'fast')
+        self.assertIn('join_multipart_tokens3', normalize_details['skipped_stages'])
+        self.assertNotIn('join_multipart_tokens3', normalize_details['ran_stages'])
+
+        correction_normalizer.normalize('آرام کنندهخوبی')
+        normalize_details = correction_normalizer.get_normalize_details()
+        self.assertIn('join_multipart_tokens3', normalize_details['ran_stages'])
+        self.assertFalse(normalize_details['skipped_stages'])
+
+    # وقتی زمان مجاز تمام شده باشد هیچ مرحله‌ای اجرا نمی‌شود ولی نتیجه همچنان برگردانده می‌شود.
+    def test_expired_deadline_skips_remaining_stages(self):
+        correction_normalizer = cache.normalizers['mohaverekhan-correction-normalizer']
+        text_content = correction_normalizer.normalize('آرام کنندهخوبی', deadline=0)
+        normalize_details = correction_normalizer.get_normalize_details()
+        self.assertTrue(text_content)
+        self.assertEqual(normalize_details['ran_stages'], [])
+        self.assertEqual(
+            normalize_details['skipped_stages'],
+            [stage_name for stage_name, stage in correction_normalizer.get_token_stages()])
+
+class EntitySpanTests(SimpleTestCase):
+    # برچسبی که از روی نوع بازه گذاشته می‌شود باید همان برچسب RegexpTagger باشد.
+    def test_entity_tags_match_regexp_tagger(self):
+        regexp_tagger = nltk.RegexpTagger(MohaverekhanCorrectionTagger.word_patterns)
+        with open(sample_inputs_path, 'r', encoding='utf-8') as sample_inputs_file:
+            text_content = sample_inputs_file.read()
+        text_content += ' ' + ' '.join((
+            'ali@gmail.com', '@bitianist', '#tag', '#خونه', '#!!', 'http://www.x.ir', 'www.site.com/a', 
+            '۱۲۴', '۱۲۴.۵', '-4', ',5', '12abc', '😀😀', '🙏🏻', 'cache.numf.com', 'ab'))
+        token_contents = text_content.replace('\n', ' ').split(' ')
+        token_offsets, offset = {}, 0
+        for token_content in token_contents:
+            token_offsets[offset] = token_content
+            offset += len(token_content) + 1
+
+        entity_spans = cache.find_entity_spans(text_content)
+        self.assertTrue(entity_spans)
+        for offset, kind in entity_spans:
+            token_content = token_offsets[offset]
+            self.assertEqual(
+                cache.entity_tags[kind], 
+                regexp_tagger.tag([token_content])[0][1], 
+                msg=token_content)
+
+    # نوع نشانه‌هایی که fix_spaces_in_text پیدا می‌کند باید همان بازه‌های find_entity_spans روی متن خروجی باشد.
+    def test_fix_spaces_collects_entity_kinds(self):
+        correction_normalizer = MohaverekhanCorrectionNormalizer()
+        with open(sample_inputs_path, 'r', encoding='utf-8') as sample_inputs_file:
+            text_contents = sample_inputs_file.read().split('\n')
+        text_contents += ['۱۲۴سلام😀', 'ali@gmail.comسلام', '124  site.com\n#tag', 'x1😀#tag']
+        for text_content in text_contents:
+            fixed_text_content, entity_kinds = correction_normalizer.fix_spaces_in_text(text_content)
+            fixed_text_content = fixed_text_content.replace(' newline ', '\n')
+            self.assertEqual(
+                entity_kinds, 
+                {
+                    fixed_text_content[offset:].split(' ')[0].split('\n')[0]: kind
+                        for offset, kind in cache.find_entity_spans(fixed_text_content)
+                },
+                msg=repr(text_content))
+
+class AdversarialInputTests(SimpleTestCase):
+    # زمان عبور هر ورودی ساختگی از تمام الگوهایی که link و email را دارند باید با طول ورودی خطی باشد.
+    # زمان ورودی با طول 2n با زمان ورودی با طول n مقایسه می‌شود. با زمان خطی نسبت حدود ۲ و با زمان درجه دو حدود ۴ است.
+    # کمترین زمان چند بار اجرا گرفته می‌شود و زمان‌های خیلی کوتاه با time_floor از نوسان سیستم در امان هستند.
+    length = 20000
+    max_growth = 3
+    time_floor = 0.01
+    repeat = 3
+
+    def generate_inputs(self, n):
+        return {
+            'host': 'a' * n + '^',
+            'path': 'a.aa' + 'a' * n + '^',
+            'dots': 'a' + '.aa' * (n // 3) + '^',
+            'www': 'www.' * (n // 4) + '^',
+            'labels_path': ('a' + '.aa' * 120 + '/' + 'a' * 2000 + '^') * (n // 2400),
+            'local': 'a' * n + '@',
+            'domain': 'a@' + 'a.' * (n // 2) + '^',
+            'domain_dash': 'a@' + 'a-' * (n // 2) + '^',
+            'at_dots': '@a.' * (n // 3) + '^',
+            'persian_path': 'site.com/' + 'س' * n + '^',
+        }
+
+    def measure(self, function, text_content):
+        elapsed_times = []
+        for _ in range(self.repeat):
+            beg_ts = time.perf_counter()
+            function(text_content)
+            elapsed_times.append(time.perf_counter() - beg_ts)
+        return min(elapsed_times)
+
+    def assertLinear(self, name, function, text_content, double_text_content):
+        elapsed = self.measure(function, text_content)
+        double_elapsed = self.measure(function, double_text_content)
+        self.assertLess(double_elapsed, self.max_growth * elapsed + self.time_floor, 
+            msg=f'{name} took {elapsed:.4f}s for n and {double_elapsed:.4f}s for 2n')
+
+    def test_entity_patterns_scale_linearly(self):
+        replacement_normalizer = MohaverekhanReplacementNormalizer()
+        regexp_tagger = nltk.RegexpTagger(MohaverekhanCorrectionTagger.word_patterns)
+        functions = {
+            'replace_entities': replacement_normalizer.replace_entities,
+            'find_entity_spans': cache.find_entity_spans,
+            'fix_spaces_in_text': MohaverekhanCorrectionNormalizer().fix_spaces_in_text,
+            'regexp_tagger': lambda text_content: regexp_tagger.tag([text_content]),
+        }
+        for index, (pattern, replacement) in enumerate(MohaverekhanReplacementNormalizer.replacement_patterns):
+            functions[f'replacement_pattern_{index}'] = lambda text_content, pattern=pattern, replacement=replacement: pattern.sub(replacement, text_content)
+        for index, (pattern, replacement) in enumerate(MohaverekhanCorrectionNormalizer.correction_patterns):
+            functions[f'correction_pattern_{index}'] = lambda text_content, pattern=pattern, replacement=replacement: pattern.sub(replacement, text_content)
+
+        inputs, double_inputs = self.generate_inputs(self.length), self.generate_inputs(2 * self.length)
+        for input_name, text_content in inputs.items():
+            for function_name, function in functions.items():
+                self.assertLinear(f'({input_name})({function_name})', function, text_content, double_inputs[input_name])
+
+    # الگوهای link و email طول هر بخش را مثل RFC محدود می‌کنند. نشانه‌ای که از این حد بلندتر باشد یک نشانه کامل شناخته نمی‌شود.
+    # link : هر بخش دامنه ۶۳، آخرین بخش ۲ حرف و بقیه در مسیر تا ۲۰۴۸، حداکثر ۱۲۶ بخش میانی
+    # email : بخش محلی ۶۴، هر بخش دامنه ۶۳ و پسوند ۶۳ حرف
+    def test_entity_length_limits(self):
+        replacement_normalizer = MohaverekhanReplacementNormalizer()
+        for kind, token_content, is_entity in (
+            ('LINK', 'a' * 63 + '.com', True),
+            ('LINK', 'a' * 64 + '.com', False),
+            ('LINK', 'a' + '.aa' * 126 + '.com', True),
+            ('LINK', 'a' + '.aa' * 127 + '.com', False),
+            ('LINK', 'site.co' + 'm' * 2048, True),
+            ('LINK', 'site.co' + 'm' * 2049, False),
+            ('EMAIL', 'a' * 64 + '@gmail.com', True),
+            ('EMAIL', 'a' * 65 + '@gmail.com', False),
+            ('EMAIL', 'a@' + 'b' * 63 + '.com', True),
+            ('EMAIL', 'a@' + 'b' * 64 + '.com', False),
+            ('EMAIL', 'a@b.' + 'c' * 63, True),
+            ('EMAIL', 'a@b.' + 'c' * 64, False),
+        ):
+            text_content = f'سلام {token_content} خوبی'
+            self.assertEqual(cache.find_entity_spans(text_content), [(5, kind)] if is_entity else [], 
+                msg=f'({kind})({len(token_content)})')
+            self.assertEqual(replacement_normalizer.replace_entities(text_content) == f'سلام {kind} خوبی', is_entity, 
+                msg=f'({kind})({len(token_content)})')
+
+class InferenceQueueTests(SimpleTestCase):
+
+    def test_concurrent_requests_are_batched(self):
+        batch_sizes = []
+        def batch_function(items):
+            batch_sizes.append(len(items))
+            return [item.upper() for item in items]
+        inference_queue = InferenceQueue(batch_function, 'test-inference-queue', max_batch_size=8, max_wait=0.05)
+        results = {}
+        def request(index):
+            results[index] = inference_queue(f'text{index}', timeout=5)
+        threads = [threading.Thread(target=request, args=(index,)) for index in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        inference_queue.stop()
+        self.assertEqual(results, {index: f'TEXT{index}' for index in range(20)})
+        self.assertEqual(sum(batch_sizes), 20)
+        self.assertLessEqual(max(batch_sizes), 8)
+        self.assertLess(len(batch_sizes), 20)
+
+    def test_errors_reach_every_caller(self):
+        def batch_function(items):
+            raise ValueError('failed')
+        inference_queue = InferenceQueue(batch_function, 'test-inference-queue')
+        futures = [inference_queue.submit(index) for index in range(3)]
+        for future in futures:
+            self.assertRaises(ValueError, future.result, 5)
+        inference_queue.stop()
+
+class NormalLexiconTests(SimpleTestCase):
+
+    def setUp(self):
+        self.normal_lexicon = NormalLexicon()
+        self.normal_lexicon.tables = self.normal_lexicon.build_tables(
+            ['اونا میان', 'در میان ما'], ['آن‌ها می‌آیند', 'در میان ما'], 
+            ['خونه', 'بریم'], ['خانه', 'برویم'])
+        self.normal_lexicon.lexicon_version = cache.lexicon_version
+
+    def test_formal_words_pass_through(self):
+        self.assertEqual(self.normal_lexicon.lookup('بریم خونه'), 'برویم خانه')
+        self.assertEqual(self.normal_lexicon.lookup('خانه ما'), 'خانه ما')
+
+    def test_words_with_informal_use_go_to_the_model(self):
+        self.assertEqual(self.normal_lexicon.lookup('در میان ما'), 'در میان ما')
+        self.assertIsNone(self.normal_lexicon.lookup('میان خانه'))
+        self.assertIsNone(self.normal_lexicon.lookup('ما میان'))
+
+    def test_lookup_misses_until_tables_are_built(self):
+        normal_lexicon = NormalLexicon()
+        normal_lexicon.refresh = lambda lexicon_version: None
+        self.assertIsNone(normal_lexicon.lookup('خانه'))
+
+class MetricsTests(SimpleTestCase):
+
+    def setUp(self):
+        metrics.reset('metrics-test')
+
+    def tearDown(self):
+        metrics.reset('metrics-test')
+
+    # صدک‌ها وسط بازه‌های لگاریتمی هستند، پس خطای نسبی آن‌ها باید کمتر از ۱۰ درصد باشد.
+    def test_percentiles_of_known_values(self):
+        for milliseconds in range(1, 101):
+            metrics.record('metrics-test', 'stage', milliseconds / 1000)
+        metrics.record_value('metrics-test', 'batch_size', 4)
+        stage_percentiles = metrics.get_stage_percentiles('metrics-test')
+        histogram_dict = stage_percentiles['stage']
+        self.assertEqual(histogram_dict['count'], 100)
+        self.assertAlmostEqual(histogram_dict['mean_ms'], 50.5)
+        self.assertAlmostEqual(histogram_dict['min_ms'], 1)
+        self.assertAlmostEqual(histogram_dict['max_ms'], 100)
+        for percentile in metrics.percentiles:
+            self.assertLess(abs(histogram_dict[f'p{percentile}_ms'] - percentile) / percentile, 0.1)
+        self.assertEqual(stage_percentiles['batch_size']['p50'], 4)
+
+    def test_reset_keeps_other_models(self):
+        metrics.record('metrics-test', 'stage', 0.001)
+        metrics.record('metrics-test-other', 'stage', 0.001)
+        metrics.reset('metrics-test')
+        self.assertEqual(metrics.get_stage_percentiles('metrics-test'), {})
+        self.assertEqual(metrics.get_stage_percentiles('metrics-test-other')['stage']['count'], 1)
+        metrics.reset('metrics-test-other')
+
+    # زمان‌هایی که پردازه فرزند جمع کرده در هیستوگرام پردازه اصلی ثبت می‌شوند.
+    def test_record_samples_merges_recorded_samples(self):
+        metrics.start_recording()
+        metrics.record('metrics-test', 'stage', 0.002)
+        samples = metrics.stop_recording()
+        self.assertEqual(samples, [('metrics-test', 'stage', 0.002)])
+        metrics.record_samples(samples + samples)
+        self.assertEqual(metrics.get_stage_percentiles('metrics-test')['stage']['count'], 3)
+
+    # مراحل نشانه‌ای در اصلاح موازی فقط در پردازه‌های فرزند اجرا می‌شوند.
+    def test_parallel_stage_times_reach_parent(self):
+        correction_normalizer = cache.normalizers['mohaverekhan-correction-normalizer']
+        metrics.reset(correction_normalizer.name)
+        correction_normalizer.normalize('سلام. خوبی؟ آرام کنندهخوبی.', parallel=True)
+        stage_percentiles = metrics.get_stage_percentiles(correction_normalizer.name)
+        stage_counts = {
+            stage_percentiles[stage_name]['count'] 
+                for stage_name, stage in correction_normalizer.get_token_stages()
+        }
+        # هر مرحله یک بار برای هر کدام از سه جمله
+        self.assertEqual(stage_counts, {3})
+
+def generate_tagged_sentences(generator, count):
+    words = [f'w{index}' for index in range(200)]
+    word_tags = {word: generator.choice('NVAJRO') for word in words}
+    return [
+        [(word, word_tags[word] if generator.random() < 0.8 else generator.choice('NVAJRO')) 
+            for word in generator.choices(words, k=generator.randint(1, 30))]
+                for _ in range(count)
+    ]
+
+class IndexedBrillTaggerTests(SimpleTestCase):
+
+    def test_output_equals_brill_tagger(self):
+        generator = random.Random(0)
+        tagged_sentences = generate_tagged_sentences(generator, 1200)
+        train_data, test_data = tagged_sentences[:1000], tagged_sentences[1000:]
+        initial_tagger = nltk.UnigramTagger(train_data[:200], backoff=nltk.DefaultTagger('N'))
+        brill_tagger = brill_trainer.BrillTaggerTrainer(
+            initial_tagger, brill.fntbl37(), deterministic=True).train(train_data, max_rules=100, min_score=2)
+        self.assertTrue(brill_tagger.rules())
+        indexed_tagger = IndexedBrillTagger(brill_tagger)
+        sentences = [[token for token, _ in tagged_sentence] for tagged_sentence in test_data] + [['unknown'], []]
+        for sentence in sentences:
+            self.assertEqual(brill_tagger.tag(sentence), indexed_tagger.tag(sentence))
+
+    def test_tag_sents_equals_brill_tagger(self):
+        generator = random.Random(1)
+        tagged_sentences = generate_tagged_sentences(generator, 1200)
+        train_data, test_data = tagged_sentences[:1000], tagged_sentences[1000:]
+        regexp_tagger = nltk.RegexpTagger([(r'^w1\d*$', 'J')], backoff=nltk.DefaultTagger('N'))
+        unigram_tagger = nltk.UnigramTagger(train_data[:200], backoff=regexp_tagger)
+        bigram_tagger = nltk.BigramTagger(train_data[:400], backoff=unigram_tagger)
+        trigram_tagger = nltk.TrigramTagger(train_data[:600], backoff=bigram_tagger)
+        brill_tagger = brill_trainer.BrillTaggerTrainer(
+            trigram_tagger, brill.fntbl37(), deterministic=True).train(train_data, max_rules=100, min_score=2)
+        indexed_tagger = IndexedBrillTagger(brill_tagger)
+        self.assertIsNotNone(indexed_tagger.ngram_tables)
+        sentences = [[token for token, _ in tagged_sentence] for tagged_sentence in test_data] + [['unknown'], []]
+        self.assertEqual(
+            [brill_tagger.tag(sentence) for sentence in sentences],
+            indexed_tagger.tag_sents(sentences, batch_size=64)
+        )
+
+class ParallelBrillTrainerTests(SimpleTestCase):
+
+    def test_rules_equal_brill_tagger_trainer(self):
+        generator = random.Random(2)
+        tagged_sentences = generate_tagged_sentences(generator, 600)
+        initial_tagger = nltk.UnigramTagger(tagged_sentences[:100], backoff=nltk.DefaultTagger('N'))
+        templates = brill.fntbl37()
+        brill_tagger = brill_trainer.BrillTaggerTrainer(
+            initial_tagger, templates, deterministic=True).train(tagged_sentences, max_rules=40, min_score=2)
+        self.assertTrue(brill_tagger.rules())
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = os.path.join(directory, 'brill_rules.pkl')
+            progress = []
+            ParallelBrillTrainer(initial_tagger, templates, n_jobs=2, checkpoint_path=checkpoint_path, fingerprint='test',
+                                 checkpoint_interval=5, progress_function=progress.append, progress_interval=0
+                                 ).train(tagged_sentences, max_rules=15, min_score=2)
+            self.assertEqual(progress[-1]['rules'], 15)
+            # آموزش از قاعده‌های ذخیره‌شده ادامه پیدا می‌کند.
+            parallel_brill_tagger = ParallelBrillTrainer(
+                initial_tagger, templates, n_jobs=3, checkpoint_path=checkpoint_path, fingerprint='test'
+            ).train(tagged_sentences, max_rules=40, min_score=2)
+        self.assertEqual(brill_tagger.rules(), parallel_brill_tagger.rules())
+        self.assertEqual(brill_tagger.train_stats('finalerrors'), parallel_brill_tagger.train_stats('finalerrors'))
+
 # class WordModelTestCase(TestCase):
 #     def setUp(self):
 #         self.word = Word(formal = 'نان', informal = 'نون')
@@ -0,0 +1,68 @@
+import time
+import threading
+
+
+###############################################################################
+# ردیابی مراحل نرمالایزرها و برچسب‌زن‌ها برای یک درخواست
+# به صورت پیش‌فرض خاموش است و در این حالت هیچ رشته‌ای ساخته نمی‌شود و چیزی روی دیسک نوشته نمی‌شود.
+# اگر برای درخواستی روشن شود، ورودی و خروجی هر مرحله و تصمیم‌های قاعده‌ها در یک Trace جمع می‌شوند و همراه پاسخ برگردانده می‌شوند.
+# هر نخ ردیابی خودش را دارد، پس برچسب‌زنی که نرمالایزر را صدا می‌زند، ردیابی آن را هم در همان Trace دارد.
+current = threading.local()
+
+class Trace:
+
+    def __init__(self):
+        self.beg_ts = time.time()
+        self.stages = []
+        self.decisions = []
+
+    def get_elapsed_ms(self):
+        return round((time.time() - self.beg_ts) * 1000, 3)
+
+    def add_stage(self, operator_name, stage_name, input_content, output_content):
+        self.stages.append({
+            'operator': operator_name,
+            'stage': stage_name,
+            'input': input_content,
+            'output': output_content,
+            'elapsed_ms': self.get_elapsed_ms(),
+        })
+
+    # subject ممکن است لیستی باشد که بعدا تغییر می‌کند، پس از آن کپی می‌گیریم.
+    def add_decision(self, operator_name, rule, subject, result=None):
+        if isinstance(subject, list):
+            subject = list(subject)
+        self.decisions.append({
+            'operator': operator_name,
+            'rule': rule,
+            'subject': subject,
+            'result': result,
+        })
+
+    # ردیابی‌هایی که پردازه‌های فرزند برگردانده‌اند را اضافه می‌کند.
+    def extend(self, trace_dict):
+        self.stages.extend(trace_dict['stages'])
+        self.decisions.extend(trace_dict['decisions'])
+
+    def to_dict(self):
+        return {
+            'elapsed_ms': self.get_elapsed_ms(),
+            'stages': self.stages,
+            'decisions': self.decisions,
+        }
+
+
+def get_trace():
+    return getattr(current, 'trace', None)
+
+# اگر در این نخ ردیابی در جریان باشد، همان را برمی‌گرداند و در غیر این صورت یک ردیابی جدید شروع می‌کند.
+# مقدار دوم نشان می‌دهد که این فراخوانی ردیابی را شروع کرده و باید آن را تمام کند.
+def start_trace():
+    trace = get_trace()
+    if trace is not None:
+        return trace, False
+    current.trace = Trace()
+    return current.trace, True
+
+def stop_trace():
+    current.trace = None
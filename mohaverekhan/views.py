@@ -34,12 +34,27 @@ from .models import (
 from django.views.decorators.csrf import csrf_exempt
 import threading 
 import json
-from . import cache
+from . import cache, metrics
 
 
 import logging
 logger = None
 
+def get_operator_options(request, operator_options):
+    options = {}
+    for option_name, option_type in operator_options.items():
+        value = request.GET.get(option_name, None)
+        if value is None:
+            continue
+        if option_type is bool:
+            options[option_name] = value.lower() in ('true', '1', 'yes')
+            continue
+        try:
+            options[option_name] = option_type(value)
+        except ValueError:
+            raise ParseError(detail=f"Error 400, invalid {option_name}", code=400)
+    return options
+
 class HomePageView(TemplateView):
     """
     This is home page
@@ -247,6 +262,16 @@ class NormalizerViewSet(viewsets.ModelViewSet):
         serializer = NormalizerSerializer(normalizer)
         return Response(serializer.data)
 
+    # صدک‌های زمان اجرای هر مرحله این نرمالایزر از زمان شروع پردازه یا آخرین reset
+    @action(detail=True, methods=['get',], url_name='metrics', url_path='metrics')
+    def stage_metrics(self, request, name=None):
+        normalizer = cache.normalizers.get(name, None)
+        if not normalizer:
+            raise NotFound(detail="Error 404, normalizer not found", code=404)
+        if get_operator_options(request, {'reset': bool}).get('reset', False):
+            metrics.reset(name)
+        return Response(metrics.get_stage_percentiles(name))
+
     @action(detail=True, methods=['get',], url_name='normalize')
     @csrf_exempt
     def normalize(self, request, name=None):
@@ -261,14 +286,23 @@ class NormalizerViewSet(viewsets.ModelViewSet):
         text = Text.objects.filter(id=text_id).first()
         if not text:
             raise NotFound(detail="Error 404, text not found", code=404)
-        text_normal_content = normalizer.normalize(text.content)
+        options = get_operator_options(request, normalizer.normalize_options)
+        try:
+            text_normal_content = normalizer.normalize(text.content, **options)
+        except ValueError as e:
+            raise ParseError(detail=f"Error 400, {e}", code=400)
         text_normal, created = TextNormal.objects.update_or_create(
             text=text, 
             normalizer=normalizer,
             defaults={'content': text_normal_content}
         )
         serializer = TextNormalSerializer(text_normal)
-        return Response(serializer.data)
+        data = serializer.data
+        normalize_details = normalizer.get_normalize_details()
+        if normalize_details:
+            data = dict(data)
+            data.update(normalize_details)
+        return Response(data)
 
 class TaggerViewSet(viewsets.ModelViewSet):
     queryset = Tagger.objects.all()
@@ -292,6 +326,16 @@ class TaggerViewSet(viewsets.ModelViewSet):
         serializer = TaggerSerializer(tagger)
         return Response(serializer.data)
 
+    # صدک‌های زمان اجرای هر مرحله این برچسب‌زن از زمان شروع پردازه یا آخرین reset
+    @action(detail=True, methods=['get',], url_name='metrics', url_path='metrics')
+    def stage_metrics(self, request, name=None):
+        tagger = cache.taggers.get(name, None)
+        if not tagger:
+            raise NotFound(detail="Error 404, tagger not found", code=404)
+        if get_operator_options(request, {'reset': bool}).get('reset', False):
+            metrics.reset(name)
+        return Response(metrics.get_stage_percentiles(name))
+
     @action(detail=True, methods=['get',], url_name='tag')
     @csrf_exempt
     def tag(self, request, name=None):
@@ -308,7 +352,8 @@ class TaggerViewSet(viewsets.ModelViewSet):
         if not text:
             raise NotFound(detail="Error 404, text not found", code=404)
 
-        text_tagged_tokens = tagger.tag(text.content)
+        options = get_operator_options(request, tagger.tag_options)
+        text_tagged_tokens = tagger.tag(text.content, **options)
 
         tagged_token_json = {}
         text_tagged_token_list = []
@@ -316,7 +361,6 @@ class TaggerViewSet(viewsets.ModelViewSet):
             tagged_token_json = {}
             tagged_token_json['token'] = tagged_token[0]
             tagged_token_json['tag'] = {'name': tagged_token[1]}
-            logger.info(f'tagged_token_json : {tagged_token_json}')
             text_tagged_token_list.append(tagged_token_json)
 
         text_tag, created = TextTag.objects.update_or_create(
@@ -324,9 +368,13 @@ class TaggerViewSet(viewsets.ModelViewSet):
             text=text,
             defaults={'tagged_tokens': text_tagged_token_list}
         )
-        logger.info(f'text tags : {text_tag.__unicode__()}')
         serializer = TextTagSerializer(text_tag)
-        return Response(serializer.data)
+        data = serializer.data
+        tag_details = tagger.get_tag_details()
+        if tag_details:
+            data = dict(data)
+            data.update(tag_details)
+        return Response(data)
 
 
 def init():
@@ -140,6 +140,10 @@ STATIC_URL = '/static/'
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_ROOT = os.path.join(PROJECT_DIR, 'static')
 
+# داده‌هایی که برنامه در حین اجرا می‌سازد، مثل اصلاح‌های ذخیره‌شده نرمالایزر اصلاح‌کننده
+DATA_DIR = os.environ.get('MOHAVEREKHAN_DATA_DIR', os.path.join(BASE_DIR, 'data'))
+MOHAVEREKHAN_CORRECTIONS_PATH = os.environ.get('MOHAVEREKHAN_CORRECTIONS_PATH', os.path.join(DATA_DIR, 'corrections.pkl'))
+
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': (
         'rest_framework.renderers.JSONRenderer',
@@ -227,6 +231,10 @@ now = datetime.datetime.now()
 PROJECT_PATH = os.path.abspath(os.path.dirname(__name__))
 # BASE_LOG_PATH = os.path.join(PROJECT_PATH, 'logs', now.date().__str__())
 BASE_LOG_PATH = os.path.join(r'/home/bitianist/bitianist', 'logs', now.date().__str__())
+# ساختن و نوشتن لاگ‌های DEBUG بخش زیادی از زمان هر درخواست را می‌گیرد.
+# برای بررسی یک درخواست، ردیابی آن را روشن کنید (?trace=true) یا سطح لاگ را با MOHAVEREKHAN_LOG_LEVEL تغییر دهید.
+LOG_LEVEL = os.environ.get('MOHAVEREKHAN_LOG_LEVEL', 'INFO')
+LOG_HANDLERS = ['console'] if DEBUG else []
 os.makedirs(BASE_LOG_PATH, exist_ok=True)
 
 LOGGING = {
@@ -240,13 +248,13 @@ LOGGING = {
     },
     'handlers': {
         'root': {
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'class': 'logging.FileHandler',
             'filename': os.path.join(BASE_LOG_PATH, 'root.log'),
             'formatter': 'main',
         },
         'mohaverekhan': {
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'class': 'logging.FileHandler',
             'filename': os.path.join(BASE_LOG_PATH, 'mohaverekhan.log'),
             'formatter': 'main',
@@ -258,18 +266,18 @@ LOGGING = {
     },
     'root': {
         'handlers': ['root'],
-        'level': 'DEBUG',
+        'level': LOG_LEVEL,
         'propagate': True,
     },
     'loggers': {
         '': {
-            'handlers': ['console', 'root'],
-            'level': 'DEBUG',
+            'handlers': LOG_HANDLERS + ['root'],
+            'level': LOG_LEVEL,
             'propagate': True,
         },
         'mohaverekhan': {
-            'handlers': ['console', 'mohaverekhan'],
-            'level': 'DEBUG',
+            'handlers': LOG_HANDLERS + ['mohaverekhan'],
+            'level': LOG_LEVEL,
             'propagate': False,
         },
     },